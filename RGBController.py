@@ -1,23 +1,22 @@
+import sys
+
+if __name__ == "__main__" and {'--apply', '--engine', '--stats', '--record', '--verify', '--save-pattern'} & set(sys.argv[1:]):
+    #headless modes (see rgbengine/cli.py), handled before any of the GUI modules below are imported
+    from rgbengine.cli import main as run_headless
+    sys.exit(run_headless(sys.argv[1:]))
+
 from tkinter import *
 from tkinter import ttk
 from tkinter import colorchooser
 
-import pystray
-from PIL import Image
-
 import subprocess
-import sys
 import os
 
-def resource_path(relative_path):
-    '''
-    A useful function for absolute paths for both release and debug versions, see below:
-    #https://stackoverflow.com/questions/7674790/bundling-data-files-with-pyinstaller-onefile
-    '''
-    base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
-    return os.path.join(base_path, relative_path)
+from rgbengine.cli import ENGINE_START_TIMEOUT, launch_engine, resource_path #one way of starting the engine, shared with --apply
+from rgbengine.control import EngineControl, EngineError
+from rgbengine.profiles import ProfileStore
 
-WINDOW_HEIGHT= 600
+WINDOW_HEIGHT= 680
 WINDOW_WIDTH = 550
 
 APPLICATION_NAME = "RGB Controller"
@@ -25,8 +24,14 @@ MAX_PROFILES = 10
 SUPPORTED_DEVICES = ['All', 'Keyboard', 'Mouse', 'Memory Module', 'Led Hub', 'Cooler', 'Headset'] #note that these correspond to the device_id numbers, e.x. keyboard = 01
 PATTERN_LIST = ['static', 'pulse', 'rainbowpulse', 'rainbowcycle', 'randomstrobe', 'fire']
 SPEED_VALUES = ['Slow', 'Medium', 'Fast']
-
-rgbProcesses = [] #contains all created subprocesses that are currently affecting rgb devices, note the current implementation only calls for one, server.exe, which spawns api subprocesses
+ENGINE_STOP_TIMEOUT = 2 #seconds to wait for the pattern engine to exit by itself before killing it
+STATS_REFRESH_MS = 1000 #how often the engine stats panel is refreshed, each refresh is one small request to the engine
+
+rgbProcesses = [] #contains all created subprocesses that are currently affecting rgb devices, note the current implementation only calls for one, the pattern engine, which spawns api subprocesses
+engine = EngineControl() #connection to the long-lived pattern engine (see rgbengine/server.py), which applies pattern changes without restarting
+latency_data = None #StringVar showing how long the last change took to reach the devices, created in init_gui
+stats_data = None #StringVar holding the engine stats panel's text, created in init_gui
+profile_store = ProfileStore() #every saved profile and the last loaded profile, read once and cached
 current_selected_pattern = 'static'
 current_selected_device = 'All'
 
@@ -40,10 +45,18 @@ class RGBController(Tk):
         self.protocol('WM_DELETE_WINDOW', self.minimize_to_tray) #instead of closing, goes to tray
         self.iconbitmap(resource_path("./resources/app.ico"))
         self.geometry(str(WINDOW_WIDTH) + "x" + str(WINDOW_HEIGHT))
+        self.tray_image = None #decoded the first time the window is minimized, then reused
     
     def minimize_to_tray(self):
+        #pystray and PIL are only needed once the window is hidden, so they are imported here rather than slowing down startup
+        import pystray
+        from PIL import Image
+
         self.withdraw()
-        image = Image.open(resource_path("./resources/app.png"))
+        if self.tray_image is None:
+            self.tray_image = Image.open(resource_path("./resources/app.png"))
+            self.tray_image.load()
+        image = self.tray_image
         menu = (pystray.MenuItem('Quit',  self.quit_window), 
                 pystray.MenuItem('Show',self.show_window)) #tray options
         icon = pystray.Icon("name", image, APPLICATION_NAME, menu)
@@ -81,14 +94,23 @@ for index, device in enumerate(device_patterns):
 
 def handle_rgb_processes():
     '''
-    This process properly closes the pattern-generating RGB subprocesses for each of our currently-supported APIs.
-    Sends a signal to each one, then wipes the processes list.
+    This process properly closes the pattern engine, which closes the API subprocesses for each of our currently-supported APIs.
+    Asks the engine to stop, kills it if it does not exit in time, then wipes the processes list.
     Note: this returns the rgb devices to whatever state they were in prior to opening the program, so any patterns set by default or by another program will turn back on.
     '''
     global rgbProcesses
+    if engine.connected() or engine.connect():
+        try:
+            engine.stop()
+        except EngineError:
+            pass
+
     if rgbProcesses:
         for process in rgbProcesses:
-            process.kill()
+            try:
+                process.wait(timeout=ENGINE_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
 
     rgbProcesses = [] # empty our processes as none are running anymore
 
@@ -101,77 +123,126 @@ def close_app(win):
     win.destroy()
     win.quit()
 
-def open_rgb_service(args):
+def start_rgb_engine():
     '''
-    Assuming RGBA values and pattern are valid, starts the pattern-creating subprocess for each API we support and adds it to our subprocess list.
-    Does nothing if supplied parameters are invalid.
-    Also terminates and removes the processes for any previous effect properly, so it does not conflict with our new effect.
+    Connects to the pattern engine, first starting it and adding it to our subprocess list if it isn't running yet.
+    The engine keeps running (and keeps its API subprocesses connected) across pattern changes, so this only launches it the first time.
     '''
-
     global rgbProcesses
-    
-    #close other effects so they don't conflict with our new one
-    handle_rgb_processes()
 
-    rgbProcesses.append(subprocess.Popen(resource_path("./rgbsyncserver/server.exe") + " " + " ".join(args),
-                                          stdout=subprocess.PIPE, shell=False, cwd=resource_path('./rgbsyncserver'),creationflags=subprocess.CREATE_NO_WINDOW))
+    if engine.connected() or engine.connect():
+        return
+
+    rgbProcesses.append(launch_engine(engine.port))
+    engine.connect(timeout=ENGINE_START_TIMEOUT)
 
     #https://github.com/pyinstaller/pyinstaller/wiki/Recipe-Multiprocessing this is why the pyinstaller --onefile option does not work. use the default configuration (--onedir) instead
 
+def send_engine_command(command, *args):
+    '''
+    Calls one of the engine's commands (starting the engine if needed) and shows how long the change took to reach the devices.
+    If the engine has gone away it is started again and the command retried once. Returns the engine's reply, or None if it failed.
+    '''
+    for attempt in range(2):
+        start_rgb_engine()
+        try:
+            reply = command(*args)
+        except EngineError:
+            if engine.connected(): #the engine is running but rejected the command, retrying won't help
+                return None
+            continue
+        if latency_data is not None:
+            latency_data.set("Last change reached your devices in " + str(round(reply['round_trip'] * 1000)) + " ms")
+        return reply
+    return None
+
+def open_rgb_service(args):
+    '''
+    Assuming RGBA values and pattern are valid, replaces every pattern the engine is displaying with the ones in args (a multiple of seven values per device).
+    The change is applied on the engine's next tick, without restarting the engine or the API subprocesses.
+    '''
+    send_engine_command(engine.load_profile, args, None, profile_store.patterns(set(args[6::7])))
+
+def update_rgb_device(args):
+    '''
+    Changes the pattern of the single device in args (device r g b a speed pattern), every other device keeps its current pattern.
+    '''
+    send_engine_command(engine.set_device_pattern, args, None, profile_store.patterns([args[6]]))
+
+def clear_rgb_device(device_id):
+    '''
+    Stops displaying a pattern on one device, which the engine turns off. Once no device has a pattern left the engine is closed, handing the devices back to their default patterns.
+    Device 0 ('All') stops every pattern, closing the engine straight away.
+    '''
+    if int(device_id) == 0:
+        handle_rgb_processes()
+        return
+    reply = send_engine_command(engine.clear_device, device_id)
+    if reply is None or reply['devices'] == 0:
+        handle_rgb_processes()
+
+def format_stats(stats):
+    '''
+    Turns the engine's stats reply into the few lines shown in the stats panel.
+    '''
+    def milliseconds(value):
+        return "-" if value is None else str(round(value, 2)) + " ms"
+    scheduler = stats['scheduler']
+    fanout = stats['fanout']
+    lines = ["Engine: " + str(stats['devices']) + " devices at " + (str(round(scheduler['effective_fps'], 1)) if scheduler['effective_fps'] else "-")
+             + " / " + str(scheduler['fps']) + " fps, " + str(scheduler['skipped']) + " ticks skipped, lateness p95 " + milliseconds(scheduler['lateness_p95']),
+             "Render p95 " + milliseconds(stats['render_time']['p95']) + ", send p95 " + milliseconds(stats['publish_time']['p95'])
+             + ", frames dropped " + str(fanout['frames_dropped']) + ", unchanged frames skipped " + str(fanout['frames_suppressed']),
+             "API connections " + str(len(stats['clients'])) + ", dropped " + str(fanout['disconnects']) + ", restarted " + str(stats['respawns'])]
+    discovery = stats.get('discovery')
+    if discovery is not None:
+        found = [backend['name'] for backend in discovery['backends'] if backend['present']]
+        missing = [backend['name'] + " (" + backend['detail'] + ")" for backend in discovery['backends'] if not backend['present']]
+        lines.append("Backends found: " + (", ".join(found) or "none") + (", not found: " + ", ".join(missing) if missing else "")
+                     + ", discovery took " + str(round(discovery['elapsed'] * 1000)) + " ms" + (" (cached)" if discovery['cached'] else ""))
+    for client in stats['clients']:
+        lines.append("    " + client['name'] + ": delivery p95 " + milliseconds(client['send_latency']['p95'])
+                     + ", max " + milliseconds(client['send_latency']['max']) + ", dropped " + str(client['frames_dropped']))
+    return "\n".join(lines)
+
+def refresh_stats(win):
+    '''
+    Updates the stats panel every STATS_REFRESH_MS, only while the window is showing and the engine is running (it never starts the engine).
+    '''
+    if win.winfo_viewable():
+        if engine.connected() or engine.connect():
+            try:
+                stats_data.set(format_stats(engine.stats()))
+            except EngineError:
+                stats_data.set("Engine stats unavailable")
+        else:
+            stats_data.set("Engine not running")
+    win.after(STATS_REFRESH_MS, refresh_stats, win)
+
 def save_profile(profile_id):
     '''
     Saves pattern data for all devices under profile_id.
-    Writes these settings to a file in the user's home directory -> /RGBController/rgbprofile_(profile_id)
+    Writes these settings to the profile store in the user's home directory -> /RGBController/profiles.json
     '''
-    home_path = os.path.expanduser("~")
-    path = home_path + "/RGBController"
-    #recursively create the directory structure if it can't be found
-    os.makedirs(path, exist_ok=True)
-
-    file = open(path + "/rgbprofile_" + str(profile_id), "w")
-    #now write out all the patterns for each device under this profile
-    for device in device_patterns:
-        if device.valid:
-            file.write(str(device.device_id) + " " +  device.r + " " + device.g + " " + device.b + " " + device.a + " " + device.speed + " " + device.pattern + "\n")
-    file.close()
+    profile_store.save_profile(profile_id, [[str(device.device_id), device.r, device.g, device.b, device.a, str(device.speed), device.pattern]
+                                            for device in device_patterns if device.valid])
 
 def load_profile(profile_id, device_data):
     '''
-    Loads pattern data for all devices under profile_id, and then starts up the rgb server to start displaying patterns.
-    Finds these settings from a file in the user's home directory -> /RGBController/rgbprofile_(profile_id)
-    Also changes the settings file in the user's home directory -> /RGBController/rgbprofile_settings to accomodate the user's new last loaded profile.
+    Loads pattern data for all devices under profile_id, and then sends them to the rgb engine to start displaying patterns.
+    Finds these settings in the profile store in the user's home directory -> /RGBController/profiles.json
+    Also records profile_id as the user's new last loaded profile in the store.
     Does not load profiles that do not exist.
-    Edits device_data to be equal to the device patterns found inside the profile file, and sets the active patterns to valid.
+    Edits device_data to be equal to the device patterns found inside the profile, and sets the active patterns to valid.
     '''
     global device_patterns
 
-    home_path = os.path.expanduser("~")
-    path = home_path + "/RGBController"
-    os.makedirs(path, exist_ok=True)
-
-    settings_path = path + "/rgbprofile_settings"
-    found_last_profile = False
-
     #start by setting the new last loaded profile for the user
-    if os.path.exists(settings_path):
-        with open(settings_path, "r") as file:
-            data = file.readlines()
-            for index in range(0, len(data)):
-                line_list = data[index].split()
-                if line_list[0] == 'last_loaded_profile': 
-                    data[index] = 'last_loaded_profile ' + str(profile_id)
-                    found_last_profile = True
-                    break
-        if found_last_profile:
-            with open(settings_path, 'w') as file:
-                file.writelines(data)
-    else:
-        with open(settings_path, "w") as file:
-            file.writelines('last_loaded_profile ' + str(profile_id))
-
-    #now load the device data from the profile file
-    profile_path = path + "/rgbprofile_" + str(profile_id)
-    if os.path.exists(profile_path):
+    profile_store.set_last_loaded_profile(profile_id)
+
+    #now load the device data from the profile
+    profile = profile_store.profile(profile_id)
+    if profile is not None:
 
         for stringvar in device_data:
             stringvar.set("Pattern: None selected yet")
@@ -179,90 +250,80 @@ def load_profile(profile_id, device_data):
         for devicepattern in device_patterns:
             devicepattern.setValid(False)
 
-        with open(profile_path, 'r') as file:
-            values = []
-            for line in file:
-                line_values = line.split()
-                device_num = int(line_values[0])
-                if line_values[1] == '0' and line_values[2] == '0' and line_values[3] == '0' and line_values[6] == 'static':
-                    device_data[device_num].set("Pattern: OFF")
-                else:
-                    device_data[device_num].set(
-                                                "Pattern: " + line_values[6]
-                                                + ", R = " + line_values[1]
-                                                + ", G = " + line_values[2]
-                                                + ", B = " + line_values[3]
-                                                + ", A = " + line_values[4]
-                                                + ", Speed = " + SPEED_VALUES[int(line_values[5])]
-                                                )
-                device_patterns[device_num].setValid(True)
-                device_patterns[device_num].r = line_values[1]
-                device_patterns[device_num].g = line_values[2]
-                device_patterns[device_num].b = line_values[3]
-                device_patterns[device_num].a = line_values[4]
-                device_patterns[device_num].speed = line_values[5]
-                device_patterns[device_num].pattern = line_values[6]
-
-                if line_values[0] == '0': #this is the 'All' identifier, so we just ignore any other patterns and apply this one to all devices
-                    values = line_values
-                    break
-                else:
-                    values.extend(line_values)
-            open_rgb_service(values)
+        values = []
+        for line_values in profile:
+            device_num = int(line_values[0])
+            if line_values[1] == '0' and line_values[2] == '0' and line_values[3] == '0' and line_values[6] == 'static':
+                device_data[device_num].set("Pattern: OFF")
+            else:
+                device_data[device_num].set(
+                                            "Pattern: " + line_values[6]
+                                            + ", R = " + line_values[1]
+                                            + ", G = " + line_values[2]
+                                            + ", B = " + line_values[3]
+                                            + ", A = " + line_values[4]
+                                            + ", Speed = " + SPEED_VALUES[int(line_values[5])]
+                                            )
+            device_patterns[device_num].setValid(True)
+            device_patterns[device_num].r = line_values[1]
+            device_patterns[device_num].g = line_values[2]
+            device_patterns[device_num].b = line_values[3]
+            device_patterns[device_num].a = line_values[4]
+            device_patterns[device_num].speed = line_values[5]
+            device_patterns[device_num].pattern = line_values[6]
+
+            if line_values[0] == '0': #this is the 'All' identifier, so we just ignore any other patterns and apply this one to all devices
+                values = line_values
+                break
+            else:
+                values.extend(line_values)
+        open_rgb_service(values)
 
 def read_profile(profile_id):
     '''
     Reads pattern data for all devices under profile_id, for displaying the settings within the GUI.
-    Finds these settings from a file in the user's home directory -> /RGBController/rgbprofile_(profile_id)
-    '''
-    home_path = os.path.expanduser("~")
-    path = home_path + "/RGBController"
-    profile_path = path + "/rgbprofile_" + str(profile_id)
-    if os.path.exists(profile_path):
-        with open(profile_path, 'r') as file:
-            values = []    
-            first_line = True
-            for line in file:
-                line_list = line.split()
-                if first_line:
-                    first_line = False
-                else:
-                    values.append("\n")
-                values.append("Device: " + SUPPORTED_DEVICES[int(line_list[0])])
-                if line_list[1] == '0' and line_list[2] == '0' and line_list[3] == '0' and line_list[6] == 'static':
-                    values.append(", Pattern = OFF")
-                else:
-                    values.append(", R = " + line_list[1])
-                    values.append(", G = " + line_list[2])
-                    values.append(", B = " + line_list[3])
-                    values.append(", A = " + line_list[4])
-                    values.append(", Speed = " + SPEED_VALUES[int(line_list[5])])
-                    values.append(", Pattern = " + line_list[6])
-                if line_list[0] == '0':
-                    break
-            return " ".join(values)
-        
+    Finds these settings in the profile store (cached in memory, so this does not reopen the file) -> /RGBController/profiles.json
+    '''
+    profile = profile_store.profile(profile_id)
+    if profile is not None:
+        values = []
+        first_line = True
+        for line_list in profile:
+            if first_line:
+                first_line = False
+            else:
+                values.append("\n")
+            values.append("Device: " + SUPPORTED_DEVICES[int(line_list[0])])
+            if line_list[1] == '0' and line_list[2] == '0' and line_list[3] == '0' and line_list[6] == 'static':
+                values.append(", Pattern = OFF")
+            else:
+                values.append(", R = " + line_list[1])
+                values.append(", G = " + line_list[2])
+                values.append(", B = " + line_list[3])
+                values.append(", A = " + line_list[4])
+                values.append(", Speed = " + SPEED_VALUES[int(line_list[5])])
+                values.append(", Pattern = " + line_list[6])
+            if line_list[0] == '0':
+                break
+        return " ".join(values)
+
 def load_profile_on_startup(profile_tabs, device_data):
     '''
-    Loads pattern data for all devices under the last loaded profile_id, if it exists within the settings file -> /RGBController/rgbprofile_settings
+    Loads pattern data for all devices under the last loaded profile_id, if one has been recorded in the profile store -> /RGBController/profiles.json
     '''
-    home_path = os.path.expanduser("~")
-    path = home_path + "/RGBController"
-    settings_path = path + "/rgbprofile_settings"
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r') as file:
-            for line in file:
-                line_list = line.split()
-                if line_list[0] == 'last_loaded_profile' and line_list[1] != '-1':
-                    profile_tabs.select(int(line_list[1]) - 1)
-                    load_profile(int(line_list[1]), device_data)
-                    return
+    profile_id = profile_store.last_loaded_profile()
+    if profile_id is not None:
+        if profile_id <= MAX_PROFILES: #profiles past the displayed tabs still load, there just isn't a tab to select
+            profile_tabs.select(profile_id - 1)
+        load_profile(profile_id, device_data)
 
 def init_gui(win):
     '''
     Initializes all widgets required for the GUI, with their functionality.
     '''
     global current_selected_pattern
+    global latency_data
+    global stats_data
 
     #title, colour selection instructions and picker
     msg = Message(win, width=WINDOW_WIDTH, text="Change Your RGB Here!", justify=CENTER)
@@ -365,7 +426,7 @@ def init_gui(win):
         if button['text'] == 'RGB OFF': #RGB being OFF just means a static black pattern with zero brightness
             current_selected_pattern = 'static'
             device_identifier = str(device_tabs.index(device_tabs.select()))
-            open_rgb_service([device_identifier, '0', '0', '0', '0', '0', 'static'])
+            update_rgb_device([device_identifier, '0', '0', '0', '0', '0', 'static'])
             device_data[device_tabs.index(device_tabs.select())].set("Pattern: OFF") 
             device_patterns[device_tabs.index(device_tabs.select())].r = '0'
             device_patterns[device_tabs.index(device_tabs.select())].g = '0'
@@ -378,7 +439,7 @@ def init_gui(win):
 
         current_selected_pattern = button['text']
         device_identifier = str(device_tabs.index(device_tabs.select()))
-        open_rgb_service([device_identifier, colours[0], colours[1], colours[2], str(w.get()), str(s.get()), button['text']])
+        update_rgb_device([device_identifier, colours[0], colours[1], colours[2], str(w.get()), str(s.get()), button['text']])
         device_data[device_tabs.index(device_tabs.select())].set("Pattern: " + button['text'] +
                                                                 ", R = " + colours[0] +
                                                                 ", G = " + colours[1] +
@@ -397,8 +458,8 @@ def init_gui(win):
     rgbOptionsFrame.pack()
     pattern_buttons = []
 
-    #now we render the pattern buttons
-    for pattern in PATTERN_LIST:
+    #now we render the pattern buttons, user defined patterns (saved with --save-pattern) after the built in ones
+    for pattern in PATTERN_LIST + sorted(profile_store.patterns()):
         patternButton = Button(master=rgbOptionsFrame, text=pattern)
         patternButton.configure(command=lambda button=patternButton: apply_effect_and_update(button))
         patternButton.pack(side='left', padx=5, pady=5)
@@ -412,11 +473,18 @@ def init_gui(win):
     rgbOFFButton.configure(command= lambda button=rgbOFFButton: apply_effect_and_update(button))
     rgbOFFButton.pack(side=LEFT, padx=5, pady=5)
 
-    #the RGB STOP button destroys all pattern displaying processes, returning devices to system defaults
-    rgbStopButton = Button(master=rgbFrame, text="No Pattern", command=lambda: (handle_rgb_processes(),
-                                                                                          device_data[device_tabs.index(device_tabs.select())].set("Pattern: None selected yet"),
-                                                                                          device_patterns[device_tabs.index(device_tabs.select())].setValid(False)
-                                                                                          ))
+    def stop_pattern():
+        '''
+        Function for the No Pattern button. Stops the selected device's pattern, or every device's on the 'All' tab, and marks them as having none.
+        '''
+        device_index = device_tabs.index(device_tabs.select())
+        clear_rgb_device(device_index)
+        for index in (range(len(SUPPORTED_DEVICES)) if device_index == 0 else [device_index]):
+            device_data[index].set("Pattern: None selected yet")
+            device_patterns[index].setValid(False)
+
+    #the RGB STOP button stops the selected device's pattern (every pattern on the All tab), once no patterns are left devices return to system defaults
+    rgbStopButton = Button(master=rgbFrame, text="No Pattern", command=stop_pattern)
     rgbStopButton.pack(side=RIGHT, padx=5, pady=5)
 
     #another grouping of tabs, this time for effect profiles
@@ -476,6 +544,17 @@ def init_gui(win):
     helpButton = Button(profilesFrame, text="Need Help?", command=open_help_window)
     helpButton.pack(side='left', padx=5, pady=5)
 
+    #shows how long the last pattern change took to reach the devices
+    latency_data = StringVar()
+    latency_label = Label(win, textvariable=latency_data, font=("times", 10))
+    latency_label.pack()
+
+    #live engine metrics, refreshed at a fixed rate so the panel costs next to nothing
+    stats_data = StringVar()
+    stats_label = Label(win, textvariable=stats_data, font=("times", 9), justify=LEFT)
+    stats_label.pack()
+    win.after(STATS_REFRESH_MS, refresh_stats, win)
+
     #finally, load the last loaded profile (if possible)
     load_profile_on_startup(profile_tabs, device_data)
 
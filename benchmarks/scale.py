@@ -0,0 +1,238 @@
+'''
+Scale test for the sync loop: one SyncServer streaming to many fake API clients, to find where it stops keeping up before it shows up as flicker.
+
+    python benchmarks/scale.py [--clients 10,100,300] [--devices 8] [--delay 0,0.0005] [--wire-format binary] [--fps 30] [--seconds 5]
+                               [--processes N] [--output results.json]
+
+Every combination of --clients and --delay is one run. The server runs in this process, with one device for each device a client drives (up to
+the wire format's device ids), all running a fast rainbowcycle so every device changes often. The fake clients connect to it like
+corsairAPIclient does, spread over --processes worker processes (this script again, with --worker), so their own work doesn't count as the
+server's CPU. Each fake client reads the stream, drives --devices of the devices, and spends --delay seconds on each update to one of them,
+as a vendor SDK call would, then notes how late the frame was.
+
+For each run, once the clients have connected and warmed up, the harness reports:
+
+    scale.tick_rate     ticks per second the server sustained, against --fps
+    scale.tick_time     the server's time per tick (mean and p95, ms)
+    scale.server_cpu    CPU time of the server process (all its threads) per second of wall time, in percent of one core
+    scale.client_lag    how long after a frame was encoded a client finished handling it (binary wire format only): the median client's
+                        mean, and the p95 and worst of any client
+    scale.send_latency  the server's time from queueing a frame for a client to it being sent, since the client connected: p95 of the
+                        slowest client, which rises as clients fall behind and the kernel's buffers fill
+    scale.dropped       frames the fan-out dropped for clients that fell more than its queue behind, per client per second, and the clients
+                        it disconnected for stalling
+    scale.client_updates  device updates each fake client handled per second, with the frames it received (ticks that changed nothing send none)
+
+Results are written in the same JSON format as suite.py, so two runs can be compared with suite.py --compare BASELINE --input RESULTS.
+'''
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from suite import metadata, result
+
+MAX_DEVICE_ID = {'legacy': 99, 'binary': 255} #legacy device ids are two ASCII digits
+WARMUP = 1 #seconds between the clients connecting and the measurement starting
+CONNECT_TIMEOUT = 30
+SLEEP_GRANULARITY = 0.001 #delays are added up and slept in steps of at least this, as shorter sleeps overshoot
+
+def client_devices(index, devices, max_device_id):
+    '''
+    The device ids fake client index drives, spread so every device of the server is driven by someone.
+    '''
+    return {(index * devices + device) % max_device_id + 1 for device in range(devices)}
+
+class FakeClient():
+    '''
+    One fake API client, run on its own thread in a worker process.
+    '''
+    def __init__(self, index, host, port, wire_format, devices, delay):
+        self.index = index
+        self.address = (host, port)
+        self.legacy = wire_format == 'legacy'
+        self.devices = client_devices(index, devices, MAX_DEVICE_ID[wire_format])
+        self.delay = delay
+        self.measuring = False
+        self.frames = 0
+        self.updates = 0
+        self.lags = []
+        self.sock = None
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+
+    def run(self):
+        from rgbengine.protocol import FrameDecoder, LEGACY_MESSAGE_SIZE, decode_message
+        decoder = FrameDecoder()
+        leftover = b''
+        owed = 0.0
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            if self.legacy:
+                data = leftover + data
+                usable = len(data) - len(data) % LEGACY_MESSAGE_SIZE
+                leftover = data[usable:]
+                updates = [decode_message(data[offset:offset + LEGACY_MESSAGE_SIZE])[0] for offset in range(0, usable, LEGACY_MESSAGE_SIZE)]
+                frames = [(None, updates)]
+            else:
+                frames = [(frame.timestamp, [int(device_id) for device_id in frame.device_ids]) for frame in decoder.feed(data)]
+            for timestamp, device_ids in frames:
+                mine = sum(1 for device_id in device_ids if device_id in self.devices or device_id == 0)
+                owed += mine * self.delay
+                if owed >= SLEEP_GRANULARITY:
+                    time.sleep(owed)
+                    owed = 0.0
+                if not self.measuring:
+                    continue
+                self.frames += 1
+                self.updates += mine
+                if timestamp is not None:
+                    self.lags.append((time.monotonic_ns() - timestamp) / 1e6)
+
+    def stats(self, seconds):
+        lags = sorted(self.lags)
+        return {'index': self.index, 'frames_per_second': self.frames / seconds, 'updates_per_second': self.updates / seconds,
+                'lag_mean': statistics.mean(lags) if lags else None,
+                'lag_p95': lags[min(len(lags) - 1, int(0.95 * len(lags)))] if lags else None, 'lag_max': lags[-1] if lags else None}
+
+def worker(args):
+    '''
+    Runs this worker's share of the fake clients: connects them all, says so on stdout, measures from the next line on stdin for args.seconds,
+    then prints every client's stats as one line of JSON.
+    '''
+    clients = [FakeClient(index, args.host, args.port, args.wire_format, args.devices_per_client, args.delay_per_update)
+               for index in range(args.first_client, args.first_client + args.client_count)]
+    for client in clients:
+        client.connect()
+    for client in clients:
+        threading.Thread(target=client.run, daemon=True).start()
+    print('connected', flush=True)
+    sys.stdin.readline()
+    for client in clients:
+        client.measuring = True
+    time.sleep(args.seconds)
+    for client in clients:
+        client.measuring = False
+    print(json.dumps([client.stats(args.seconds) for client in clients]), flush=True)
+    return 0
+
+def percentile(values, fraction):
+    values = sorted(value for value in values if value is not None)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+def run(clients, devices, delay, wire_format, fps, seconds, processes):
+    from rgbengine.metrics import Histogram
+    from rgbengine.server import SyncServer
+
+    engine_devices = min(clients * devices, MAX_DEVICE_ID[wire_format])
+    args = []
+    for device_id in range(1, engine_devices + 1):
+        args += [device_id, 255, 0, 0, 255, 2, 'rainbowcycle']
+    server = SyncServer(port=0, control_port=0, wire_format=wire_format, fps=fps, transition=0).start()
+    workers = []
+    try:
+        server.submit({'command': 'load-profile', 'args': args, 'transition': 0})
+        processes = max(1, min(processes, clients))
+        for worker_index in range(processes):
+            first, last = clients * worker_index // processes, clients * (worker_index + 1) // processes
+            workers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', '--port', str(server.port),
+                                             '--wire-format', wire_format, '--first-client', str(first), '--client-count', str(last - first),
+                                             '--devices-per-client', str(devices), '--delay-per-update', str(delay), '--seconds', str(seconds)],
+                                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True))
+        for process in workers:
+            if process.stdout.readline().strip() != 'connected':
+                raise RuntimeError("a worker could not connect its clients")
+        time.sleep(WARMUP)
+
+        #the measurement window: a fresh tick histogram and counters on the server, and the workers told to start counting
+        server.tick_time = Histogram()
+        fanout = server.fanout.stats()
+        sequence, cpu, start = server.sequence, time.process_time(), time.monotonic()
+        for process in workers:
+            process.stdin.write('start\n')
+            process.stdin.flush()
+        client_stats = []
+        for process in workers:
+            client_stats += json.loads(process.stdout.readline())
+        elapsed = time.monotonic() - start
+        ticks, cpu = server.sequence - sequence, time.process_time() - cpu
+        tick_time = server.tick_time.summary()
+        after = server.fanout.stats()
+    finally:
+        for process in workers:
+            process.kill()
+        server.stop()
+
+    params = {'clients': clients, 'devices_per_client': devices, 'engine_devices': engine_devices, 'delay_ms': delay * 1000,
+              'wire_format': wire_format, 'fps': fps}
+    results = [
+        result('scale.tick_rate', params, ticks / elapsed, 'ticks/s', True),
+        result('scale.tick_time', params, tick_time['mean'], 'ms', False, p95=tick_time['p95']),
+        result('scale.server_cpu', params, cpu / elapsed * 100, '%', False),
+        result('scale.send_latency', params, max((client['send_latency']['p95'] or 0) for client in after['clients']) if after['clients'] else None,
+               'ms', False),
+        result('scale.dropped', params, (after['frames_dropped'] - fanout['frames_dropped']) / elapsed / clients, 'frames/s', False,
+               disconnects=after['disconnects'] - fanout['disconnects']),
+        result('scale.client_updates', params, statistics.mean(client['updates_per_second'] for client in client_stats), 'updates/s', True,
+               frames_per_second=statistics.mean(client['frames_per_second'] for client in client_stats)),
+    ]
+    if wire_format != 'legacy':
+        results.append(result('scale.client_lag', params, statistics.median(client['lag_mean'] for client in client_stats if client['lag_mean'] is not None),
+                              'ms', False, p95=percentile([client['lag_p95'] for client in client_stats], 0.95),
+                              max=max(client['lag_max'] for client in client_stats if client['lag_max'] is not None)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', default='10,100,300', help="comma separated numbers of fake clients, one run each")
+    parser.add_argument('--devices', type=int, default=8, help="devices each fake client drives")
+    parser.add_argument('--delay', default='0,0.0005', help="comma separated seconds each client spends per device update, one run each")
+    parser.add_argument('--wire-format', default='binary', choices=sorted(MAX_DEVICE_ID))
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--seconds', type=float, default=5, help="length of each measurement")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help="worker processes to spread the fake clients over")
+    parser.add_argument('--output', help="write the JSON results here instead of to stdout")
+    #worker mode, used by the harness itself
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--host', default='127.0.0.1', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--first-client', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--client-count', type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument('--devices-per-client', type=int, default=8, help=argparse.SUPPRESS)
+    parser.add_argument('--delay-per-update', type=float, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    results = []
+    for clients in [int(value) for value in args.clients.split(',')]:
+        for delay in [float(value) for value in args.delay.split(',')]:
+            print("running " + str(clients) + " clients with " + str(delay * 1000) + "ms per update", file=sys.stderr)
+            results += run(clients, args.devices, delay, args.wire_format, args.fps, args.seconds, args.processes)
+    output = json.dumps({'metadata': dict(metadata(), benchmark='scale'), 'results': results}, indent=1)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+'''
+Measures how long it takes to get a saved profile onto the LEDs from a cold process start, through the GUI and through the headless --apply mode.
+
+    python benchmarks/startup.py [--runs 10]
+
+A pattern engine (with no API clients) is started on free ports with a throwaway profile directory, then each path is timed as a fresh subprocess:
+
+    headless  RGBController.py --apply, which exits once the engine has the profile
+    gui       imports RGBController.py as the GUI does, builds the window with init_gui (which loads the last profile) and exits once it is drawn.
+              Without a display only the imports can be timed, which is reported as 'gui-imports' and leaves out the window and the engine round trip
+'''
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rgbengine.profiles import ProfileStore
+
+PROFILE = [['1', '255', '0', '0', '255', '1', 'pulse'], ['2', '0', '0', '255', '255', '2', 'rainbowcycle']]
+
+def gui_child(profiles, control_port):
+    '''
+    Run in the measured subprocess: the GUI's startup, pointed at the benchmark's engine and profiles.
+    '''
+    sys.argv = [os.path.join(ROOT, 'RGBController.py')]
+    import RGBController
+    from rgbengine.control import EngineControl
+    RGBController.engine = EngineControl(port=control_port)
+    RGBController.profile_store = ProfileStore(profiles)
+    try:
+        win = RGBController.RGBController()
+    except Exception as error: #no display (or no .ico support), the imports are all we can measure
+        print('gui-imports')
+        return
+    RGBController.init_gui(win)
+    win.update()
+    win.destroy()
+    print('gui')
+
+def measure(command, environment):
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(" ".join(command) + " failed:\n" + result.stderr)
+    return elapsed, result.stdout.strip()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--gui-child', nargs=2, metavar=('PROFILES', 'CONTROL_PORT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.gui_child:
+        gui_child(args.gui_child[0], int(args.gui_child[1]))
+        return
+
+    from rgbengine.server import SyncServer #not imported at the top, so the gui child doesn't pay for numpy
+
+    with tempfile.TemporaryDirectory() as profiles:
+        store = ProfileStore(profiles)
+        store.save_profile(1, PROFILE)
+        store.set_last_loaded_profile(1)
+        server = SyncServer(port=0, control_port=0).start()
+        environment = dict(os.environ, PYTHONDONTWRITEBYTECODE='')
+        try:
+            paths = {
+                'headless': [sys.executable, os.path.join(ROOT, 'RGBController.py'), '--apply', '--profiles', profiles,
+                             '--control-port', str(server.control_port)],
+                'gui': [sys.executable, os.path.abspath(__file__), '--gui-child', profiles, str(server.control_port)],
+            }
+            measure(paths['headless'], environment) #warms the file cache and writes any .pyc files, so every path starts equally warm
+            for name, command in paths.items():
+                times = []
+                for run in range(args.runs):
+                    elapsed, output = measure(command, environment)
+                    times.append(elapsed * 1000)
+                if name == 'gui':
+                    name = output
+                print('%-12s runs %3d   min %7.1f ms   median %7.1f ms   max %7.1f ms'
+                      % (name, len(times), min(times), statistics.median(times), max(times)))
+        finally:
+            server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+'''
+Benchmark suite for the Python side of the pipeline. Runs on any platform with no vendor software, the API clients being replaced by LoopbackClients.
+
+    python benchmarks/suite.py [--quick] [--only patterns,protocol,profiles,leds,latency,transport,razer] [--output results.json]
+    python benchmarks/suite.py --compare baseline.json [--threshold 10]
+
+Every result is one entry of a flat JSON list, identified by its name and params, so the output of two commits can be compared entry by entry:
+
+    {"name": "patterns.ticks", "params": {"pattern": "fire", "devices": 64, "cached": true}, "value": 12345.6, "unit": "ticks/s", "higher_is_better": true}
+
+The groups are:
+
+    patterns   ticks per second of PatternEngine.step() plus frame() for every pattern, at several device counts, with and without the cycle cache
+    protocol   encode and decode throughput of the legacy 14 byte messages and of binary frames, and FrameDecoder on a stream of frames
+    profiles   ProfileStore save latency, cold load latency (a new store reading profiles.json) and cached lookups, for small and large stores
+    leds       frames per second of LedRenderer.frame() (rendering every LED straight into an LED frame) for each spatial pattern on a keyboard,
+               and for every supported device at once
+    latency    end to end time from a set-device-pattern command to a loopback client seeing the new colour, for both wire formats
+    transport  the client port against the shared memory frame ring (see framering.py), with 1 and 4 stand-in consumer processes reading full
+               frames of 64 devices: frames per second and latency seen by each consumer, their CPU time, and the server's publishing time
+    razer      the Razer bridge (see razer.py) against razerAPIclient's request pattern, both driving a mock Chroma SDK (see chromamock.py) that
+               answers straight away or after 10ms: requests and connections per second, colour changes shown per second, and how long a
+               static colour set after a second of a moving pattern takes to show
+
+--compare runs the suite (or reads --input) and prints the change against a baseline file. It exits with status 1 if anything got slower by more than
+--threshold percent, so it can gate a commit.
+'''
+
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from rgbengine.control import EngineControl
+from rgbengine.chromamock import MockChromaServer
+from rgbengine.cycles import CycleCache
+from rgbengine.discovery import LOCAL_OPENER
+from rgbengine.leds import LedRenderer, SPATIAL_PATTERNS
+from rgbengine.loopback import LoopbackClient
+from rgbengine.patterns import PatternEngine, PATTERN_LIST
+from rgbengine.profiles import ProfileStore
+from rgbengine.protocol import FrameDecoder, LEGACY_MESSAGE_SIZE, decode_frame, decode_message, encode_frame, encode_message
+from rgbengine.razer import APP_INFO, DEVICE_MAP, RazerBridge, bgr
+from rgbengine.server import SyncServer
+
+GROUPS = ('patterns', 'protocol', 'profiles', 'leds', 'latency', 'transport', 'razer')
+DEVICE_COUNTS = (1, 16, 64, 250) #device ids are one byte on the wire
+QUICK_DEVICE_COUNTS = (1, 64)
+MIN_TIME = 0.2 #seconds each measurement runs for
+REPEATS = 5 #measurements per benchmark, the best one is reported
+LATENCY_SAMPLES = 50
+QUICK_LATENCY_SAMPLES = 10
+TRANSPORTS = ('socket', 'shared_memory')
+TRANSPORT_CONSUMERS = (1, 4)
+TRANSPORT_FPS = 200
+TRANSPORT_DEVICES = 64
+TRANSPORT_SECONDS = 2
+QUICK_TRANSPORT_SECONDS = 0.5
+RAZER_DELAYS = (0, 0.01)
+RAZER_PROFILES = {
+    'all_rainbowcycle': [0, 255, 0, 0, 255, 2, 'rainbowcycle'],
+    'pulse': [1, 255, 0, 0, 255, 2, 'pulse', 2, 0, 255, 0, 255, 2, 'pulse', 6, 0, 0, 255, 255, 2, 'pulse'],
+}
+RAZER_SECONDS = 2
+QUICK_RAZER_SECONDS = 0.5
+RAZER_LAG_TIMEOUT = 10
+
+def measure_rate(function, min_time=MIN_TIME, repeats=REPEATS):
+    '''
+    Calls function() repeatedly for min_time seconds, repeats times over, and returns the best calls per second.
+    The best run is the one least disturbed by the rest of the machine, which makes it the most repeatable between commits.
+    '''
+    rates = []
+    for repeat in range(repeats):
+        calls = 0
+        start = time.perf_counter()
+        deadline = start + min_time
+        while True:
+            function()
+            calls += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+        rates.append(calls / (now - start))
+    return max(rates)
+
+def result(name, params, value, unit, higher_is_better, **extra):
+    entry = {'name': name, 'params': params, 'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+    entry.update(extra)
+    return entry
+
+def device_args(pattern, devices):
+    '''
+    server.exe style arguments for devices devices all running pattern ('mixed' cycles through every pattern),
+    with different colours and speeds so they don't move in lockstep.
+    '''
+    args = []
+    for index in range(devices):
+        device_pattern = PATTERN_LIST[index % len(PATTERN_LIST)] if pattern == 'mixed' else pattern
+        args += [index + 1, (index * 37) % 256, (index * 91) % 256, (index * 13) % 256, 255, index % 3, device_pattern]
+    return args
+
+def bench_patterns(device_counts, min_time):
+    results = []
+    for pattern in PATTERN_LIST + ['mixed']:
+        for devices in device_counts:
+            args = device_args(pattern, devices)
+            for cached in (False, True):
+                engine = PatternEngine(args, cycle_cache=CycleCache() if cached else None)
+                out = np.empty((len(engine), 4), dtype=np.uint8)
+                def tick():
+                    engine.step(0.05)
+                    engine.frame(out=out)
+                rate = measure_rate(tick, min_time)
+                results.append(result('patterns.ticks', {'pattern': pattern, 'devices': devices, 'cached': cached}, rate, 'ticks/s', True,
+                                      device_updates_per_second=rate * devices))
+    return results
+
+def bench_protocol(device_counts, min_time):
+    results = []
+    rng = np.random.default_rng(0)
+    for devices in device_counts:
+        device_ids = np.arange(1, devices + 1, dtype=np.uint8)
+        colours = rng.integers(0, 256, size=(devices, 4), dtype=np.uint8)
+
+        if devices < 100: #legacy device ids are two ASCII digits
+            rows = [(int(device_id), *map(int, colour)) for device_id, colour in zip(device_ids, colours)]
+            messages = b''.join(encode_message(*row) for row in rows)
+            size = len(messages)
+            def legacy_encode():
+                b''.join(encode_message(*row) for row in rows)
+            def legacy_decode():
+                for offset in range(0, size, 14):
+                    decode_message(messages[offset:offset + 14])
+            for name, function in (('protocol.legacy_encode', legacy_encode), ('protocol.legacy_decode', legacy_decode)):
+                rate = measure_rate(function, min_time)
+                results.append(result(name, {'devices': devices}, rate, 'frames/s', True, megabytes_per_second=rate * size / 1e6))
+
+        frame = encode_frame(device_ids, colours, 1)
+        def binary_encode():
+            encode_frame(device_ids, colours, 1)
+        def binary_decode():
+            decode_frame(frame[4:])
+        for name, function in (('protocol.binary_encode', binary_encode), ('protocol.binary_decode', binary_decode)):
+            rate = measure_rate(function, min_time)
+            results.append(result(name, {'devices': devices}, rate, 'frames/s', True, megabytes_per_second=rate * len(frame) / 1e6))
+
+        #a second of 20 fps frames arriving as one chunk, as a client that fell behind would read them
+        stream = frame * 20
+        def stream_decode():
+            decoder = FrameDecoder()
+            decoder.feed(stream)
+        rate = measure_rate(stream_decode, min_time) * 20
+        results.append(result('protocol.binary_stream_decode', {'devices': devices}, rate, 'frames/s', True,
+                              megabytes_per_second=rate * len(frame) / 1e6))
+    return results
+
+def bench_profiles(min_time, quick):
+    results = []
+    profile = [[str(device), '255', '0', '0', '255', '1', 'pulse'] for device in range(1, 7)]
+    for profiles in ((10,) if quick else (10, 1000)):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ProfileStore(directory)
+            for profile_id in range(1, profiles + 1):
+                store.save_profile(profile_id, profile)
+
+            def save():
+                store.save_profile(1, profile)
+            def cold_load():
+                ProfileStore(directory).profile(1)
+            def cached_load():
+                store.profile(1)
+            for name, function in (('profiles.save', save), ('profiles.cold_load', cold_load), ('profiles.cached_load', cached_load)):
+                rate = measure_rate(function, min_time, repeats=3)
+                results.append(result(name, {'profiles': profiles}, 1000 / rate, 'ms', False))
+    return results
+
+def bench_leds(min_time):
+    results = []
+    cases = [(pattern, [1, 255, 64, 0, 255, 2, pattern]) for pattern in SPATIAL_PATTERNS + ['pulse']]
+    cases.append(('mixed', [1, 255, 64, 0, 255, 2, 'wave', 2, 0, 0, 255, 255, 1, 'pulse', 3, 255, 255, 255, 255, 0, 'gradient',
+                            4, 0, 255, 0, 255, 2, 'ripple', 5, 255, 0, 255, 255, 1, 'rainbowcycle', 6, 0, 255, 255, 255, 0, 'fire']))
+    for name, args in cases:
+        engine = PatternEngine(args, cycle_cache=CycleCache())
+        renderer = LedRenderer(engine)
+        sequence = [0]
+        def frame():
+            engine.step(1 / 30)
+            renderer.frame(sequence[0])
+            sequence[0] += 1
+        rate = measure_rate(frame, min_time)
+        leds = renderer.writer.leds
+        results.append(result('leds.frames', {'pattern': name, 'leds': leds}, rate, 'frames/s', True, leds_per_second=rate * leds))
+    return results
+
+def bench_latency(samples):
+    '''
+    Changes one device's colour through the control socket and times how long it takes to arrive at a loopback client,
+    covering the wait for the next tick, rendering, encoding, the fan-out and decoding.
+    Each change is sent at a random point between ticks (from a fixed seed), as a click would be, since a reply always arrives just after a tick.
+    '''
+    results = []
+    rng = np.random.default_rng(0)
+    for wire_format in ('legacy', 'binary'):
+        server = SyncServer(port=0, control_port=0, wire_format=wire_format, transition=0).start()
+        try:
+            with LoopbackClient(port=server.port, legacy=wire_format == 'legacy') as client:
+                control = EngineControl(port=server.control_port)
+                control.connect(timeout=5)
+                control.load_profile(device_args('static', 4))
+                times = []
+                for sample in range(samples):
+                    colour = (sample % 256, 255 - sample % 256, 7, 255)
+                    time.sleep(rng.random() * server.scheduler.period)
+                    start = time.perf_counter()
+                    control.set_device_pattern([2, colour[0], colour[1], colour[2], colour[3], 0, 'static'])
+                    if not client.wait_for_colour(2, colour):
+                        raise RuntimeError("the loopback client never received the change")
+                    times.append((time.perf_counter() - start) * 1000)
+                control.close()
+        finally:
+            server.stop()
+        times.sort()
+        params = {'wire_format': wire_format, 'fps': server.scheduler.fps}
+        results.append(result('latency.pattern_change', params, statistics.median(times), 'ms', False,
+                              p95=times[min(len(times) - 1, int(0.95 * len(times)))], max=times[-1], samples=len(times)))
+    return results
+
+def bench_transport(seconds):
+    '''
+    Runs a server sending every device on every tick, and times stand-in consumers (python -m rgbengine.loopback) in their own processes
+    reading it through each transport. Consumers start together and each measures for seconds.
+    '''
+    results = []
+    for transport in TRANSPORTS:
+        for consumers in TRANSPORT_CONSUMERS:
+            ring = 'rgbbench-' + str(os.getpid()) if transport == 'shared_memory' else None
+            server = SyncServer(port=0, control_port=0, wire_format='binary', fps=TRANSPORT_FPS, keyframe_interval=1, shared_frames=ring).start()
+            try:
+                server.submit({'command': 'load-profile', 'args': device_args('rainbowcycle', TRANSPORT_DEVICES), 'transition': 0})
+                source = ['--ring', ring] if ring else ['--port', str(server.port)]
+                processes = [subprocess.Popen([sys.executable, '-m', 'rgbengine.loopback', '--seconds', str(seconds)] + source,
+                                              cwd=ROOT, stdout=subprocess.PIPE, text=True) for consumer in range(consumers)]
+                stats = [json.loads(process.communicate()[0]) for process in processes]
+                publish_time = server.publish_time.summary()['mean']
+            finally:
+                server.stop()
+            params = {'transport': transport, 'consumers': consumers, 'devices': TRANSPORT_DEVICES, 'fps': TRANSPORT_FPS}
+            results.append(result('transport.frames', params, statistics.mean(entry['frame_rate'] for entry in stats), 'frames/s', True,
+                                  skipped=sum(entry.get('skipped', 0) for entry in stats)))
+            results.append(result('transport.latency', params, statistics.mean(entry['mean_latency'] * 1000 for entry in stats), 'ms', False,
+                                  p95=max(entry['p95_latency'] * 1000 for entry in stats)))
+            results.append(result('transport.consumer_cpu', params,
+                                  statistics.mean(entry['cpu_time'] * 1000 / entry['elapsed'] for entry in stats), 'ms/s', False))
+            results.append(result('transport.publish_time', params, publish_time, 'ms', False))
+    return results
+
+class RazerClientEmulation():
+    '''
+    razerAPIclient's requests, for comparison with the bridge: every legacy message is turned into creating, applying and deleting an effect
+    for its device (every device for 'All') followed by a heartbeat, each request over a new connection. Started by a SyncServer like a bridge.
+    '''
+    def __init__(self, host, port, legacy, url):
+        self.address = (host, port)
+        self.url = url
+        self.uri = None
+        self.sock = None
+        self.thread = None
+
+    def _request(self, method, url, body):
+        request = urllib.request.Request(url, data=json.dumps(body).encode(), method=method, headers={'Content-Type': 'application/json'})
+        with LOCAL_OPENER.open(request, timeout=5) as response:
+            return json.loads(response.read())
+
+    def start(self):
+        self.uri = self._request('POST', self.url, APP_INFO)['uri']
+        self.sock = socket.create_connection(self.address)
+        self.thread = threading.Thread(target=self._run, name='razer-emulation', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        buffer = b''
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except OSError:
+                break
+            if not data:
+                break
+            buffer += data
+            while len(buffer) >= LEGACY_MESSAGE_SIZE:
+                device_id, r, g, b, a = decode_message(buffer[:LEGACY_MESSAGE_SIZE])
+                buffer = buffer[LEGACY_MESSAGE_SIZE:]
+                devices = list(DEVICE_MAP.values()) if device_id == 0 else [DEVICE_MAP[device_id]] if device_id in DEVICE_MAP else []
+                if not devices:
+                    continue
+                effect = {'effect': 'CHROMA_STATIC', 'param': {'color': bgr(r, g, b)}}
+                ids = [self._request('POST', self.uri + '/' + device, effect)['id'] for device in devices]
+                body = {'id': ids[0]} if len(ids) == 1 else {'ids': ids}
+                self._request('PUT', self.uri + '/effect', body)
+                self._request('DELETE', self.uri + '/effect', body)
+                self._request('PUT', self.uri + '/heartbeat', {'tick': 1})
+
+    def stop(self):
+        self.sock.close()
+        self.thread.join(timeout=1)
+
+    def stats(self):
+        return {}
+
+def bench_razer(seconds):
+    '''
+    Runs each Razer client against a mock Chroma SDK on a legacy server at the default fps, playing each profile for seconds,
+    then sets every device to a static colour and times how long the mock takes to show it.
+    '''
+    results = []
+    for client in ('bridge', 'razerAPIclient'):
+        for profile, args in RAZER_PROFILES.items():
+            for delay in RAZER_DELAYS:
+                with MockChromaServer(delay=delay) as mock:
+                    if client == 'bridge':
+                        factory = lambda host, port, legacy: RazerBridge(host, port, legacy, url=mock.url)
+                    else:
+                        factory = lambda host, port, legacy: RazerClientEmulation(host, port, legacy, url=mock.url)
+                    server = SyncServer(port=0, control_port=0, transition=0, bridges=[factory]).start()
+                    try:
+                        control = EngineControl(port=server.control_port)
+                        control.connect(timeout=5)
+                        start = mock.stats()
+                        control.load_profile(args)
+                        time.sleep(seconds)
+                        end = mock.stats()
+                        changed = time.perf_counter()
+                        control.load_profile([0, 1, 2, 3, 255, 0, 'static'])
+                        shown = all(mock.wait_for_colour(device, bgr(1, 2, 3), RAZER_LAG_TIMEOUT) for device in DEVICE_MAP.values())
+                        lag = (time.perf_counter() - changed) * 1000
+                        control.close()
+                    finally:
+                        server.stop()
+                params = {'client': client, 'profile': profile, 'delay_ms': delay * 1000}
+                results.append(result('razer.requests', params, (end['total_requests'] - start['total_requests']) / seconds, 'requests/s', False,
+                                      connections_per_second=(end['connections'] - start['connections']) / seconds))
+                results.append(result('razer.changes', params, (end['changes'] - start['changes']) / seconds, 'changes/s', True))
+                results.append(result('razer.lag', params, lag, 'ms', False, timed_out=not shown))
+    return results
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit or None, 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count()}
+
+def run(groups, quick):
+    min_time = MIN_TIME / 4 if quick else MIN_TIME
+    device_counts = QUICK_DEVICE_COUNTS if quick else DEVICE_COUNTS
+    results = []
+    for group in groups:
+        print("running " + group + " benchmarks", file=sys.stderr)
+        if group == 'patterns':
+            results += bench_patterns(device_counts, min_time)
+        elif group == 'protocol':
+            results += bench_protocol(device_counts, min_time)
+        elif group == 'profiles':
+            results += bench_profiles(min_time, quick)
+        elif group == 'leds':
+            results += bench_leds(min_time)
+        elif group == 'latency':
+            results += bench_latency(QUICK_LATENCY_SAMPLES if quick else LATENCY_SAMPLES)
+        elif group == 'transport':
+            results += bench_transport(QUICK_TRANSPORT_SECONDS if quick else TRANSPORT_SECONDS)
+        elif group == 'razer':
+            results += bench_razer(QUICK_RAZER_SECONDS if quick else RAZER_SECONDS)
+    return {'metadata': dict(metadata(), quick=quick), 'results': results}
+
+def result_key(entry):
+    return entry['name'] + ' ' + json.dumps(entry['params'], sort_keys=True)
+
+def compare(baseline, current, threshold):
+    '''
+    Prints every result that is in both runs with its change, and returns the keys that got worse by more than threshold percent.
+    '''
+    previous = {result_key(entry): entry for entry in baseline['results']}
+    regressions = []
+    for entry in current['results']:
+        key = result_key(entry)
+        if key not in previous or not previous[key]['value']:
+            continue
+        change = (entry['value'] - previous[key]['value']) / previous[key]['value'] * 100
+        worse = -change if entry['higher_is_better'] else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print('%-80s %12.4g -> %12.4g %-8s %+7.1f%%%s' % (key, previous[key]['value'], entry['value'], entry['unit'], change, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', default=','.join(GROUPS), help="comma separated groups to run (default: all)")
+    parser.add_argument('--quick', action='store_true', help="fewer device counts and shorter measurements")
+    parser.add_argument('--output', help="write the JSON results here instead of to stdout")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare against a previous results file")
+    parser.add_argument('--input', help="with --compare, the results to compare instead of running the suite")
+    parser.add_argument('--threshold', type=float, default=10, help="percent change counted as a regression by --compare")
+    args = parser.parse_args()
+
+    groups = [group for group in args.only.split(',') if group]
+    for group in groups:
+        if group not in GROUPS:
+            parser.error("unknown group " + group + ", choose from " + ", ".join(GROUPS))
+
+    if args.input:
+        with open(args.input) as file:
+            current = json.load(file)
+    else:
+        current = run(groups, args.quick)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(current, file, indent=1)
+    elif not args.compare:
+        json.dump(current, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(baseline, current, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+'''
+Python side of the RGB syncing pipeline: the pattern engine and the pieces that move its frames to the API clients.
+Nothing in here imports tkinter, so it can be used (and profiled) headless on any platform.
+'''
+
+def __getattr__(name):
+    #imported on first use, so the control and profile modules (all the headless --apply mode needs) load without numpy
+    if name in ('PatternEngine', 'PATTERN_LIST'):
+        from rgbengine import patterns
+        return getattr(patterns, name)
+    raise AttributeError("module 'rgbengine' has no attribute " + repr(name))
@@ -0,0 +1,189 @@
+'''
+Stand-in for the Razer Chroma SDK's REST server, so the Razer bridge (and razerAPIclient's request pattern) can be tested and benchmarked
+without Synapse or any Razer device. It implements the part of the API the RGB Controller uses:
+
+    GET    /razer/chromasdk                    SDK version and supported devices (what discovery.py probes)
+    POST   /razer/chromasdk                    start a session, returns {"sessionid": ..., "uri": ".../sid=N/chromasdk"}
+    DELETE <uri>                               end the session
+    PUT    <uri>/heartbeat                     keep the session alive
+    PUT    <uri>/<device>                      show an effect straight away
+    POST   <uri>/<device>                      create an effect, returns {"id": ...}
+    PUT    <uri>/effect                        show created effects, {"id": ...} or {"ids": [...]}
+    DELETE <uri>/effect                        delete created effects, the same way
+
+Replies are HTTP/1.1 with keep-alive. Every request can be delayed by delay seconds to act like a busy SDK. The server counts requests by method
+and endpoint, and TCP connections. It also keeps the colour each device is showing, with the time it changed. end_sessions() ends every
+session, as the SDK does when Synapse restarts, so clients can be tested for starting a new one.
+'''
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import itertools
+import json
+import re
+import threading
+import time
+
+from rgbengine.ports import HOST
+
+SDK_PATH = '/razer/chromasdk'
+SESSION_PATH = re.compile(r'^/sid=(\d+)/chromasdk(?:/(\w+))?$')
+SUPPORTED_DEVICES = ['keyboard', 'mouse', 'headset', 'mousepad', 'keypad', 'chromalink']
+
+class MockChromaServer():
+    '''
+    Serves the mock API on a background thread. Port 0 picks a free port, url is the SDK url to give the bridge once start() returns.
+    '''
+    def __init__(self, host=HOST, port=0, delay=0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.lock = threading.Condition()
+        self.requests = {} #'METHOD endpoint' -> count
+        self.connections = 0
+        self.sessions = {} #session id -> time of its last request
+        self.effects = {} #effect id -> (device, effect body)
+        self.colours = {} #device -> BGR colour shown
+        self.changed = {} #device -> time.monotonic() of its last colour change
+        self.changes = 0
+        self.ids = itertools.count(1)
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://' + self.host + ':' + str(self.port) + SDK_PATH
+
+    def start(self):
+        mock = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True #headers and body are written separately, which would otherwise stall keep-alive clients
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with mock.lock:
+                    mock.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length)) if length else None
+                except ValueError:
+                    body = None
+                if mock.delay:
+                    time.sleep(mock.delay)
+                status, reply = mock.handle(self.command, self.path, body)
+                data = json.dumps(reply).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mock-chroma', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, method, path, body):
+        '''
+        Answers one request, returning (HTTP status, reply dict).
+        '''
+        now = time.monotonic()
+        with self.lock:
+            if path == SDK_PATH:
+                endpoint = 'sdk'
+            else:
+                match = SESSION_PATH.match(path)
+                if match is None or int(match.group(1)) not in self.sessions:
+                    return 404, {'result': 1168, 'error': 'no such session'}
+                session = int(match.group(1))
+                self.sessions[session] = now
+                endpoint = match.group(2) or 'session'
+                endpoint = endpoint if endpoint in ('heartbeat', 'effect', 'session') else 'device'
+            key = method + ' ' + endpoint
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            if key == 'GET sdk':
+                return 200, {'core': '3.29.00', 'device_supported': SUPPORTED_DEVICES, 'version': '3.29.00'}
+            if key == 'POST sdk':
+                session = next(self.ids)
+                self.sessions[session] = now
+                return 200, {'sessionid': session, 'uri': 'http://' + self.host + ':' + str(self.port) + '/sid=' + str(session) + '/chromasdk'}
+            if key == 'DELETE session':
+                del self.sessions[session]
+                return 200, {'result': 0}
+            if key == 'PUT heartbeat':
+                return 200, {'tick': self.requests[key]}
+            if endpoint == 'device':
+                device = match.group(2)
+                if device not in SUPPORTED_DEVICES or not isinstance(body, dict):
+                    return 400, {'result': 87}
+                if method == 'PUT':
+                    self._show(device, body, now)
+                    return 200, {'result': 0}
+                if method == 'POST':
+                    effect = str(next(self.ids))
+                    self.effects[effect] = (device, body)
+                    return 200, {'id': effect, 'result': 0}
+            if endpoint == 'effect' and isinstance(body, dict):
+                ids = body['ids'] if 'ids' in body else [body.get('id')]
+                results = []
+                for effect in ids:
+                    if effect not in self.effects:
+                        results.append({'id': effect, 'result': 1168})
+                    elif method == 'PUT':
+                        self._show(self.effects[effect][0], self.effects[effect][1], now)
+                        results.append({'id': effect, 'result': 0})
+                    else:
+                        del self.effects[effect]
+                        results.append({'id': effect, 'result': 0})
+                return 200, {'results': results} if 'ids' in body else results[0]
+            return 400, {'result': 87}
+
+    def _show(self, device, effect, now):
+        colour = effect.get('param', {}).get('color')
+        if self.colours.get(device) != colour:
+            self.colours[device] = colour
+            self.changed[device] = now
+            self.changes += 1
+        self.lock.notify_all()
+
+    def end_sessions(self):
+        '''
+        Ends every session along with the effects made in it, after which requests to their uris fail with 404. The devices show nothing again.
+        '''
+        with self.lock:
+            self.sessions.clear()
+            self.effects.clear()
+            self.colours.clear()
+
+    def wait_for_colour(self, device, colour, timeout=5):
+        '''
+        Blocks until device shows colour (BGR), returns False on timeout.
+        '''
+        with self.lock:
+            return self.lock.wait_for(lambda: self.colours.get(device) == colour, timeout=timeout)
+
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'total_requests': sum(self.requests.values()), 'connections': self.connections,
+                    'sessions': len(self.sessions), 'effects': len(self.effects), 'changes': self.changes, 'colours': dict(self.colours)}
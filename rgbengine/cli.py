@@ -0,0 +1,207 @@
+'''
+Command line modes that never import the GUI modules (tkinter, pystray, PIL), so they start in a fraction of the GUI's time.
+RGBController.py hands these flags over before it imports anything from the GUI:
+
+    RGBController --apply [profile_id]   applies a saved profile (the last loaded one if no id is given) and exits, leaving the engine running
+    RGBController --engine               runs the pattern engine itself, this is how the GUI and --apply start it
+    RGBController --stats                prints the running engine's metrics as JSON (see the stats command in server.py)
+    RGBController --record PATH          renders a saved profile (--profile, the last loaded one by default) into a seeded golden recording
+    RGBController --verify PATH          renders a golden recording's patterns again and checks every frame still matches
+    RGBController --save-pattern NAME PATH   saves the keyframe pattern defined in the JSON file PATH (see rgbengine/keyframes.py) as NAME,
+                                             which profiles can then use like a built in pattern
+
+--apply is meant for the startup scripts: the LEDs get their profile without building the window, and opening the GUI later simply connects to the
+engine that is already running. It can also be run as python -m rgbengine.cli --apply [profile_id].
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from rgbengine.control import EngineControl, EngineError
+from rgbengine.profiles import ProfileStore, ProfileError, PROFILE_DIRECTORY
+from rgbengine.ports import HOST, CONTROL_PORT, FRAME_RING
+
+ENGINE_START_TIMEOUT = 5 #seconds to wait for a newly launched pattern engine to start listening
+
+def resource_path(relative_path):
+    '''
+    Absolute paths for both release and debug versions, the GUI uses this one too, see below:
+    #https://stackoverflow.com/questions/7674790/bundling-data-files-with-pyinstaller-onefile
+    '''
+    base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(base_path, relative_path)
+
+def engine_command(control_port=CONTROL_PORT):
+    '''
+    The command that starts the pattern engine process. Release builds run the same executable again in engine mode.
+    '''
+    if getattr(sys, 'frozen', False):
+        command = [sys.executable, '--engine']
+    else:
+        command = [sys.executable, '-m', 'rgbengine.cli', '--engine']
+    if control_port != CONTROL_PORT:
+        command += ['--control-port', str(control_port)]
+    return command
+
+def launch_engine(control_port=CONTROL_PORT):
+    '''
+    Starts the pattern engine in the background, detached so it keeps running after this process exits.
+    This is how both --apply and the GUI start it. Returns the engine's Popen.
+    '''
+    if os.name == 'nt':
+        options = {'creationflags': subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        options = {'start_new_session': True}
+    environment = dict(os.environ)
+    if not getattr(sys, 'frozen', False): #so python -m rgbengine.cli works from the rgbsyncserver directory
+        environment['PYTHONPATH'] = os.pathsep.join(filter(None, [resource_path('.'), environment.get('PYTHONPATH')]))
+    return subprocess.Popen(engine_command(control_port), cwd=resource_path('./rgbsyncserver'), env=environment,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **options)
+
+def profile_args(profile):
+    '''
+    Flattens a profile's device lines into the engine's arguments. A line for device 0 ('All') replaces every other line, as in load_profile.
+    '''
+    values = []
+    for line_values in profile:
+        if line_values[0] == '0':
+            return list(line_values)
+        values.extend(line_values)
+    return values
+
+def profile_patterns(store, args):
+    '''
+    Returns the saved definitions of the user defined patterns named in args, which the engine needs along with them.
+    '''
+    return store.patterns(set(args[6::7]))
+
+def apply_profile(profile_id=None, store=None, engine=None, transition=None):
+    '''
+    Sends a saved profile to the engine, starting the engine if it isn't running. profile_id defaults to the last loaded profile,
+    and becomes the new last loaded profile, the same as loading it from the GUI. transition is the fade time in seconds, the engine's own
+    by default. Returns the engine's reply.
+    Raises ProfileError if there is no such profile, or EngineError if the engine could not be reached.
+    '''
+    store = store or ProfileStore()
+    engine = engine or EngineControl()
+    if profile_id is None:
+        profile_id = store.last_loaded_profile()
+        if profile_id is None:
+            raise ProfileError("no profile has been loaded yet, pass a profile id")
+    profile = store.profile(profile_id)
+    if profile is None:
+        raise ProfileError("there is no profile " + str(profile_id))
+    store.set_last_loaded_profile(profile_id)
+
+    if not (engine.connected() or engine.connect()):
+        launch_engine(engine.port)
+        if not engine.connect(timeout=ENGINE_START_TIMEOUT):
+            raise EngineError("the pattern engine did not start")
+    try:
+        args = profile_args(profile)
+        return engine.load_profile(args, transition, profile_patterns(store, args))
+    finally:
+        engine.close()
+
+def report(message, stream):
+    if stream is not None: #release builds have no console, so there is nowhere to print to
+        print(message, file=stream)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='RGBController', description="Headless modes of the RGB Controller.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--apply', nargs='?', const=0, type=int, metavar='PROFILE_ID',
+                      help="apply a saved profile (default: the last loaded one) and exit")
+    mode.add_argument('--engine', action='store_true', help="run the pattern engine")
+    mode.add_argument('--stats', action='store_true', help="print the running engine's metrics as JSON")
+    mode.add_argument('--record', metavar='PATH', help="record a saved profile's frames to PATH, see rgbengine/recording.py")
+    mode.add_argument('--verify', metavar='PATH', help="check a recording made with --record against the current patterns")
+    mode.add_argument('--save-pattern', nargs=2, metavar=('NAME', 'PATH'), help="save the keyframe pattern defined in the JSON file PATH as NAME")
+    parser.add_argument('--profile', type=int, help="with --record, the profile to record (default: the last loaded one)")
+    parser.add_argument('--ticks', type=int, default=6000, help="with --record, frames to record")
+    parser.add_argument('--fps', type=float, help="with --record, record real time steps at this rate instead of server.cpp's ticks")
+    parser.add_argument('--seed', type=int, default=0, help="with --record, the random seed for randomstrobe")
+    parser.add_argument('--transition', type=float, metavar='SECONDS',
+                        help="with --apply, how long to fade into the profile; with --engine, the default fade for every pattern change")
+    parser.add_argument('--shared-frames', nargs='?', const=FRAME_RING, metavar='NAME',
+                        help="with --engine, also write every frame to shared memory for local consumers, see rgbengine/framering.py")
+    parser.add_argument('--profiles', default=PROFILE_DIRECTORY, help="directory holding profiles.json")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--control-port', type=int, default=CONTROL_PORT)
+    args = parser.parse_args(argv)
+
+    if args.engine:
+        from rgbengine.server import main as run_engine #the engine is the only mode that needs numpy
+        options = {} if args.transition is None else {'transition': args.transition}
+        if args.shared_frames:
+            options['shared_frames'] = args.shared_frames
+        run_engine(cwd=resource_path('./rgbsyncserver'), host=args.host, control_port=args.control_port, **options)
+        return 0
+
+    if args.stats:
+        engine = EngineControl(args.host, args.control_port)
+        if not engine.connect():
+            report("the pattern engine is not running", sys.stderr)
+            return 1
+        try:
+            report(json.dumps(engine.stats(), indent=1), sys.stdout)
+        except EngineError as error:
+            report("could not read the engine's stats: " + str(error), sys.stderr)
+            return 1
+        finally:
+            engine.close()
+        return 0
+
+    if args.record or args.verify:
+        from rgbengine import recording #numpy is only needed here
+        try:
+            if args.record:
+                store = ProfileStore(args.profiles)
+                profile_id = args.profile or store.last_loaded_profile()
+                profile = store.profile(profile_id) if profile_id is not None else None
+                if profile is None:
+                    raise ProfileError("there is no profile " + str(profile_id))
+                pattern_args = profile_args(profile)
+                frames = recording.record_patterns(args.record, pattern_args, args.ticks, args.fps, args.seed,
+                                                   profile_patterns(store, pattern_args))
+                report("recorded " + str(frames) + " frames of profile " + str(profile_id) + " to " + args.record, sys.stdout)
+                return 0
+            difference = recording.verify_recording(args.verify)
+        except (ValueError, OSError) as error: #ProfileError and RecordingError are both ValueErrors
+            report("could not " + ("record: " if args.record else "verify: ") + str(error), sys.stderr)
+            return 1
+        if difference is None:
+            report(args.verify + " matches", sys.stdout)
+            return 0
+        index, device_ids, recorded, rendered = difference
+        report("frame " + str(index) + " differs, devices " + str(device_ids.tolist()) + " were recorded as " + str(recorded.tolist())
+               + " but now render as " + str(rendered.tolist()), sys.stderr)
+        return 1
+
+    if args.save_pattern:
+        name, path = args.save_pattern
+        try:
+            with open(path, 'r') as file:
+                definition = json.load(file)
+            ProfileStore(args.profiles).save_pattern(name, definition)
+        except (ValueError, OSError) as error: #invalid JSON, and ProfileError, are both ValueErrors
+            report("could not save pattern " + name + ": " + str(error), sys.stderr)
+            return 1
+        report("saved pattern " + name, sys.stdout)
+        return 0
+
+    store = ProfileStore(args.profiles)
+    try:
+        reply = apply_profile(args.apply or None, store, EngineControl(args.host, args.control_port), args.transition)
+    except (ProfileError, EngineError) as error:
+        report("could not apply profile: " + str(error), sys.stderr)
+        return 1
+    report("applied profile " + str(store.last_loaded_profile()) + " to " + str(reply['devices']) + " devices in "
+           + str(round(reply['round_trip'] * 1000)) + " ms", sys.stdout)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+'''
+Client side of the engine's control socket, used by the GUI to change patterns on a running engine (see server.py for the message format).
+'''
+
+import json
+import socket
+import time
+
+from rgbengine.ports import HOST, CONTROL_PORT
+
+CONNECT_TIMEOUT = 5 #seconds to keep retrying while a freshly launched engine starts listening
+RETRY_INTERVAL = 0.05
+
+class EngineError(Exception):
+    '''
+    Raised when the engine rejects a command or cannot be reached.
+    '''
+
+class EngineControl():
+    '''
+    A connection to the engine's control port. Every command blocks until the engine has sent the change to the API clients.
+    last_latency holds the round trip time of the last command, i.e. how long a click took to reach the LEDs.
+    '''
+    def __init__(self, host=HOST, port=CONTROL_PORT):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.stream = None
+        self.last_latency = None
+
+    def connected(self):
+        return self.sock is not None
+
+    def connect(self, timeout=0):
+        '''
+        Connects to the engine, retrying for up to timeout seconds. Returns False if nothing is listening.
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+                self.stream = self.sock.makefile('rwb')
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(RETRY_INTERVAL)
+
+    def close(self):
+        if self.sock is not None:
+            self.stream.close()
+            self.sock.close()
+        self.sock = None
+        self.stream = None
+
+    def request(self, command, **fields):
+        '''
+        Sends one command and returns the engine's reply dict, with the measured round trip time added as 'round_trip'.
+        '''
+        if self.sock is None:
+            raise EngineError("not connected to the engine")
+        fields['command'] = command
+        start = time.monotonic()
+        try:
+            self.stream.write(json.dumps(fields).encode() + b'\n')
+            self.stream.flush()
+            line = self.stream.readline()
+        except OSError as error:
+            self.close()
+            raise EngineError(str(error))
+        if not line:
+            self.close()
+            raise EngineError("engine closed the connection")
+        reply = json.loads(line)
+        reply['round_trip'] = time.monotonic() - start
+        if not reply.get('ok'):
+            raise EngineError(reply.get('error'))
+        self.last_latency = reply['round_trip']
+        return reply
+
+    def set_device_pattern(self, args, transition=None, patterns=None):
+        return self.request('set-device-pattern', args=list(args), **self._options(transition, patterns))
+
+    def load_profile(self, args, transition=None, patterns=None):
+        return self.request('load-profile', args=list(args), **self._options(transition, patterns))
+
+    def _options(self, transition, patterns):
+        #without a transition time the engine uses its own, patterns are the definitions of any user defined patterns args names
+        options = {} if transition is None else {'transition': float(transition)}
+        if patterns:
+            options['patterns'] = patterns
+        return options
+
+    def clear_device(self, device_id):
+        return self.request('clear-device', device_id=int(device_id))
+
+    def ping(self):
+        return self.request('ping')
+
+    def stats(self):
+        return self.request('stats')['stats']
+
+    def discover(self):
+        return self.request('discover')
+
+    def stop(self):
+        try:
+            return self.request('stop')
+        finally:
+            self.close()
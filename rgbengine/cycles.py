@@ -0,0 +1,225 @@
+'''
+Precomputed pattern cycles. Every built-in pattern except randomstrobe is deterministic, so the colours a device shows are fully decided by
+its pattern, colour and alpha, and eventually repeat (rainbowcycle every 1530 updates, pulse every ~2 * colour + 51 updates, and so on).
+A PatternCycle runs the state machine once until its state repeats and keeps the colours as a compact uint8 table,
+which the pattern engine then plays back by index instead of stepping the state machine.
+User defined keyframe patterns (see keyframes.py) are compiled straight into a PatternCycle, and cached here the same way.
+
+Computing a cycle runs the state machine for up to a few thousand updates (rainbowpulse takes about a third of a second), too long to do on the
+server's tick thread. Engines that can't wait ask for their misses without waiting: the cycles are computed on a background thread, and the
+devices run their state machine until the table is ready, then carry on in it from the update they had reached.
+'''
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+from rgbengine.patterns import PatternEngine, PATTERN_CODES, STATIC, RANDOM_STROBE, STATE_FIELDS
+
+MAX_CYCLE_STEPS = 8192 #longest cycle we look for, rainbowpulse (the longest built-in cycle) needs about 4500 updates
+DEFAULT_CACHE_SIZE = 64
+#patterns that start from the same colour whatever colour they are given, so every colour can share one table
+FIXED_COLOUR_PATTERNS = ('rainbowcycle', 'fire')
+
+#fields that decide what a device does next, the rest (device_id, speed, pattern...) never change while a pattern runs
+CYCLE_FIELDS = [STATE_FIELDS.index(name) for name in ('r', 'g', 'b', 'count', 'initial_r', 'initial_g', 'initial_b',
+                                                      'pulse', 'rainbow_index', 'changing_channel')]
+
+def is_cacheable(pattern):
+    '''
+    Returns True if the pattern is deterministic and can be stored as a cycle (unknown patterns are treated as static, like the server).
+    '''
+    return PATTERN_CODES.get(pattern, STATIC) != RANDOM_STROBE
+
+class PatternCycle():
+    '''
+    One full run of a pattern, as a (length, 4) uint8 RGBA table where row k is the colour after k pattern updates.
+    The first prefix rows are only shown once (e.g. rainbowpulse showing the user's colour before cycling through the rainbow colours),
+    and the remaining period rows repeat forever.
+    '''
+    def __init__(self, table, prefix, period):
+        self.table = table
+        self.prefix = prefix
+        self.period = period
+
+    def __len__(self):
+        return len(self.table)
+
+    def index(self, updates):
+        '''
+        Returns the table row for the given number of pattern updates, works on ints and integer arrays alike.
+        '''
+        updates = np.asarray(updates)
+        return np.where(updates < self.prefix, updates, self.prefix + (updates - self.prefix) % self.period)
+
+    def colours(self, updates):
+        '''
+        Returns the RGBA colour(s) after the given number of pattern updates.
+        '''
+        return self.table[self.index(updates)]
+
+def compute_cycles(configs):
+    '''
+    Computes the PatternCycle for every (pattern, r, g, b, a) in configs with one batched PatternEngine run.
+    Each device's state is recorded after every update until it repeats a state it has already been in.
+    Raises ValueError for randomstrobe, or for any pattern whose cycle is longer than MAX_CYCLE_STEPS.
+    '''
+    engine = PatternEngine()
+    for pattern, r, g, b, a in configs:
+        if not is_cacheable(pattern):
+            raise ValueError(pattern + " is not deterministic and cannot be cached")
+        engine.add_device(0, r, g, b, a, 2, pattern) #fast speed, so every tick is one update
+
+    cycles = [None] * len(configs)
+    seen = [{} for config in configs]
+    frames = []
+    remaining = set(range(len(configs)))
+
+    for step in range(MAX_CYCLE_STEPS + 1):
+        frames.append(engine.frame())
+        state = np.stack([getattr(engine, STATE_FIELDS[field]) for field in CYCLE_FIELDS], axis=1)
+        for device in list(remaining):
+            key = state[device].tobytes()
+            if key in seen[device]: #this state has already happened, so everything after it is a repeat
+                prefix = seen[device][key]
+                table = np.ascontiguousarray(np.stack([frame[device] for frame in frames[:step]]))
+                cycles[device] = PatternCycle(table, prefix, step - prefix)
+                remaining.discard(device)
+            else:
+                seen[device][key] = step
+        if not remaining:
+            return cycles
+        engine.step()
+
+    raise ValueError("pattern cycle is longer than " + str(MAX_CYCLE_STEPS) + " steps")
+
+class CycleCache():
+    '''
+    Bounded LRU cache of PatternCycles keyed by (pattern, r, g, b, a).
+    Speed is deliberately left out of the key, it only changes how often a device updates and not the colours it goes through,
+    so the slow, medium and fast versions of a pattern share one table, and so is the colour of patterns that ignore it.
+    pattern is a built in pattern's name, or a KeyframePattern, which is keyed by its definition.
+    The cache can be used from several threads, cycles computed in the background are stored by their own thread.
+    '''
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.cycles = OrderedDict()
+        self.lock = threading.Condition()
+        self.pending = set() #keys being computed in the background
+        self.generation = 0 #counts background batches finished, so engines know when to look for their cycles again
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self.cycles)
+
+    def __contains__(self, key):
+        return key in self.cycles
+
+    def key(self, pattern, r, g, b, a):
+        if hasattr(pattern, 'compile'): #a KeyframePattern (keyframes.py builds on this module, so it isn't imported here)
+            #alpha is never in the table, and neither is the device's colour unless a keyframe uses it
+            if not pattern.uses_device_colour:
+                r = g = b = 0
+            return ('keyframes', pattern.key, int(r), int(g), int(b))
+        #unknown patterns run as static on the server, so they can share static's tables
+        if pattern not in PATTERN_CODES:
+            pattern = 'static'
+        if pattern in FIXED_COLOUR_PATTERNS:
+            r = g = b = 0
+        return (pattern, int(r), int(g), int(b), int(a))
+
+    def get(self, pattern, r, g, b, a):
+        '''
+        Returns the PatternCycle for this configuration, computing and storing it on a miss.
+        '''
+        return self.get_many([(pattern, r, g, b, a)])[0]
+
+    def get_many(self, configs, wait=True):
+        '''
+        Returns the PatternCycles for a list of (pattern, r, g, b, a) configurations, computing all misses together in one batch.
+        Without wait, built in patterns that miss are computed on a background thread instead, and None is returned for them,
+        see peek() and generation. Keyframe patterns are always compiled straight away, which takes no longer than a table copy.
+        '''
+        keys = [self.key(*config) for config in configs]
+        missing = {}
+        with self.lock:
+            for key, config in zip(keys, configs):
+                if key in self.cycles:
+                    self.hits += 1
+                    self.cycles.move_to_end(key)
+                elif key not in missing:
+                    missing[key] = config
+            self.misses += len(missing)
+            found = {key: self.cycles[key] for key in keys if key in self.cycles}
+            computed = [key for key in missing if key[0] != 'keyframes' and (wait or key not in self.pending)]
+            if not wait:
+                self.pending.update(computed)
+
+        if computed and wait:
+            found.update(zip(computed, compute_cycles(computed)))
+        elif computed:
+            threading.Thread(target=self._compute, args=(computed,), name='cycles', daemon=True).start()
+        for key, (pattern, r, g, b, a) in missing.items():
+            if key[0] == 'keyframes':
+                found[key] = pattern.compile(r, g, b)
+        with self.lock:
+            for key in missing:
+                if key in found:
+                    self._store(key, found[key])
+        return [found.get(key) for key in keys]
+
+    def _compute(self, keys):
+        try:
+            cycles = compute_cycles(keys)
+        except ValueError: #a cycle too long to keep, its devices go on running their state machine
+            cycles = None
+        with self.lock:
+            if cycles is None:
+                self.errors += 1
+            else:
+                for key, cycle in zip(keys, cycles):
+                    self._store(key, cycle)
+            self.pending.difference_update(keys)
+            self.generation += 1
+            self.lock.notify_all()
+
+    def peek(self, key):
+        '''
+        Returns the cached PatternCycle for a key, or None, without counting a hit or a miss or computing anything.
+        '''
+        with self.lock:
+            return self.cycles.get(key)
+
+    def wait(self, timeout=None):
+        '''
+        Blocks until no cycles are being computed in the background, returns False on timeout.
+        '''
+        with self.lock:
+            return self.lock.wait_for(lambda: not self.pending, timeout=timeout)
+
+    def _store(self, key, cycle):
+        self.cycles[key] = cycle
+        self.cycles.move_to_end(key)
+        while len(self.cycles) > self.maxsize:
+            self.cycles.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.cycles.clear()
+
+    def stats(self):
+        '''
+        Returns the cache counters as a dict.
+        '''
+        with self.lock:
+            return {'size': len(self.cycles), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions, 'pending': len(self.pending), 'errors': self.errors,
+                    'bytes': sum(cycle.table.nbytes for cycle in self.cycles.values())}
+
+#shared by every engine in the process, so reloading a profile reuses the tables computed the first time it was loaded
+DEFAULT_CYCLE_CACHE = CycleCache()
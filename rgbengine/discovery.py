@@ -0,0 +1,178 @@
+'''
+Finding out which vendor backends can be used before starting their API clients.
+
+server.cpp starts every API client and then waits on select() with a 3 second timeout until they have all connected, so every vendor that
+is not installed or not running adds seconds to each start (and to each logon event, which redoes the whole thing). Here every backend is
+probed at the same time, with quick checks that do not involve starting its client:
+
+    corsair  the client has been built, and iCUE is running (the SDK only connects through a running iCUE)
+    razer    the Chroma SDK's REST server (part of Synapse) answers, which also reports the supported devices. It is driven by the bridge in
+             razer.py, so nothing has to be built
+
+discover() does not wait for the sum of timeouts, or even for the slowest probe: it returns as soon as every backend that was present last
+time (or has never been probed) has answered, or every probe has if none of them was. A backend that was absent last time and is slow to
+answer now, usually one whose probe is waiting out its timeout, is reported absent as before while its probe finishes in the background and
+updates the cache, so a vendor that has just been started is picked up by the next discover(), which the server runs every
+REDISCOVER_INTERVAL seconds (see SyncServer.rediscover() in server.py). Only the backends found present are started.
+
+Results are cached in ~/RGBController/backends.json, so restarting the engine (or the GUI starting it straight after the startup scripts
+did) does not probe again: present backends for CACHE_TTL seconds, absent ones only for NEGATIVE_TTL, so starting a vendor's software is
+noticed soon.
+'''
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+
+from rgbengine.profiles import PROFILE_DIRECTORY
+
+CACHE_NAME = "backends.json"
+CACHE_TTL = 60 #seconds a backend found present is trusted for, short so that closing a vendor's software is noticed soon
+NEGATIVE_TTL = 5 #seconds a backend found absent is trusted for, shorter still as the user may be starting its software right now
+PROBE_TIMEOUT = 1 #seconds any one probe may take
+RAZER_URL = "http://localhost:54235/razer/chromasdk" #the same url razerAPIclient uses
+LOCAL_OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({})) #the Chroma SDK is local, so never go through a proxy
+ICUE_PROCESS = "iCUE.exe"
+
+class Backend():
+    '''
+    One vendor backend: the API client that drives it (relative to the rgbsyncserver directory), a probe(timeout) function returning
+    (present, inventory, detail), and the device types it can drive, used as its inventory when the probe can't list them.
+    bridge is set for backends the server drives in process (see BRIDGES in server.py), whose API client does not need to be built.
+    '''
+    def __init__(self, name, path, probe, devices, bridge=False):
+        self.name = name
+        self.path = path
+        self.probe = probe
+        self.devices = devices
+        self.bridge = bridge
+
+def probe_corsair(timeout):
+    if os.name != 'nt':
+        return False, [], "iCUE only runs on Windows"
+    try:
+        result = subprocess.run(['tasklist', '/FI', 'IMAGENAME eq ' + ICUE_PROCESS, '/NH'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                timeout=timeout, text=True, creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+    except (OSError, subprocess.TimeoutExpired) as error:
+        return False, [], "could not list processes: " + str(error)
+    if ICUE_PROCESS.lower() not in result.stdout.lower():
+        return False, [], "iCUE is not running"
+    return True, None, "iCUE is running"
+
+def probe_razer(timeout):
+    try:
+        with LOCAL_OPENER.open(RAZER_URL, timeout=timeout) as response:
+            info = json.loads(response.read())
+    except (OSError, ValueError) as error:
+        return False, [], "Chroma SDK is not answering (" + str(getattr(error, 'reason', error)) + ")"
+    inventory = info.get('device_supported') if isinstance(info, dict) else None
+    return True, inventory, "Chroma SDK " + str(info.get('version', '') if isinstance(info, dict) else '').strip()
+
+#every currently implemented backend, in the same order as API_PATHS in server.cpp
+BACKENDS = [
+    Backend('corsair', './APIs/iCUESDK/corsairAPIclient.exe', probe_corsair, ['keyboard', 'mouse', 'memory module', 'led hub', 'cooler', 'headset']),
+    Backend('razer', './APIs/RAZER/razerAPIclient.exe', probe_razer, ['keyboard', 'mouse', 'headset'], bridge=True),
+]
+
+class DiscoveryCache():
+    '''
+    The last probe result of every backend, kept in a small JSON file so it survives engine restarts.
+    '''
+    def __init__(self, directory=PROFILE_DIRECTORY, ttl=CACHE_TTL, negative_ttl=NEGATIVE_TTL):
+        self.directory = directory
+        self.path = os.path.join(directory, CACHE_NAME)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock() #probes finishing in the background save their own results
+
+    def load(self):
+        '''
+        Returns every cached result by backend name, fresh or not.
+        '''
+        try:
+            with open(self.path, 'r') as file:
+                results = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(results, dict):
+            return {}
+        return {name: result for name, result in results.items() if isinstance(result, dict)}
+
+    def fresh(self, result):
+        return 0 <= time.time() - result.get('checked', 0) <= (self.ttl if result.get('present') else self.negative_ttl)
+
+    def update(self, results):
+        '''
+        Saves results ({name: result}) over whatever the cache holds for the other backends.
+        '''
+        with self.lock:
+            self.save(dict(self.load(), **results))
+
+    def save(self, results):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            descriptor, temporary_path = tempfile.mkstemp(prefix=CACHE_NAME, dir=self.directory)
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(results, file, separators=(',', ':'))
+            os.replace(temporary_path, self.path)
+        except OSError: #the cache only saves time, failing to write it is not worth stopping for
+            pass
+
+def _probe(backend, cwd, timeout, previous):
+    start = time.monotonic()
+    if not backend.bridge and not os.path.exists(os.path.join(cwd, backend.path)):
+        present, inventory, detail = False, [], "API client has not been built"
+    else:
+        try:
+            present, inventory, detail = backend.probe(timeout)
+        except Exception as error: #a broken probe only rules out its own backend
+            present, inventory, detail = False, [], "probe failed: " + str(error)
+    inventory = backend.devices if present and inventory is None else inventory or []
+    return {'name': backend.name, 'path': backend.path, 'present': present, 'inventory': inventory,
+            'last_inventory': inventory or previous.get('last_inventory', []), #what it had when it was last present
+            'detail': detail, 'checked': time.time(), 'probe_time': time.monotonic() - start}
+
+def discover(backends=BACKENDS, cwd=None, cache=None, timeout=PROBE_TIMEOUT, refresh=False):
+    '''
+    Probes every backend at once (using fresh cached results unless refresh is set) and returns
+    {'backends': [result, ...], 'elapsed': seconds, 'cached': names answered from the cache, 'pending': names still being probed},
+    results in the order of backends.
+    Each result holds name, path, present, inventory (the device types it reported, or can drive), last_inventory (the inventory from the
+    last time it was present, kept across restarts), detail, checked and probe_time.
+    Backends in pending were absent last time and had not answered yet, their last result is returned and their probe saves its own.
+    '''
+    start = time.monotonic()
+    cwd = cwd or os.getcwd()
+    cache = cache or DiscoveryCache()
+    previous = cache.load()
+    cached = {} if refresh else {name: result for name, result in previous.items() if cache.fresh(result)}
+
+    results = {backend.name: cached[backend.name] for backend in backends if backend.name in cached}
+    missing = [backend for backend in backends if backend.name not in results]
+    pending = []
+    if missing:
+        pool = ThreadPoolExecutor(max_workers=len(missing), thread_name_prefix='discovery')
+        probes = {pool.submit(_probe, backend, cwd, timeout, previous.get(backend.name, {})): backend for backend in missing}
+        #only the backends that may be present are waited for, the ones that were absent last time only until those have answered.
+        #if none may be present every probe is waited for, as there would be nothing to start otherwise
+        awaited = {probe for probe, backend in probes.items() if previous.get(backend.name, {}).get('present', True)} or set(probes)
+        waiting = set(probes)
+        while waiting and awaited & waiting:
+            done, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+        pool.shutdown(wait=False)
+        for probe, backend in probes.items():
+            if probe in waiting:
+                pending.append(backend.name)
+                results[backend.name] = previous[backend.name]
+                probe.add_done_callback(lambda probe: cache.update({probe.result()['name']: probe.result()}))
+            else:
+                results[backend.name] = probe.result()
+        cache.update({backend.name: results[backend.name] for backend in missing if backend.name not in pending})
+
+    return {'backends': [results[backend.name] for backend in backends], 'elapsed': time.monotonic() - start,
+            'cached': [backend.name for backend in backends if backend.name in cached], 'pending': pending}
@@ -0,0 +1,307 @@
+'''
+Non-blocking fan-out of encoded frames to the API clients.
+
+server.cpp sends to each client in turn with blocking send() calls, so one slow client (like the Razer client, which makes HTTP requests for every message)
+holds up every other client, and a single send error restarts all of them. Here every client gets its own bounded queue, and a single selector thread
+writes to whichever sockets are ready. When a client falls behind, the oldest queued frames are dropped so that it only ever catches up to the newest one,
+and a client that errors or stops reading altogether is disconnected on its own while the rest keep streaming.
+
+Frames published with publish_frame() are also diffed against what each client was last sent, so only devices whose colour changed go out
+(a static pattern, or a pulse holding at black, costs nothing after its first frame). Every keyframe_interval ticks a client is sent every device
+again so it can recover from anything it missed, and a client that had frames dropped gets a full frame straight away.
+Devices whose id doesn't fit on the wire are left out of every frame and counted in devices_invalid.
+'''
+
+from collections import deque
+import selectors
+import socket
+import threading
+import time
+
+import numpy as np
+
+from rgbengine.metrics import Histogram
+
+QUEUE_SIZE = 2 #frames queued per client before the oldest are dropped
+STALL_TIMEOUT = 5 #seconds a client can go without accepting any bytes before it is disconnected
+SELECT_TIMEOUT = 0.5
+KEYFRAME_INTERVAL = 100 #ticks between full frames, 5 seconds at the default 20 fps
+DEVICE_ID_LIMIT = 256 #device ids are a single byte on the wire
+
+class ClientConnection():
+    '''
+    One API client's socket, along with the frames waiting to be written to it and its counters.
+    '''
+    def __init__(self, sock, queue_size):
+        self.sock = sock
+        try:
+            self.name = '%s:%d' % sock.getpeername()[:2]
+        except OSError:
+            self.name = 'client'
+        self.queue = deque() #(frame, time it was queued)
+        self.queue_size = queue_size
+        self.current = None #memoryview of the frame being written, frames are never dropped part way through
+        self.current_queued = None
+        self.last_progress = time.monotonic()
+        self.connected = self.last_progress
+        self.send_latency = Histogram() #time from a frame being queued to its last byte being accepted by the socket
+
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+
+        #the last colour queued for every device id, -1 where nothing has been sent (or it has to be sent again)
+        self.last_colours = np.full((DEVICE_ID_LIMIT, 4), -1, dtype=np.int16)
+        self.ticks_since_keyframe = None #None until the first keyframe
+        self.keyframes = 0
+        self.frames_suppressed = 0 #ticks where nothing had changed, so nothing was sent
+        self.devices_sent = 0
+        self.devices_suppressed = 0
+
+    def pending(self):
+        return self.current is not None or bool(self.queue)
+
+    def enqueue(self, data, now=None):
+        now = time.monotonic() if now is None else now
+        if not self.pending():
+            self.last_progress = now #an idle client is not stalled
+        self.queue.append((data, now))
+        while len(self.queue) > self.queue_size:
+            self.queue.popleft()
+            self.frames_dropped += 1
+            self.last_colours[:] = -1 #the dropped frame may have held changes, so the next frame has to resend everything
+
+    def changed(self, device_ids, colours, keyframe_interval):
+        '''
+        Returns (mask of devices to send, whether this is a keyframe) for a new frame, and records them as sent.
+        '''
+        keyframe = self.ticks_since_keyframe is None or self.ticks_since_keyframe + 1 >= keyframe_interval
+        if keyframe:
+            mask = np.ones(len(device_ids), dtype=bool)
+            self.ticks_since_keyframe = 0
+            self.keyframes += 1
+        else:
+            mask = (self.last_colours[device_ids] != colours).any(axis=1)
+            self.ticks_since_keyframe += 1
+        self.last_colours[device_ids[mask]] = colours[mask]
+
+        sent = int(np.count_nonzero(mask))
+        self.devices_sent += sent
+        self.devices_suppressed += len(device_ids) - sent
+        if not sent:
+            self.frames_suppressed += 1
+        return mask, keyframe
+
+    def flush(self):
+        '''
+        Writes as much as the socket accepts without blocking. Raises OSError if the connection has failed.
+        '''
+        while True:
+            if self.current is None:
+                if not self.queue:
+                    return
+                data, self.current_queued = self.queue.popleft()
+                self.current = memoryview(data)
+            try:
+                sent = self.sock.send(self.current)
+            except BlockingIOError:
+                return
+            if sent == 0:
+                raise ConnectionError("connection closed")
+            self.bytes_sent += sent
+            self.last_progress = time.monotonic()
+            self.current = self.current[sent:]
+            if not len(self.current):
+                self.current = None
+                self.frames_sent += 1
+                self.send_latency.record(self.last_progress - self.current_queued)
+
+    def stats(self):
+        return {'name': self.name, 'frames_sent': self.frames_sent, 'frames_dropped': self.frames_dropped,
+                'bytes_sent': self.bytes_sent, 'queued': len(self.queue) + (self.current is not None),
+                'keyframes': self.keyframes, 'frames_suppressed': self.frames_suppressed,
+                'devices_sent': self.devices_sent, 'devices_suppressed': self.devices_suppressed,
+                'connected_for': time.monotonic() - self.connected, 'send_latency': self.send_latency.summary()}
+
+class FanOut():
+    '''
+    Streams published frames to every added client socket from a background selector thread.
+    on_disconnect(connection) is called (from that thread) whenever a client is dropped because of an error or a stall.
+    '''
+    def __init__(self, queue_size=QUEUE_SIZE, stall_timeout=STALL_TIMEOUT, on_disconnect=None, keyframe_interval=KEYFRAME_INTERVAL):
+        self.queue_size = queue_size
+        self.keyframe_interval = keyframe_interval
+        self.stall_timeout = stall_timeout
+        self.on_disconnect = on_disconnect
+
+        self.connections = []
+        self.added = [] #connections the selector thread has not registered yet
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.wake_reader, self.wake_writer = socket.socketpair() #wakes the selector when frames are published or clients added
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+
+        self.clients_added = 0
+        self.disconnects = 0
+        self.devices_invalid = 0 #devices left out of published frames because their id doesn't fit in a byte
+        self.running = False
+        self.thread = None
+
+    def __len__(self):
+        return len(self.connections)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='fanout', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stops the selector thread and closes every client socket.
+        '''
+        self.running = False
+        self._wake()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        with self.lock:
+            for connection in self.connections:
+                connection.sock.close()
+            self.connections = []
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+
+    def add(self, sock):
+        '''
+        Adds a connected client socket, it receives every frame published from now on.
+        '''
+        sock.setblocking(False)
+        connection = ClientConnection(sock, self.queue_size)
+        with self.lock:
+            self.connections.append(connection)
+            self.added.append(connection)
+            self.clients_added += 1
+        self._wake()
+        return connection
+
+    def publish(self, data):
+        '''
+        Queues one encoded frame for every client. Never blocks, however slow the clients are.
+        '''
+        if not data:
+            return
+        now = time.monotonic()
+        with self.lock:
+            for connection in self.connections:
+                connection.enqueue(data, now)
+        self._wake()
+
+    def publish_frame(self, device_ids, colours, encode):
+        '''
+        Queues one tick's colours (device_ids and an (n, 4) RGBA array) for every client, sending each only the devices it has not seen yet.
+        encode(device_ids, colours, keyframe) turns the devices to send into bytes. Clients needing the same devices share one encoding.
+        '''
+        device_ids = np.asarray(device_ids)
+        colours = np.asarray(colours, dtype=np.int16)
+        valid = (device_ids >= 0) & (device_ids < DEVICE_ID_LIMIT)
+        if not valid.all():
+            self.devices_invalid += int(np.count_nonzero(~valid))
+            device_ids, colours = device_ids[valid], colours[valid]
+        encoded = {}
+        now = time.monotonic()
+        with self.lock:
+            for connection in self.connections:
+                mask, keyframe = connection.changed(device_ids, colours, self.keyframe_interval)
+                if not keyframe and not mask.any():
+                    continue
+                key = (keyframe, mask.tobytes())
+                if key not in encoded:
+                    encoded[key] = encode(device_ids[mask], colours[mask], keyframe)
+                connection.enqueue(encoded[key], now)
+        if encoded:
+            self._wake()
+
+    def _wake(self):
+        try:
+            self.wake_writer.send(b'\0')
+        except OSError: #a wake up is already pending, or we are shutting down
+            pass
+
+    def _run(self):
+        #every client is watched for reads (the API clients never send anything, so a readable socket means it closed) and for writes while it has data queued
+        while self.running:
+            with self.lock:
+                added, self.added = self.added, []
+                connections = list(self.connections)
+            for connection in added:
+                self.selector.register(connection.sock, selectors.EVENT_READ, connection)
+
+            self._flush(connections)
+
+            with self.lock:
+                connections = list(self.connections)
+            registered = self.selector.get_map()
+            for connection in connections:
+                key = registered.get(connection.sock)
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.pending() else 0)
+                if key is not None and key.events != events:
+                    self.selector.modify(connection.sock, events, connection)
+
+            for key, events in self.selector.select(SELECT_TIMEOUT):
+                if key.data is None:
+                    self._drain_wake()
+                elif events & selectors.EVENT_READ:
+                    self._check_closed(key.data)
+
+    def _drain_wake(self):
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def _check_closed(self, connection):
+        try:
+            closed = not connection.sock.recv(4096)
+        except BlockingIOError:
+            closed = False
+        except OSError:
+            closed = True
+        if closed:
+            self._disconnect(connection)
+
+    def _flush(self, connections):
+        now = time.monotonic()
+        for connection in connections:
+            with self.lock:
+                try:
+                    connection.flush()
+                    failed = connection.pending() and now - connection.last_progress > self.stall_timeout
+                except OSError:
+                    failed = True
+            if failed:
+                self._disconnect(connection)
+
+    def _disconnect(self, connection):
+        with self.lock:
+            if connection not in self.connections:
+                return
+            self.connections.remove(connection)
+            self.disconnects += 1
+        try:
+            self.selector.unregister(connection.sock)
+        except (KeyError, ValueError):
+            pass
+        connection.sock.close()
+        if self.on_disconnect is not None:
+            self.on_disconnect(connection)
+
+    def stats(self):
+        with self.lock:
+            clients = [connection.stats() for connection in self.connections]
+        totals = {name: sum(client[name] for client in clients)
+                  for name in ('frames_sent', 'frames_dropped', 'frames_suppressed', 'devices_sent', 'devices_suppressed', 'bytes_sent')}
+        return dict(totals, clients=clients, clients_added=self.clients_added, disconnects=self.disconnects, devices_invalid=self.devices_invalid)
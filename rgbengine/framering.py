@@ -0,0 +1,223 @@
+'''
+Shared memory transport for frames, for consumers running on the same machine as the engine.
+
+Over the client port every consumer gets its own copy of every frame, encoded, sent through the kernel and received again. A frame ring is
+instead a block of shared memory the server writes each frame into once, which any number of consumer processes can read the newest frame from
+without a syscall. All fields are little endian, and every slot holds one complete protocol frame (binary keyframes, or LED frames):
+
+    HEADER   MAGIC (8 bytes)  VERSION (4 bytes)  SLOT_COUNT (4 bytes)  SLOT_SIZE (4 bytes)  padding (4 bytes)  LATEST (8 bytes)
+    SLOT     STAMP (8 bytes)  LENGTH (4 bytes)  padding (4 bytes)  FRAME (SLOT_SIZE bytes)
+
+LATEST is the sequence number of the newest complete frame (0 before the first), which is in slot LATEST % SLOT_COUNT. Each slot's STAMP is a
+seqlock: the writer sets it to 2 * sequence - 1 (odd) before touching the slot and to 2 * sequence once the frame is complete, so a reader that
+sees the same even STAMP before and after reading a slot knows that the writer did not change the frame underneath it. Readers only ever read,
+so they can't slow the writer down, and a reader that falls behind simply skips to the newest frame.
+
+The writer never waits and the readers never block, so consumers have to poll. Python has no memory fences, the check relies on the stores
+happening in program order, which they do on x86 and in practice on the platforms numpy supports, since each one is a separate C call.
+'''
+
+import struct
+import time
+
+from multiprocessing import shared_memory
+import numpy as np
+
+from rgbengine.ports import FRAME_RING
+
+MAGIC = b'RGBRING\x00'
+RING_VERSION = 1
+RING_HEADER = struct.Struct('<8sIIII')
+LATEST_OFFSET = RING_HEADER.size
+HEADER_SIZE = LATEST_OFFSET + 8
+SLOT_HEADER_SIZE = 16
+SLOT_COUNT = 8 #frames a reader can fall behind by while it is reading before its slot is reused
+SLOT_SIZE = 64 * 1024 #bytes of frame per slot, 250 devices take 1270 bytes and every supported device's LEDs 800
+READ_RETRIES = 16
+
+_created = set() #rings written by this process, which its readers share the resource tracker registration of
+
+class RingError(ValueError):
+    '''
+    Raised for shared memory that is not a frame ring, or frames that do not fit in one.
+    '''
+
+class FrameRing():
+    '''
+    The layout of a frame ring over a SharedMemory block, shared by FrameRingWriter and FrameRingReader.
+    '''
+    def __init__(self, memory, slot_count, slot_size):
+        self.memory = memory
+        self.name = memory.name
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        buffer = memory.buf
+        self.latest = np.ndarray((1,), dtype='<u8', buffer=buffer, offset=LATEST_OFFSET)
+        stride = SLOT_HEADER_SIZE + slot_size
+        self.stamps = np.ndarray((slot_count,), dtype='<u8', buffer=buffer, offset=HEADER_SIZE, strides=(stride,))
+        self.lengths = np.ndarray((slot_count,), dtype='<u4', buffer=buffer, offset=HEADER_SIZE + 8, strides=(stride,))
+        self.slots = np.ndarray((slot_count, slot_size), dtype=np.uint8, buffer=buffer, offset=HEADER_SIZE + SLOT_HEADER_SIZE, strides=(stride, 1))
+
+    @staticmethod
+    def size(slot_count, slot_size):
+        return HEADER_SIZE + slot_count * (SLOT_HEADER_SIZE + slot_size)
+
+    def close(self):
+        #every view into the block has to go before it can be closed
+        self.latest = self.stamps = self.lengths = self.slots = None
+        try:
+            self.memory.close()
+        except BufferError: #a reader's views are still alive, they keep the mapping until they go
+            pass
+
+class FrameRingWriter(FrameRing):
+    '''
+    Creates a frame ring called name and writes frames into it. close() also removes it, so consumers attached to it stop seeing new frames.
+    An existing ring of the same name, e.g. one left behind by a writer that was killed, is replaced.
+    '''
+    def __init__(self, name=FRAME_RING, slot_count=SLOT_COUNT, slot_size=SLOT_SIZE):
+        size = FrameRing.size(slot_count, slot_size)
+        try:
+            memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            memory = shared_memory.SharedMemory(name, create=True, size=size)
+        _created.add(memory.name)
+        RING_HEADER.pack_into(memory.buf, 0, MAGIC, RING_VERSION, slot_count, slot_size, 0)
+        FrameRing.__init__(self, memory, slot_count, slot_size)
+        self.latest[0] = 0
+        self.stamps[:] = 0
+        self.sequence = 0
+        self.frames = 0
+
+    def write(self, frame):
+        '''
+        Copies one encoded frame (any bytes-like object) into the next slot and publishes it. Returns the frame's ring sequence number.
+        '''
+        frame = np.frombuffer(frame, dtype=np.uint8)
+        if len(frame) > self.slot_size:
+            raise RingError("a frame of " + str(len(frame)) + " bytes does not fit in slots of " + str(self.slot_size))
+        sequence = self.sequence + 1
+        slot = sequence % self.slot_count
+        self.stamps[slot] = 2 * sequence - 1
+        self.slots[slot, :len(frame)] = frame
+        self.lengths[slot] = len(frame)
+        self.stamps[slot] = 2 * sequence
+        self.latest[0] = sequence
+        self.sequence = sequence
+        self.frames += 1
+        return sequence
+
+    def close(self):
+        if self.memory is None:
+            return
+        memory = self.memory
+        FrameRing.close(self)
+        self.memory = None
+        try:
+            memory.unlink()
+        except FileNotFoundError:
+            pass
+        _created.discard(memory.name)
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False) #python 3.13 and up, readers must not remove the ring when they exit
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        if memory.name in _created:
+            return memory
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        except (ImportError, AttributeError, KeyError): #windows has no resource tracker, the block goes with its last handle
+            pass
+        return memory
+
+class FrameRingReader(FrameRing):
+    '''
+    Attaches to an existing frame ring. read() returns the newest frame not read yet, as a copy in the reader's own buffer,
+    view() returns it in place for consumers that check valid() once they are done with it.
+    Raises FileNotFoundError if no ring called name exists (the engine is not running, or not writing one).
+    '''
+    def __init__(self, name=FRAME_RING):
+        memory = _attach(name)
+        if memory.size < HEADER_SIZE:
+            memory.close()
+            raise RingError(name + " is too small to be a frame ring")
+        magic, version, slot_count, slot_size, padding = RING_HEADER.unpack_from(memory.buf, 0)
+        if magic != MAGIC or version != RING_VERSION or memory.size < FrameRing.size(slot_count, slot_size):
+            memory.close()
+            raise RingError(name + " is not a frame ring this version can read")
+        FrameRing.__init__(self, memory, slot_count, slot_size)
+        self.last_sequence = 0
+        self.buffer = np.empty(slot_size, dtype=np.uint8)
+        self.skipped = 0 #frames the writer published that this reader never saw
+        self.retries = 0 #reads that raced the writer and had to start again
+
+    def _newest(self):
+        sequence = int(self.latest[0])
+        if sequence == 0 or sequence == self.last_sequence:
+            return None
+        return sequence
+
+    def read(self):
+        '''
+        Returns (sequence, memoryview of the frame) for the newest frame, or None if nothing new has been written. The memoryview is into
+        the reader's buffer, so it stays valid until the next read().
+        '''
+        for attempt in range(READ_RETRIES):
+            sequence = self._newest()
+            if sequence is None:
+                return None
+            slot = sequence % self.slot_count
+            stamp = int(self.stamps[slot])
+            if stamp != 2 * sequence: #already being overwritten, so there is a newer frame
+                self.retries += 1
+                continue
+            length = int(self.lengths[slot])
+            self.buffer[:length] = self.slots[slot, :length]
+            if int(self.stamps[slot]) == stamp:
+                self._seen(sequence)
+                return sequence, memoryview(self.buffer)[:length]
+            self.retries += 1
+        return None
+
+    def view(self):
+        '''
+        Returns (sequence, memoryview into the ring) for the newest frame without copying it, or None if nothing new has been written.
+        The writer may reuse the slot at any time, so anything read through the view only counts if valid(sequence) is still true afterwards.
+        '''
+        sequence = self._newest()
+        if sequence is None:
+            return None
+        slot = sequence % self.slot_count
+        if int(self.stamps[slot]) != 2 * sequence:
+            self.retries += 1
+            return None
+        length = int(self.lengths[slot])
+        self._seen(sequence)
+        return sequence, memoryview(self.slots[slot])[:length]
+
+    def valid(self, sequence):
+        return int(self.stamps[sequence % self.slot_count]) == 2 * sequence
+
+    def _seen(self, sequence):
+        if self.last_sequence:
+            self.skipped += max(0, sequence - self.last_sequence - 1)
+        self.last_sequence = sequence
+
+    def wait(self, timeout=None, poll_interval=0.001):
+        '''
+        Polls until a new frame can be read and returns read()'s result, or None once timeout seconds pass.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            result = self.read()
+            if result is not None:
+                return result
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
@@ -0,0 +1,155 @@
+'''
+User defined patterns, described as data instead of another state machine in patterns.py and server.cpp.
+
+A keyframe pattern is a list of colours the device moves through, each one held for a while and then eased into the next:
+
+    {
+        "keyframes": [
+            {"colour": [255, 40, 0], "hold": 20, "ease": "smooth"},
+            {"colour": [120, 0, 160]},
+            {"colour": null, "ease": "step"}
+        ],
+        "period": 200,
+        "ease": "linear",
+        "loop": true
+    }
+
+    colour   the keyframe's RGB colour, or null for the colour the device line gives (so one pattern works with any colour the user picks)
+    hold     pattern updates the colour stays on once it is reached, 0 by default
+    ease     how the fade away from the keyframe moves (see EASINGS), the pattern's own ease by default, which defaults to linear
+    period   pattern updates from the first keyframe back to it again (or to the last one, without loop). Whatever the holds leave of it is split
+             evenly between the fades, so a period of exactly len(keyframes) plus the holds cuts straight from colour to colour
+    loop     false plays the keyframes once and stays on the last one
+
+Times are counted in pattern updates like the built in patterns' (PULSE_HOLD and the rest), so the device line's speed still applies: fast is
+20 updates a second, medium 10 and slow 20 / 3.
+
+A pattern is compiled once into a PatternCycle, the same kind of colour table the built in patterns are cached as (see cycles.py), which the
+engine plays back by indexing. Custom patterns cost exactly what a cached static pattern does per tick, however many keyframes they have.
+CycleCache keys them by their definition, not their name, so reloading a profile reuses the tables and editing a pattern never shows the old one.
+'''
+
+import json
+
+import numpy as np
+
+from rgbengine.cycles import PatternCycle, MAX_CYCLE_STEPS
+from rgbengine.leds import SPATIAL_PATTERNS
+from rgbengine.patterns import PATTERN_LIST
+from rgbengine.transitions import ease
+
+EASINGS = {
+    'linear': lambda progress: progress,
+    'smooth': ease,
+    'in': lambda progress: progress * progress,
+    'out': lambda progress: progress * (2 - progress),
+    'step': lambda progress: np.zeros_like(progress), #stays on the colour for the whole fade, then cuts to the next
+}
+DEFAULT_EASE = 'linear'
+MAX_NAME_LENGTH = 32
+
+class PatternError(ValueError):
+    '''
+    Raised for pattern definitions that can't be compiled.
+    '''
+
+def _whole_number(value, name):
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise PatternError(name + " must be a whole number of pattern updates, got " + repr(value))
+    return value
+
+class KeyframePattern():
+    '''
+    A validated keyframe pattern definition. Raises PatternError if the definition is invalid.
+    key identifies the definition for caching, compile() builds its PatternCycle for a device colour.
+    '''
+    def __init__(self, definition):
+        if not isinstance(definition, dict) or not isinstance(definition.get('keyframes'), list) or not definition['keyframes']:
+            raise PatternError("a pattern needs a non empty list of keyframes")
+        default_ease = definition.get('ease', DEFAULT_EASE)
+        if default_ease not in EASINGS:
+            raise PatternError("unknown ease " + repr(default_ease) + ", use one of " + ", ".join(EASINGS))
+        self.loop = definition.get('loop', True)
+        if not isinstance(self.loop, bool):
+            raise PatternError("loop must be true or false")
+
+        self.keyframes = []
+        for keyframe in definition['keyframes']:
+            if not isinstance(keyframe, dict):
+                raise PatternError("every keyframe must be an object, got " + repr(keyframe))
+            colour = keyframe.get('colour')
+            if colour is not None:
+                if (not isinstance(colour, list) or len(colour) != 3
+                        or not all(isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 255 for value in colour)):
+                    raise PatternError("a keyframe colour must be [r, g, b] between 0 and 255, or null, got " + repr(colour))
+                colour = list(colour)
+            hold = _whole_number(keyframe.get('hold', 0), "hold")
+            keyframe_ease = keyframe.get('ease', default_ease)
+            if keyframe_ease not in EASINGS:
+                raise PatternError("unknown ease " + repr(keyframe_ease) + ", use one of " + ", ".join(EASINGS))
+            self.keyframes.append({'colour': colour, 'hold': hold, 'ease': keyframe_ease})
+        if not self.loop and len(self.keyframes) < 2:
+            raise PatternError("a pattern that doesn't loop needs at least two keyframes")
+
+        #every keyframe is shown once plus its hold, the last one's hold only counts if the pattern loops back from it
+        fading = self.keyframes if self.loop else self.keyframes[:-1]
+        shown = len(fading) + sum(keyframe['hold'] for keyframe in fading)
+        self.period = _whole_number(definition.get('period', shown), "period")
+        if not shown <= self.period <= MAX_CYCLE_STEPS:
+            raise PatternError("period must be between " + str(shown) + " (the keyframes and their holds) and " + str(MAX_CYCLE_STEPS)
+                               + ", got " + str(self.period))
+        fades, extra = divmod(self.period - shown, len(fading))
+        self.fades = [fades + (index < extra) for index in range(len(fading))]
+        self.uses_device_colour = any(keyframe['colour'] is None for keyframe in self.keyframes)
+        self.key = json.dumps({'keyframes': self.keyframes, 'period': self.period, 'loop': self.loop}, sort_keys=True)
+
+    def definition(self):
+        '''
+        Returns the pattern as a JSON serializable dict, with every default filled in.
+        '''
+        return {'keyframes': [dict(keyframe) for keyframe in self.keyframes], 'period': self.period, 'loop': self.loop}
+
+    def compile(self, r, g, b):
+        '''
+        Returns the PatternCycle of the pattern for a device whose own colour is r, g, b: row k of its table is the colour after k updates.
+        '''
+        device_colour = [int(r), int(g), int(b)]
+        colours = np.array([keyframe['colour'] if keyframe['colour'] is not None else device_colour for keyframe in self.keyframes],
+                           dtype=np.float32)
+        rows = []
+        for index, fades in enumerate(self.fades):
+            keyframe = self.keyframes[index]
+            start, end = colours[index], colours[(index + 1) % len(colours)]
+            rows.append(np.repeat(start[np.newaxis], 1 + keyframe['hold'], axis=0))
+            if fades:
+                #strictly between the two keyframes, the next keyframe's own row follows
+                progress = EASINGS[keyframe['ease']](np.arange(1, fades + 1, dtype=np.float32) / (fades + 1))
+                rows.append(start + (end - start) * progress[:, np.newaxis])
+        if not self.loop:
+            rows.append(colours[-1:])
+        rgb = np.rint(np.concatenate(rows))
+        table = np.empty((len(rgb), 4), dtype=np.uint8)
+        table[:, :3] = rgb
+        table[:, 3] = 255 #alpha is the device line's, the engine never reads it from the table
+        if self.loop:
+            return PatternCycle(table, 0, len(table))
+        return PatternCycle(table, len(table) - 1, 1)
+
+def parse_patterns(definitions):
+    '''
+    Returns {name: KeyframePattern} for a dict of pattern definitions by name, as saved in profiles.json and sent to the engine.
+    Raises PatternError for an invalid definition, or a name that is taken by a built in pattern or can't be used in a profile.
+    '''
+    if not isinstance(definitions, dict):
+        raise PatternError("patterns must be an object of definitions by name")
+    patterns = {}
+    for name, definition in definitions.items():
+        if name in PATTERN_LIST or name in SPATIAL_PATTERNS:
+            raise PatternError(name + " is a built in pattern")
+        if not name or len(name) > MAX_NAME_LENGTH or len(name.split()) != 1:
+            raise PatternError("invalid pattern name " + repr(name))
+        try:
+            patterns[name] = KeyframePattern(definition)
+        except PatternError as error:
+            raise PatternError(name + ": " + str(error))
+    return patterns
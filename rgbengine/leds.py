@@ -0,0 +1,201 @@
+'''
+Per LED rendering on top of the PatternEngine.
+
+The engine (like server.cpp and the 14 byte message) has one colour per device, which the Corsair client paints onto every LED of the device.
+LedRenderer instead gives every device the number of LEDs in its layout (DEVICE_LAYOUTS, indexed by the same device ids as SUPPORTED_DEVICES),
+each with a position, and renders all of them into one contiguous (LEDs, 4) uint8 block:
+
+    - devices running one of the engine's patterns show the engine's colour on every LED
+    - devices running a spatial pattern (wave, gradient or ripple) get that effect computed from the LED positions, using the device's
+      colour, alpha and speed
+
+Every LED of every device is computed with whole-array operations, so a frame costs the same few numpy calls at 3 LEDs or 300 and no Python
+object is made per LED. frame() renders straight into a protocol LED frame (see LedFrameWriter) and returns a memoryview of it,
+which the fan-out sends without copying.
+
+Pattern changes fade per LED, so spatial effects fade in and out like every other pattern (see transitions.py): freeze() holds the LEDs last
+rendered, and frames rendered with a fade weight are blended from them LED by LED. Unlike the device colours of the other wire formats, the
+outgoing LEDs don't keep moving during the fade, an effect is only rendered for the engine's current devices.
+'''
+
+import numpy as np
+
+from rgbengine.patterns import NANOSECONDS
+from rgbengine.protocol import LedFrameWriter
+
+SPATIAL_PATTERNS = ['wave', 'gradient', 'ripple']
+WAVE, GRADIENT, RIPPLE = range(1, len(SPATIAL_PATTERNS) + 1) #0 is every non spatial pattern
+
+EFFECT_RATES = (0.25, 0.5, 1.0) #cycles per second of the spatial patterns for the slow, medium and fast speeds
+WAVE_LENGTH = 0.5 #of the device's width
+GRADIENT_SPAN = 1.0 #hue turns across the device's width
+RIPPLE_SPACING = 0.25 #distance between rings, the device is 1 wide
+RIPPLE_SHARPNESS = 4 #higher makes thinner rings
+
+def grid_layout(rows):
+    '''
+    Positions for LEDs in rows (a list of LED counts per row), each row spread across the full width, e.g. a keyboard.
+    '''
+    positions = []
+    for row, count in enumerate(rows):
+        for column in range(count):
+            positions.append((column / max(count - 1, 1), row / max(len(rows) - 1, 1)))
+    return np.array(positions, dtype=np.float32)
+
+def line_layout(count):
+    return grid_layout([count])
+
+def ring_layout(count):
+    angles = np.arange(count) * (2 * np.pi / count)
+    return np.stack([0.5 + 0.5 * np.cos(angles), 0.5 + 0.5 * np.sin(angles)], axis=1).astype(np.float32)
+
+#LED positions (x and y from 0 to 1) of every supported device, by device id. Device 0 ('All') covers every one of them
+DEVICE_LAYOUTS = {
+    1: grid_layout([17, 21, 21, 17, 17, 11]), #keyboard, 104 keys
+    2: grid_layout([1, 1, 1]), #mouse: logo, wheel and side strip
+    3: line_layout(10), #memory module
+    4: grid_layout([10] * 6), #led hub, 6 strips of 10
+    5: ring_layout(16), #cooler fan ring
+    6: line_layout(2), #headset, left and right
+}
+
+def hues_to_rgb(hues):
+    '''
+    Fully saturated colours for hues from 0 to 1, as an (n, 3) float array from 0 to 1.
+    '''
+    sixths = hues[:, None] * 6 - np.array([3, 2, 4], dtype=np.float32)
+    rgb = np.abs(sixths)
+    rgb[:, 0] -= 1
+    rgb[:, 1:] = 2 - rgb[:, 1:]
+    return np.clip(rgb, 0, 1)
+
+class LedRenderer():
+    '''
+    Renders every LED of every device the engine is displaying. The per LED tables are rebuilt only when the engine's devices change.
+    '''
+    def __init__(self, engine, layouts=DEVICE_LAYOUTS):
+        self.engine = engine
+        self.layouts = layouts
+        self.devices = None #the engine's devices the tables below were built for
+        self.writer = LedFrameWriter([], [])
+        self.shown = [] #(device id, LED count) of every device in the frame, in order
+        self.last = None #(shown, LED block) last rendered, what freeze() holds
+        self.still = None #{device id: (first row, LED count)} of the held LEDs in still_leds, to fade from
+        self.still_leds = None
+        self.still_sources = None #for every LED, its row in still_leds or -1
+
+    def _rebuild(self):
+        '''
+        Works out which physical devices are shown and builds the per LED tables: the engine slot each LED takes its pattern from,
+        its position and which spatial effect (if any) it runs.
+        '''
+        self.devices = list(self.engine.devices)
+        slots = {}
+        for slot, device in enumerate(self.devices):
+            slots[int(device[0])] = slot
+        shown = [] #(device id, slot), a device's own slot wins over 'All'
+        for device_id in sorted(self.layouts):
+            if device_id in slots:
+                shown.append((device_id, slots[device_id]))
+            elif 0 in slots:
+                shown.append((device_id, slots[0]))
+
+        counts = [len(self.layouts[device_id]) for device_id, slot in shown]
+        self.shown = [(device_id, count) for (device_id, slot), count in zip(shown, counts)]
+        self.still_sources = None
+        self.writer = LedFrameWriter([device_id for device_id, slot in shown], counts)
+        self.led_slot = np.repeat(np.array([slot for device_id, slot in shown], dtype=np.intp), counts)
+        positions = [self.layouts[device_id] for device_id, slot in shown]
+        self.positions = np.concatenate(positions) if positions else np.zeros((0, 2), dtype=np.float32)
+
+        effects = np.array([SPATIAL_PATTERNS.index(device[6]) + 1 if device[6] in SPATIAL_PATTERNS else 0 for device in self.devices],
+                           dtype=np.int8)
+        self.led_effect = effects[self.led_slot] if len(self.led_slot) else np.zeros(0, dtype=np.int8)
+        self.effect_leds = {effect: np.flatnonzero(self.led_effect == effect) for effect in (WAVE, GRADIENT, RIPPLE)}
+        self.plain_leds = np.flatnonzero(self.led_effect == 0)
+
+    def freeze(self):
+        '''
+        Holds the LEDs last rendered, i.e. what is showing, for frames rendered with a fade to fade from.
+        '''
+        if self.last is None:
+            return
+        shown, leds = self.last
+        offsets = np.concatenate(([0], np.cumsum([count for device_id, count in shown], dtype=np.intp)))
+        self.still = {device_id: (offsets[index], count) for index, (device_id, count) in enumerate(shown)}
+        self.still_leds = leds.copy()
+        self.still_sources = None
+
+    def _fade(self, out, weight):
+        #every LED of a device that was showing before fades from its held colour, the rest show straight away
+        if self.still_sources is None:
+            sources = np.full(len(out), -1, dtype=np.intp)
+            start = 0
+            for device_id, count in self.shown:
+                held = self.still.get(device_id)
+                if held is not None and held[1] == count:
+                    sources[start:start + count] = np.arange(held[0], held[0] + count)
+                start += count
+            self.still_sources = sources
+        sources = self.still_sources
+        fading = sources >= 0
+        blended = out[fading].astype(np.float32)
+        blended += (self.still_leds[sources[fading]] - blended) * np.float32(weight)
+        out[fading] = np.rint(blended)
+
+    def render(self, out, seconds=None, colours=None, fade=0):
+        '''
+        Renders every LED into out, a (LEDs, 4) uint8 array. seconds is the pattern time for the spatial effects, the engine's clock by default.
+        colours replaces the engine's frame as the device colours. fade is how much of the LEDs held by freeze() is still showing, from 1 down
+        to 0, e.g. a Transition's weight.
+        '''
+        if self.devices != self.engine.devices:
+            self._rebuild()
+        if seconds is None:
+            seconds = self.engine.clock / NANOSECONDS
+        engine = self.engine
+        if colours is None:
+            colours = engine.frame()
+
+        plain = self.plain_leds
+        if len(plain):
+            out[plain] = colours[self.led_slot[plain]]
+
+        for effect, leds in self.effect_leds.items():
+            if not len(leds):
+                continue
+            slots = self.led_slot[leds]
+            x, y = self.positions[leds, 0], self.positions[leds, 1]
+            speeds = engine.speed[slots]
+            rates = np.where((speeds >= 0) & (speeds < len(EFFECT_RATES)), np.take(EFFECT_RATES, np.clip(speeds, 0, len(EFFECT_RATES) - 1)), 0)
+            phase = (seconds * rates).astype(np.float32)
+            base = colours[slots, :3].astype(np.float32)
+
+            if effect == WAVE:
+                level = 0.5 + 0.5 * np.sin(2 * np.pi * (x / WAVE_LENGTH - phase))
+                rgb = base * level[:, None]
+            elif effect == GRADIENT:
+                rgb = hues_to_rgb((x * GRADIENT_SPAN + phase) % 1) * 255
+            else:
+                distance = np.hypot(x - 0.5, y - 0.5)
+                level = (0.5 + 0.5 * np.cos(2 * np.pi * (distance / RIPPLE_SPACING - phase))) ** RIPPLE_SHARPNESS
+                rgb = base * level[:, None]
+            out[leds, :3] = rgb
+            out[leds, 3] = colours[slots, 3]
+
+        if fade > 0 and self.still is not None:
+            self._fade(out, fade)
+        elif fade <= 0:
+            self.still = self.still_sources = self.still_leds = None #the fade is over
+        self.last = (self.shown, out)
+        return out
+
+    def frame(self, sequence, timestamp=None, seconds=None, colours=None, fade=0):
+        '''
+        Renders every LED into a new protocol LED frame, returned as a memoryview ready to publish.
+        '''
+        if self.devices != self.engine.devices:
+            self._rebuild()
+        frame, leds = self.writer.allocate(sequence, timestamp)
+        self.render(leds, seconds, colours, fade)
+        return memoryview(frame)
@@ -0,0 +1,223 @@
+'''
+Stand-in API clients for testing and benchmarking on any platform.
+LoopbackClient connects to the server port like corsairAPIclient and razerAPIclient do, SharedFrameClient reads the engine's frame ring
+(see framering.py) instead. Rather than driving devices, both just decode and record what they receive.
+
+Run as a module, a stand-in client runs in its own process for a while and prints its stats as JSON, which is how benchmarks/suite.py compares
+the two transports with consumers that do not share the engine's interpreter:
+
+    python -m rgbengine.loopback --port 50025 --seconds 5
+    python -m rgbengine.loopback --ring rgbcontroller-frames --seconds 5
+'''
+
+import argparse
+from collections import deque
+import json
+import socket
+import sys
+import threading
+import time
+
+from rgbengine.framering import FrameRingReader
+from rgbengine.ports import FRAME_RING
+from rgbengine.protocol import HOST, PORT, LENGTH, LEGACY_MESSAGE_SIZE, FrameDecoder, decode_frame, decode_message
+
+POLL_INTERVAL = 0.0005 #seconds a SharedFrameClient sleeps when no new frame has been written
+
+class LoopbackClient():
+    '''
+    Receives frames on a background thread and keeps the latest colour of every device, along with counters for what arrived.
+    With legacy=True it reads the 14 byte ASCII messages that server.cpp sends instead of binary frames.
+    '''
+    def __init__(self, host=HOST, port=PORT, legacy=False, name='loopback'):
+        self.host = host
+        self.port = port
+        self.legacy = legacy
+        self.name = name
+
+        self.colours = {} #device_id -> (r, g, b, a)
+        self.leds = {} #device_id -> (LEDs, 4) view of the last LED frame, for LED frames
+        self.updated = {} #device_id -> the value of frames when its colour last arrived, to tell which of two devices was sent last
+        self.frames = 0 #binary frames, or legacy messages
+        self.bytes = 0
+        self.recv_calls = 0
+        self.decode_time = 0.0 #seconds spent decoding
+        self.latencies = deque(maxlen=10000) #seconds between a frame being encoded and it being decoded here (binary frames only)
+        self.last_sequence = None
+
+        self.sock = None
+        self.thread = None
+        self.condition = threading.Condition()
+
+    def connect(self, timeout=5):
+        self.sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        self.sock.settimeout(None)
+        self.thread = threading.Thread(target=self._receive, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _receive(self):
+        decoder = FrameDecoder()
+        leftover = b''
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            received = time.monotonic_ns()
+            start = time.perf_counter()
+
+            with self.condition:
+                self.recv_calls += 1
+                self.bytes += len(data)
+                if self.legacy:
+                    #legacy messages have no framing, so split the stream every 14 bytes ourselves
+                    data = leftover + data
+                    usable = len(data) - len(data) % LEGACY_MESSAGE_SIZE
+                    for offset in range(0, usable, LEGACY_MESSAGE_SIZE):
+                        device_id, r, g, b, a = decode_message(data[offset:offset + LEGACY_MESSAGE_SIZE])
+                        self.colours[device_id] = (r, g, b, a)
+                        self.updated[device_id] = self.frames
+                        self.frames += 1
+                    leftover = data[usable:]
+                else:
+                    for frame in decoder.feed(data):
+                        self._record_frame(frame, received)
+                self.decode_time += time.perf_counter() - start
+                self.condition.notify_all()
+
+    def _record_frame(self, frame, received):
+        for device in frame.devices():
+            self.colours[device[0]] = device[1:]
+            self.updated[device[0]] = self.frames
+        if frame.has_leds:
+            for index, device_id in enumerate(frame.device_ids):
+                self.leds[int(device_id)] = frame.device_leds(index)
+                self.updated[int(device_id)] = self.frames
+        self.frames += 1
+        self.last_sequence = frame.sequence
+        self.latencies.append((received - frame.timestamp) / 1e9)
+
+    def wait_for(self, predicate, timeout=5):
+        '''
+        Blocks until predicate(self) is true or the timeout passes, returning the predicate's last result.
+        '''
+        with self.condition:
+            return self.condition.wait_for(lambda: predicate(self), timeout=timeout)
+
+    def wait_for_colour(self, device_id, colour, timeout=5):
+        '''
+        Blocks until device_id shows colour (an (r, g, b, a) tuple), returns False on timeout.
+        '''
+        colour = tuple(int(value) for value in colour)
+        return self.wait_for(lambda client: client.colours.get(device_id) == colour, timeout)
+
+    def stats(self):
+        with self.condition:
+            latencies = sorted(self.latencies)
+            return {'frames': self.frames, 'bytes': self.bytes, 'recv_calls': self.recv_calls,
+                    'decode_time': self.decode_time, 'last_sequence': self.last_sequence,
+                    'mean_latency': sum(latencies) / len(latencies) if latencies else None,
+                    'p95_latency': latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None}
+
+class SharedFrameClient(LoopbackClient):
+    '''
+    A LoopbackClient that polls the engine's frame ring instead of reading a socket, so it only ever sees the newest frame:
+    frames written while it was busy are counted as skipped rather than queued. recv_calls counts the polls that found a new frame.
+    '''
+    def __init__(self, ring=FRAME_RING, poll_interval=POLL_INTERVAL, name='shared-frames'):
+        LoopbackClient.__init__(self, name=name)
+        self.ring = ring
+        self.poll_interval = poll_interval
+        self.reader = None
+        self.running = False
+        self.skipped = 0
+
+    def connect(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.reader is None:
+            try:
+                self.reader = FrameRingReader(self.ring)
+            except FileNotFoundError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+        self.running = True
+        self.thread = threading.Thread(target=self._receive, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        if self.reader is not None:
+            self.reader.close()
+
+    def _receive(self):
+        reader = self.reader
+        while self.running:
+            result = reader.read()
+            if result is None:
+                time.sleep(self.poll_interval)
+                continue
+            received = time.monotonic_ns()
+            start = time.perf_counter()
+            sequence, data = result
+            frame = decode_frame(bytes(data[LENGTH.size:]))
+            with self.condition:
+                self.recv_calls += 1
+                self.bytes += len(data)
+                self._record_frame(frame, received)
+                self.skipped = reader.skipped
+                self.decode_time += time.perf_counter() - start
+                self.condition.notify_all()
+
+    def stats(self):
+        stats = LoopbackClient.stats(self)
+        stats['skipped'] = self.skipped
+        return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a stand-in API client and print what it received as JSON.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--legacy', action='store_true', help="read server.cpp's 14 byte messages instead of binary frames")
+    parser.add_argument('--ring', help="read this frame ring instead of connecting to the port")
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    client = SharedFrameClient(args.ring) if args.ring else LoopbackClient(args.host, args.port, legacy=args.legacy)
+    client.connect()
+    cpu_start, start = time.process_time(), time.monotonic()
+    frames = client.stats()['frames']
+    time.sleep(args.seconds)
+    stats = client.stats()
+    stats['cpu_time'] = time.process_time() - cpu_start
+    stats['elapsed'] = time.monotonic() - start
+    stats['frame_rate'] = (stats['frames'] - frames) / stats['elapsed']
+    client.close()
+    json.dump(stats, sys.stdout)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
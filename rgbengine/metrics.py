@@ -0,0 +1,51 @@
+'''
+Cheap runtime metrics for the engine, reported by the control socket's stats command (see server.py).
+
+Timings go into fixed histograms rather than lists of samples, so recording one costs a bisect and an increment however long the engine runs,
+and a snapshot is a handful of numbers no matter how many ticks it covers.
+'''
+
+import bisect
+
+#bucket upper bounds in milliseconds, roughly 1.5x apart from 10 microseconds to 10 seconds
+BUCKET_BOUNDS = tuple(round(0.01 * 1.5 ** power, 4) for power in range(35))
+
+class Histogram():
+    '''
+    Counts durations (recorded in seconds) into BUCKET_BOUNDS. Percentiles are the upper bound of the bucket they fall in (or the largest
+    value recorded, if that is smaller), so they are never under-reported and over-reported by at most one bucket's width.
+    '''
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1) #the last bucket holds everything over the largest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        milliseconds = seconds * 1000
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        if milliseconds > self.max:
+            self.max = milliseconds
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        '''
+        Returns the histogram as a dict of milliseconds: count, mean, p50, p95, p99 and max, along with the non-empty buckets.
+        '''
+        return {'count': self.count, 'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(0.5), 'p95': self.percentile(0.95), 'p99': self.percentile(0.99),
+                'max': self.max if self.count else None,
+                'buckets': {str(BUCKET_BOUNDS[index]) if index < len(BUCKET_BOUNDS) else 'inf': count
+                            for index, count in enumerate(self.buckets) if count}}
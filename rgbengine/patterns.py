@@ -0,0 +1,487 @@
+'''
+In-process pattern engine, a vectorized port of the pattern state machines in rgbsyncserver/server.cpp.
+Instead of one struct rgb per device, every piece of pattern state is held in its own array (structure-of-arrays), indexed by device slot,
+so a single call to step() advances every device at once using masked array operations rather than a per-device function pointer.
+The results are tick-for-tick identical to the C++ patterns (randomstrobe aside, which depends on the random number generator).
+Given a CycleCache (see cycles.py), deterministic patterns are not stepped at all, their colours are looked up from a precomputed cycle table.
+User defined keyframe patterns (see keyframes.py) are always played back from their compiled table, cached or not.
+'''
+
+import numpy as np
+
+PATTERN_LIST = ['static', 'pulse', 'rainbowpulse', 'rainbowcycle', 'randomstrobe', 'fire'] #must match the strcmp chain in server.cpp main()
+PATTERN_CODES = {pattern: code for code, pattern in enumerate(PATTERN_LIST)}
+
+STATIC, PULSE, RAINBOW_PULSE, RAINBOW_CYCLE, RANDOM_STROBE, FIRE = range(len(PATTERN_LIST))
+
+#the same colours as rainbow_keys in server.cpp, indexed by rainbow_index
+RAINBOW_KEYS = np.array([[255, 0, 0], [255, 255, 0], [0, 255, 0],
+                         [0, 255, 255], [0, 0, 255], [255, 0, 255],
+                         [255, 255, 255]], dtype=np.int32)
+
+PULSE_HOLD = 50 #ticks that pulse patterns stay black for before rising again
+FIRE_HOLD = 30 #ticks that the fire pattern stays at g = 0
+FIRE_MAX_G = 55
+STROBE_HOLD = 10 #ticks between colour changes for randomstrobe
+
+#rainbow_changing_color is stored as a channel index rather than a char
+CHANNEL_R, CHANNEL_G, CHANNEL_B = 0, 1, 2
+
+#pattern updates per second for the slow, medium and fast speeds, as (numerator, denominator) so they can be counted exactly in integers
+#these are the rates server.cpp gets from updating every 3rd, every 2nd and every one of its 50ms ticks
+SPEED_RATES = ((20, 3), (10, 1), (20, 1))
+NANOSECONDS = 1000000000
+
+ARGS_PER_DEVICE = 7 #device r g b a speed pattern, the same argument layout that server.exe takes
+ALL_DEVICE_IDS = range(1, 7) #the devices 'All' (device 0) stands for, SUPPORTED_DEVICES in RGBController.py and DEVICE_LAYOUTS in leds.py
+
+#every per-device array held by the engine, in the order add_device() fills them
+STATE_FIELDS = ('device_id', 'r', 'g', 'b', 'a', 'speed', 'pattern', 'count',
+                'initial_r', 'initial_g', 'initial_b', 'pulse', 'rainbow_index', 'changing_channel',
+                'updates', 'cycle_offset', 'cycle_prefix', 'cycle_period')
+
+class PatternEngine():
+    '''
+    Holds the pattern state for any number of devices and advances all of them together.
+    Devices are added with add_device() (or set_patterns() with server.exe style arguments), then frames are produced with step() or render().
+    A frame is an (n, 4) uint8 array of RGBA values, one row per device slot, in the order the devices were added.
+    If a cycle_cache is given, devices with deterministic patterns play back their cached cycle table instead of running the state machine.
+    Without wait_for_cycles, cycles missing from the cache are computed in the background, and their devices switch to them once they are ready.
+    randomstrobe is the only pattern that uses random numbers, give a seed to make it (and so every frame) reproducible, e.g. for recordings.
+    patterns holds the user defined patterns that device lines can name, as {name: KeyframePattern}, see define_patterns().
+    '''
+    def __init__(self, args=None, cycle_cache=None, seed=None, patterns=None, wait_for_cycles=True):
+        self.rng = np.random.default_rng(seed)
+        self.cycle_cache = cycle_cache
+        self.wait_for_cycles = wait_for_cycles
+        self.cycle_generation = cycle_cache.generation if cycle_cache is not None else 0 #the cache's generation last looked at
+        self.patterns = dict(patterns or {})
+        self.clear()
+        if args:
+            self.set_patterns(args)
+
+    def clear(self):
+        '''
+        Removes all devices and resets the speed counters.
+        '''
+        for name in STATE_FIELDS:
+            setattr(self, name, np.zeros(0, dtype=np.int32))
+        self.devices = [] #the (device_id, r, g, b, a, speed, pattern) each slot was created from
+
+        #every cycle table used by a device, concatenated so that all cached devices can be looked up with one index operation
+        self.cycle_table = np.zeros((0, 4), dtype=np.uint8)
+        self.cycle_offsets = {} #id(cycle) -> (offset into cycle_table, cycle)
+
+        #low and medium speed patterns are updated every 3 and 2 ticks respectively, high speed patterns are updated every tick
+        self.medium_speed_count = 0
+        self.low_speed_count = 0
+        self.ticks = 0
+        self.clock = 0 #nanoseconds of pattern time, only used when steps are given the elapsed time
+
+    def __len__(self):
+        return len(self.device_id)
+
+    def define_patterns(self, patterns):
+        '''
+        Adds or replaces user defined patterns ({name: KeyframePattern}). Devices already running one keep the table they started with,
+        the new definition is used from the next time a device is set to it.
+        '''
+        self.patterns = dict(self.patterns, **patterns) #a new dict, engines copied by transitions.snapshot() share the old one
+
+    def reseed(self, seed=None):
+        '''
+        Restarts the random number generator, from seed if one is given.
+        '''
+        self.rng = np.random.default_rng(seed)
+
+    def add_device(self, device_id, r, g, b, a, speed, pattern):
+        '''
+        Adds a device pattern to the engine, initialized the same way server.cpp initializes its struct rgb.
+        Values may be given as ints or as the strings used by DevicePattern. Unknown patterns fall back to static, like the server.
+        Returns the slot index of the new device.
+        '''
+        device = (device_id, r, g, b, a, speed, pattern)
+        return self._add_device(device, self._lookup_cycles([device])[0])
+
+    def _add_device(self, device, cycle):
+        for name, value in zip(STATE_FIELDS, self._device_values(device, cycle)):
+            setattr(self, name, np.append(getattr(self, name), np.int32(value)))
+        self.devices.append(tuple(device))
+        return len(self) - 1
+
+    def _device_values(self, device, cycle):
+        '''
+        Returns the initial value of every STATE_FIELDS array for a new device.
+        '''
+        device_id, r, g, b, a, speed, pattern = device
+        r, g, b = int(r), int(g), int(b)
+        code = PATTERN_CODES.get(pattern, STATIC)
+        initial_r, initial_g, initial_b = r, g, b
+        pulse, count, rainbow_index, changing_channel = 1, 0, 0, CHANNEL_G
+
+        #certain patterns change our initial values
+        if code == RAINBOW_CYCLE or code == FIRE:
+            r, g, b = 255, 0, 0
+        #note that the server also sets initial_g to a random value for fire, but firePattern never reads it, so it is not reproduced here
+
+        cycle_offset, cycle_prefix, cycle_period = -1, 0, 0
+        if cycle is not None:
+            cycle_offset, cycle_prefix, cycle_period = self._cycle_offset(cycle), cycle.prefix, cycle.period
+            #row 0 is the colour before the first update, which for built in patterns is the colour set above
+            r, g, b = (int(value) for value in cycle.table[0, :3])
+
+        return (int(device_id), r, g, b, int(a), int(speed), code, count,
+                initial_r, initial_g, initial_b, pulse, rainbow_index, changing_channel,
+                0, cycle_offset, cycle_prefix, cycle_period)
+
+    def set_device(self, device_id, r, g, b, a, speed, pattern):
+        '''
+        Sets the pattern of one device type while every other device keeps running where it is.
+        The device's slot is restarted from its initial state, or added if the device has no slot yet.
+        Device 0 ('All') replaces every device, just like an 'All' line in a profile does.
+        Setting one device while 'All' runs splits 'All' into a slot for each device it stands for, which carry on exactly where it was.
+        Clients paint every device with device 0's colour, so leaving 'All' running next to the device would paint over it every tick.
+        Returns the slot index of the device.
+        '''
+        device = (device_id, r, g, b, a, speed, pattern)
+        if int(device_id) == 0:
+            self.set_patterns(device)
+            return 0
+        self._split_all()
+        cycle = self._lookup_cycles([device])[0]
+        slots = np.flatnonzero(self.device_id == int(device_id))
+        if len(slots) == 0:
+            return self._add_device(device, cycle)
+        slot = slots[0]
+        for name, value in zip(STATE_FIELDS, self._device_values(device, cycle)):
+            getattr(self, name)[slot] = value
+        self.devices[slot] = device
+        return slot
+
+    def _split_all(self):
+        '''
+        Replaces the 'All' slot, if there is one, with copies of it for every device in ALL_DEVICE_IDS that has no slot of its own.
+        '''
+        slots = np.flatnonzero(self.device_id == 0)
+        if len(slots) == 0:
+            return
+        slot = slots[0]
+        device_ids = [device_id for device_id in ALL_DEVICE_IDS if device_id not in self.device_id]
+        for name in STATE_FIELDS:
+            values = getattr(self, name)
+            setattr(self, name, np.append(values, np.repeat(values[slot], len(device_ids))))
+        self.device_id[len(self) - len(device_ids):] = device_ids
+        self.devices += [(device_id,) + tuple(self.devices[slot][1:]) for device_id in device_ids]
+        self.remove_device(0)
+
+    def clear_device(self, device_id):
+        '''
+        Stops the pattern of one device type. Device 0 ('All') stops every device, any other device is split out of 'All' first
+        (see set_device) so every other device keeps running. Returns the ids of the devices whose slots were removed, always with 0 for 'All'.
+        '''
+        if int(device_id) == 0:
+            removed = sorted(set(self.device_id.tolist()) | {0})
+            self.clear()
+            return removed
+        self._split_all()
+        removed = [int(device_id)] if int(device_id) in self.device_id else []
+        self.remove_device(device_id)
+        return removed
+
+    def remove_device(self, device_id):
+        '''
+        Removes every slot belonging to device_id, the remaining devices keep their state.
+        '''
+        keep = self.device_id != int(device_id)
+        for name in STATE_FIELDS:
+            setattr(self, name, getattr(self, name)[keep])
+        self.devices = [device for device, kept in zip(self.devices, keep) if kept]
+
+    def set_patterns(self, args):
+        '''
+        Replaces all devices with the ones described by args, a flat list of server.exe arguments (a multiple of seven: device r g b a speed pattern).
+        This is the same list that open_rgb_service passes to the server process.
+        '''
+        if len(args) % ARGS_PER_DEVICE != 0:
+            raise ValueError("pattern arguments must be a multiple of " + str(ARGS_PER_DEVICE))
+        self.clear()
+        devices = [tuple(args[index:index + ARGS_PER_DEVICE]) for index in range(0, len(args), ARGS_PER_DEVICE)]
+        for device, cycle in zip(devices, self._lookup_cycles(devices)):
+            self._add_device(device, cycle)
+
+    def _lookup_cycles(self, devices):
+        '''
+        Fetches the cached cycles for a list of devices in one batch, None for devices that have to run their state machine.
+        User defined patterns are compiled here if there is no cache to take them from.
+        '''
+        cycles = [None] * len(devices)
+        if self.cycle_cache is None:
+            for index, device in enumerate(devices):
+                if device[6] in self.patterns:
+                    cycles[index] = self.patterns[device[6]].compile(*device[1:4])
+            return cycles
+        cacheable = [index for index, device in enumerate(devices)
+                     if device[6] in self.patterns or PATTERN_CODES.get(device[6], STATIC) != RANDOM_STROBE]
+        configs = [(self.patterns.get(devices[index][6], devices[index][6]),) + tuple(devices[index][1:5]) for index in cacheable]
+        for index, cycle in zip(cacheable, self.cycle_cache.get_many(configs, wait=self.wait_for_cycles)):
+            cycles[index] = cycle
+        return cycles
+
+    def _adopt_cycles(self):
+        '''
+        Moves devices whose cycle has been computed in the background onto their table. updates counts every update a device has had,
+        so it carries on from the row its state machine reached.
+        '''
+        self.cycle_generation = self.cycle_cache.generation
+        for slot in np.flatnonzero((self.cycle_offset < 0) & (self.pattern != RANDOM_STROBE)):
+            device = self.devices[slot]
+            if device[6] in self.patterns:
+                continue
+            cycle = self.cycle_cache.peek(self.cycle_cache.key(device[6], *device[1:5]))
+            if cycle is not None:
+                self.cycle_offset[slot], self.cycle_prefix[slot], self.cycle_period[slot] = self._cycle_offset(cycle), cycle.prefix, cycle.period
+
+    def _cycle_offset(self, cycle):
+        '''
+        Returns where the cycle's table starts inside cycle_table, appending it if no other device uses it yet.
+        '''
+        if id(cycle) not in self.cycle_offsets:
+            self._compact_cycles()
+            self.cycle_offsets[id(cycle)] = (len(self.cycle_table), cycle)
+            self.cycle_table = np.concatenate((self.cycle_table, cycle.table))
+        return self.cycle_offsets[id(cycle)][0]
+
+    def _compact_cycles(self):
+        '''
+        Drops the tables no slot plays any more from cycle_table, once they take up more rows than the ones in use.
+        Devices replaced or removed leave their table behind, so without this a long running engine's table would only ever grow.
+        '''
+        live = set(self.cycle_offset[self.cycle_offset >= 0].tolist())
+        kept = [(offset, cycle) for offset, cycle in self.cycle_offsets.values() if offset in live]
+        used = sum(len(cycle.table) for offset, cycle in kept)
+        if len(self.cycle_table) - used <= used:
+            return
+        moved = {} #old offset -> new offset
+        self.cycle_offsets = {}
+        start = 0
+        for offset, cycle in kept:
+            moved[offset] = start
+            self.cycle_offsets[id(cycle)] = (start, cycle)
+            start += len(cycle.table)
+        self.cycle_table = np.concatenate([self.cycle_table[:0]] + [cycle.table for offset, cycle in kept])
+        playing = self.cycle_offset >= 0
+        self.cycle_offset[playing] = [moved[offset] for offset in self.cycle_offset[playing].tolist()]
+
+    def active_mask(self):
+        '''
+        Returns a boolean array of the devices whose pattern functions run on the current tick, based on their speed.
+        '''
+        return ((self.speed == 2) |
+                ((self.speed == 1) & (self.medium_speed_count == 1)) |
+                ((self.speed == 0) & (self.low_speed_count == 2)))
+
+    def step(self, elapsed=None):
+        '''
+        Advances every device by one tick. Without elapsed this is exactly one iteration of the main loop in server.cpp, with speeds counted in ticks.
+        Given elapsed (seconds since the last step), speeds are the real time rates in SPEED_RATES instead, so patterns run at the same speed at any
+        frame rate: each device updates as many times as it has become due, which can be zero, or several if the frame rate is below its rate.
+        Returns the boolean mask of devices that were updated (and would have been sent to the API clients) this tick.
+        '''
+        if self.cycle_cache is not None and self.cycle_cache.generation != self.cycle_generation:
+            self._adopt_cycles()
+        if elapsed is None:
+            due = self.active_mask().astype(np.int32)
+            self.medium_speed_count = (self.medium_speed_count + 1) % 2
+            self.low_speed_count = (self.low_speed_count + 1) % 3
+        else:
+            due = self._due_updates(elapsed)
+        self.ticks += 1
+        self._update(due)
+        return due > 0
+
+    def _due_updates(self, elapsed):
+        '''
+        Advances the pattern clock by elapsed seconds and returns how many updates each device is due.
+        '''
+        previous = self.clock
+        self.clock += int(round(elapsed * NANOSECONDS))
+        due_by_speed = np.zeros(len(SPEED_RATES) + 1, dtype=np.int32) #the extra entry is for invalid speeds, which never update (like on the server)
+        for speed, (numerator, denominator) in enumerate(SPEED_RATES):
+            due_by_speed[speed] = (self.clock * numerator // (denominator * NANOSECONDS)
+                                   - previous * numerator // (denominator * NANOSECONDS))
+        valid = (self.speed >= 0) & (self.speed < len(SPEED_RATES))
+        return due_by_speed[np.where(valid, self.speed, len(SPEED_RATES))]
+
+    def _update(self, due):
+        '''
+        Runs due[i] pattern updates on every device i, cached devices jumping straight ahead in their cycle tables.
+        '''
+        self.updates += due
+        self._play_cycles((due > 0) & (self.cycle_offset >= 0), due)
+        pattern = self.pattern
+        for update in range(int(due.max()) if len(due) else 0):
+            running = (due > update) & (self.cycle_offset < 0)
+            if not running.any():
+                break
+            self._pulse(running & ((pattern == PULSE) | (pattern == RAINBOW_PULSE)))
+            self._rainbow_advance(running & (pattern == RAINBOW_PULSE))
+            self._rainbow_cycle(running & (pattern == RAINBOW_CYCLE))
+            self._random_strobe(running & (pattern == RANDOM_STROBE))
+            self._fire(running & (pattern == FIRE))
+
+    def frame(self, out=None):
+        '''
+        Returns the current colours of every device as an (n, 4) uint8 RGBA array, written into out if it is given.
+        '''
+        if out is None:
+            out = np.empty((len(self), 4), dtype=np.uint8)
+        out[:, 0] = self.r
+        out[:, 1] = self.g
+        out[:, 2] = self.b
+        out[:, 3] = self.a
+        return out
+
+    def render(self, ticks):
+        '''
+        Headless rendering: advances the engine by ticks steps and returns a (ticks, n, 4) uint8 array holding the frame after each step.
+        '''
+        frames = np.empty((ticks, len(self), 4), dtype=np.uint8)
+        for tick in range(ticks):
+            self.step()
+            self.frame(out=frames[tick])
+        return frames
+
+    def _play_cycles(self, mask, due):
+        '''
+        Looks the colour of devices that have a cached cycle up in cycle_table, once _update() has counted their due updates.
+        '''
+        if not mask.any():
+            return
+        updates, prefix = self.updates[mask], self.cycle_prefix[mask]
+        index = np.where(updates < prefix, updates, prefix + (updates - prefix) % self.cycle_period[mask])
+        colours = self.cycle_table[self.cycle_offset[mask] + index]
+        self.r[mask] = colours[:, 0]
+        self.g[mask] = colours[:, 1]
+        self.b[mask] = colours[:, 2]
+
+    def _pulse(self, mask):
+        '''
+        Vectorized pulsePattern. Each device takes exactly one of three branches, decided from its state before the step.
+        '''
+        if not mask.any():
+            return
+        r, g, b = self.r, self.g, self.b
+        initial_r, initial_g, initial_b = self.initial_r, self.initial_g, self.initial_b
+
+        at_initial = mask & (r == initial_r) & (g == initial_g) & (b == initial_b)
+        black = mask & ~at_initial & (r == 0) & (g == 0) & (b == 0)
+        moving = mask & ~at_initial & ~black
+        rising = black & (self.count == PULSE_HOLD)
+        holding = black & ~rising
+
+        #increment/decrement each channel, clamping to the initial colour and 0 (the clamps are checked before moving, like the server)
+        for channel, initial in ((r, initial_r), (g, initial_g), (b, initial_b)):
+            moved = np.where(channel >= initial, initial, np.where(channel <= 0, 0, channel + self.pulse))
+            channel[moving] = moved[moving]
+
+        #we have reached our initial colour, now we can start decrementing
+        r[at_initial] = np.maximum(0, initial_r[at_initial] - 1)
+        g[at_initial] = np.maximum(0, initial_g[at_initial] - 1)
+        b[at_initial] = np.maximum(0, initial_b[at_initial] - 1)
+        self.pulse[at_initial] = -1
+
+        #the hold at black has finished, start rising back to the initial colour
+        r[rising] = np.minimum(1, initial_r[rising])
+        g[rising] = np.minimum(1, initial_g[rising])
+        b[rising] = np.minimum(1, initial_b[rising])
+        self.pulse[rising] = 1
+        self.count[rising] = 0
+
+        self.count[holding] += 1
+
+    def _rainbow_advance(self, mask):
+        '''
+        The rainbowPulsePattern addition to pulsePattern: once the hold at black has finished counting, switch to the next rainbow colour.
+        '''
+        done = mask & (self.r == 0) & (self.g == 0) & (self.b == 0) & (self.count == PULSE_HOLD)
+        if not done.any():
+            return
+        self.rainbow_index[done] = (self.rainbow_index[done] + 1) % len(RAINBOW_KEYS)
+        colours = RAINBOW_KEYS[self.rainbow_index[done]]
+        self.initial_r[done] = colours[:, 0]
+        self.initial_g[done] = colours[:, 1]
+        self.initial_b[done] = colours[:, 2]
+
+    def _rainbow_cycle(self, mask):
+        '''
+        Vectorized rainbowCyclePattern. The server checks six cases in order and returns after the first match,
+        so each case is masked out of the cases that follow it.
+        '''
+        if not mask.any():
+            return
+        r, g, b = self.r, self.g, self.b
+        pulse, changing = self.pulse, self.changing_channel
+
+        #(channel that must be 255, pulse, changing channel, channel to move, next changing channel)
+        cases = ((r, 1, CHANNEL_G, g, CHANNEL_R),
+                 (g, -1, CHANNEL_R, r, CHANNEL_B),
+                 (g, 1, CHANNEL_B, b, CHANNEL_G),
+                 (b, -1, CHANNEL_G, g, CHANNEL_R),
+                 (b, 1, CHANNEL_R, r, CHANNEL_B),
+                 (r, -1, CHANNEL_B, b, CHANNEL_G))
+
+        remaining = mask.copy()
+        selected = []
+        for full, direction, channel, _, _ in cases:
+            case = remaining & (full == 255) & (pulse == direction) & (changing == channel)
+            remaining &= ~case
+            selected.append(case)
+
+        for case, (_, direction, _, moving, next_channel) in zip(selected, cases):
+            if not case.any():
+                continue
+            moving[case] += direction
+            if direction == 1:
+                finished = case & (moving >= 255)
+            else:
+                finished = case & (moving == 0)
+            pulse[finished] = -direction
+            changing[finished] = next_channel
+
+    def _random_strobe(self, mask):
+        '''
+        Vectorized randomStrobePattern, picks a new rainbow colour every STROBE_HOLD updates.
+        '''
+        if not mask.any():
+            return
+        change = mask & (self.count == 0)
+        if change.any():
+            colours = RAINBOW_KEYS[self.rng.integers(0, len(RAINBOW_KEYS), size=int(change.sum()))]
+            self.r[change] = colours[:, 0]
+            self.g[change] = colours[:, 1]
+            self.b[change] = colours[:, 2]
+        self.count[mask] = (self.count[mask] + 1) % STROBE_HOLD
+
+    def _fire(self, mask):
+        '''
+        Vectorized firePattern, only the g value moves while r and b stay unchanged.
+        '''
+        if not mask.any():
+            return
+        g = self.g
+        peaked = mask & (g >= FIRE_MAX_G)
+        dark = mask & ~peaked & (g == 0)
+        rising = dark & (self.count == FIRE_HOLD)
+        holding = dark & ~rising
+        moving = mask & ~peaked & ~dark
+
+        g[moving] += self.pulse[moving]
+
+        self.pulse[peaked] = -1
+        g[peaked] = FIRE_MAX_G - 1
+
+        self.count[rising] = 0
+        g[rising] = 1
+        self.pulse[rising] = 1
+
+        self.count[holding] += 1
@@ -0,0 +1,8 @@
+'''
+Where the engine listens. Kept apart from protocol.py so the control client (and the headless --apply mode) can find the engine without importing numpy.
+'''
+
+HOST = '127.0.0.1'
+PORT = 50025 #must be common among the server and all the api clients, see server.cpp
+CONTROL_PORT = 50026 #the GUI sends pattern changes to a running engine through this port, see control.py
+FRAME_RING = 'rgbcontroller-frames' #name of the shared memory frames are written to when the engine runs with one, see framering.py
@@ -0,0 +1,223 @@
+'''
+Profile storage. Every profile, along with the last loaded profile, lives in one JSON file in the user's home directory -> /RGBController/profiles.json:
+
+    {
+        "version": 1,
+        "last_loaded_profile": 2,
+        "profiles": {
+            "1": [["0", "255", "0", "0", "255", "1", "pulse"]],
+            "2": [["1", "0", "0", "255", "255", "2", "static"], ["2", "255", "255", "0", "255", "0", "fire"]],
+            "3": [["0", "255", "0", "0", "255", "1", "sunset"]]
+        },
+        "patterns": {
+            "sunset": {"keyframes": [{"colour": [255, 40, 0], "hold": 20}, {"colour": [120, 0, 160]}], "period": 200, "loop": true}
+        }
+    }
+
+Each device line holds the same seven values as the old rgbprofile_N files (device r g b a speed pattern), kept as strings like DevicePattern does.
+patterns holds the user defined keyframe patterns (see keyframes.py) by name, which device lines in any profile can use like a built in pattern.
+Files written before there were user defined patterns have no patterns, which reads the same as none.
+The file is parsed once and cached, and only read again when its modification time or size changes, so any number of profiles costs one file open.
+Writes go to a temporary file that then replaces the real one, so a crash mid-write never leaves a half written profile behind.
+The old rgbprofile_N and rgbprofile_settings files are imported the first time the store is used, if there is no profiles.json yet.
+'''
+
+import json
+import os
+import tempfile
+
+STORE_VERSION = 1
+PROFILE_DIRECTORY = os.path.join(os.path.expanduser("~"), "RGBController")
+STORE_NAME = "profiles.json"
+LEGACY_PROFILE_PREFIX = "rgbprofile_"
+LEGACY_SETTINGS_NAME = "rgbprofile_settings"
+
+class ProfileError(ValueError):
+    '''
+    Raised for profiles that cannot be stored, or a profile file that cannot be understood.
+    '''
+
+def validate_device(values):
+    '''
+    Checks one device line (device r g b a speed pattern) and returns it as a list of strings. Raises ProfileError if it is invalid.
+    '''
+    values = [str(value) for value in values]
+    if len(values) != 7:
+        raise ProfileError("a device needs 7 values (device r g b a speed pattern), got " + str(len(values)))
+    try:
+        numbers = [int(value) for value in values[:6]]
+    except ValueError:
+        raise ProfileError("device, colour and speed values must be whole numbers: " + " ".join(values))
+    if not 0 <= numbers[0] <= 255 or not all(0 <= value <= 255 for value in numbers[1:5]) or not 0 <= numbers[5] <= 2:
+        raise ProfileError("device values out of range: " + " ".join(values))
+    if not values[6] or len(values[6].split()) != 1:
+        raise ProfileError("invalid pattern name " + repr(values[6]))
+    return values
+
+class ProfileStore():
+    '''
+    Cached access to profiles.json. Profile ids are positive integers with no upper limit.
+    '''
+    def __init__(self, directory=PROFILE_DIRECTORY):
+        self.directory = directory
+        self.path = os.path.join(directory, STORE_NAME)
+        self.data = None
+        self.signature = None #(mtime_ns, size) of the file when self.data was read
+        self.reads = 0 #times the file has actually been parsed, handy for checking the cache works
+
+    def _empty(self):
+        return {'version': STORE_VERSION, 'last_loaded_profile': None, 'profiles': {}}
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        '''
+        Returns the store's data, re-reading the file only if it changed since we last read or wrote it.
+        '''
+        signature = self._signature()
+        if self.data is not None and signature == self.signature:
+            return self.data
+        if signature is None:
+            self.data = self._import_legacy()
+            if self.data['profiles'] or self.data['last_loaded_profile'] is not None:
+                self._write(self.data)
+            return self.data
+
+        with open(self.path, 'r') as file:
+            try:
+                data = json.load(file)
+            except ValueError as error:
+                raise ProfileError("could not read " + self.path + ": " + str(error))
+        self.reads += 1
+        if not isinstance(data, dict) or data.get('version') != STORE_VERSION or not isinstance(data.get('profiles'), dict):
+            raise ProfileError(self.path + " is not a version " + str(STORE_VERSION) + " profile store")
+        self.data = data
+        self.signature = signature
+        return data
+
+    def _write(self, data):
+        '''
+        Atomically replaces the file with data, and keeps data as the cache so the write does not have to be read back.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(prefix=STORE_NAME, dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(data, file, separators=(',', ':'))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            raise
+        self.data = data
+        self.signature = self._signature()
+
+    def _import_legacy(self):
+        '''
+        Builds the store's data from the old one-file-per-profile layout, skipping any lines that don't validate.
+        '''
+        data = self._empty()
+        if not os.path.isdir(self.directory):
+            return data
+        for name in os.listdir(self.directory):
+            profile_id = name[len(LEGACY_PROFILE_PREFIX):]
+            if not name.startswith(LEGACY_PROFILE_PREFIX) or not profile_id.isdigit():
+                continue
+            devices = []
+            with open(os.path.join(self.directory, name), 'r') as file:
+                for line in file:
+                    try:
+                        devices.append(validate_device(line.split()))
+                    except ProfileError:
+                        continue
+            data['profiles'][str(int(profile_id))] = devices
+
+        settings_path = os.path.join(self.directory, LEGACY_SETTINGS_NAME)
+        if os.path.exists(settings_path):
+            with open(settings_path, 'r') as file:
+                for line in file:
+                    line_list = line.split()
+                    if len(line_list) == 2 and line_list[0] == 'last_loaded_profile' and line_list[1].lstrip('-').isdigit():
+                        data['last_loaded_profile'] = int(line_list[1]) if int(line_list[1]) > 0 else None
+        return data
+
+    def profile_ids(self):
+        '''
+        Returns the ids of every saved profile, in order.
+        '''
+        return sorted(int(profile_id) for profile_id in self._load()['profiles'])
+
+    def profile(self, profile_id):
+        '''
+        Returns the device lines saved under profile_id (lists of seven strings), or None if there is no such profile.
+        '''
+        devices = self._load()['profiles'].get(str(int(profile_id)))
+        return None if devices is None else [list(device) for device in devices]
+
+    def save_profile(self, profile_id, devices):
+        '''
+        Saves device lines (sequences of device r g b a speed pattern) under profile_id, replacing what was there.
+        '''
+        if int(profile_id) < 1:
+            raise ProfileError("profile ids start at 1")
+        devices = [validate_device(device) for device in devices]
+        data = dict(self._load())
+        data['profiles'] = dict(data['profiles'])
+        data['profiles'][str(int(profile_id))] = devices
+        self._write(data)
+
+    def patterns(self, names=None):
+        '''
+        Returns the saved user defined pattern definitions by name, only those in names if it is given (names without one are left out).
+        '''
+        patterns = self._load().get('patterns', {})
+        return {name: definition for name, definition in patterns.items() if names is None or name in names}
+
+    def save_pattern(self, name, definition):
+        '''
+        Saves a user defined pattern under name, replacing one of the same name. Raises ProfileError if the definition can't be compiled.
+        '''
+        from rgbengine.keyframes import parse_patterns #numpy is only needed to check patterns, not to read them
+        try:
+            definition = parse_patterns({name: definition})[name].definition()
+        except ValueError as error:
+            raise ProfileError(str(error))
+        data = dict(self._load())
+        data['patterns'] = dict(data.get('patterns', {}))
+        data['patterns'][name] = definition
+        self._write(data)
+
+    def delete_pattern(self, name):
+        data = dict(self._load())
+        data['patterns'] = {key: value for key, value in data.get('patterns', {}).items() if key != name}
+        self._write(data)
+
+    def delete_profile(self, profile_id):
+        data = dict(self._load())
+        data['profiles'] = {key: value for key, value in data['profiles'].items() if key != str(int(profile_id))}
+        if data['last_loaded_profile'] == int(profile_id):
+            data['last_loaded_profile'] = None
+        self._write(data)
+
+    def last_loaded_profile(self):
+        '''
+        Returns the id of the last loaded profile, or None if no profile has been loaded yet.
+        '''
+        return self._load()['last_loaded_profile']
+
+    def set_last_loaded_profile(self, profile_id):
+        data = self._load()
+        if data['last_loaded_profile'] == profile_id:
+            return #nothing changed, so there is nothing to write
+        data = dict(data)
+        data['last_loaded_profile'] = profile_id
+        self._write(data)
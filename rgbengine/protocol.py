@@ -0,0 +1,224 @@
+'''
+Wire formats between the syncing server and the API clients.
+
+The original format (still understood by corsairAPIclient and razerAPIclient) is one 14 byte, space padded ASCII message per device per tick:
+
+    -----------------------------------------
+    DEVICE_ID R_VALUE G_VALUE B_VALUE A_VALUE
+        ^         ^       ^       ^       ^
+    2 bytes  3 bytes 3 bytes 3 bytes  3 bytes
+    -----------------------------------------
+
+The binary format sends every device for a tick in one length-prefixed frame, so a tick costs one send per client however many devices there are,
+and a client can always tell where a frame ends no matter how TCP splits or coalesces the stream. All fields are little endian:
+
+    ------------------------------------------------------------------------------------------------
+    LENGTH  VERSION  FLAGS  DEVICE_COUNT  SEQUENCE  TIMESTAMP  DEVICE_ID R G B A  (x DEVICE_COUNT)
+      ^        ^       ^         ^           ^          ^          ^      ^
+    4 bytes  1 byte  1 byte   2 bytes     4 bytes    8 bytes    1 byte  4 bytes
+    ------------------------------------------------------------------------------------------------
+
+LENGTH counts every byte after itself. TIMESTAMP is time.monotonic_ns() on the sending side when the frame was encoded.
+
+Frames with the LEDS flag set carry a colour for every LED instead of one per device. The header is followed by a table of the devices,
+then every LED's RGBA value back to back, in table order, so the LEDs of all devices form one contiguous block:
+
+    ---------------------------------------------------------------------------------------------
+    HEADER  DEVICE_ID LED_COUNT  (x DEVICE_COUNT)  R G B A  (x the sum of every LED_COUNT)
+               ^         ^                            ^
+            1 byte    2 bytes                      4 bytes
+    ---------------------------------------------------------------------------------------------
+'''
+
+import struct
+import time
+
+import numpy as np
+
+from rgbengine.ports import HOST, PORT, CONTROL_PORT
+
+LEGACY_MESSAGE_SIZE = 14
+LEGACY_MAX_DEVICE_ID = 99 #device ids are two ASCII digits in legacy messages
+
+PROTOCOL_VERSION = 1
+LENGTH = struct.Struct('<I')
+HEADER = struct.Struct('<BBHIQ') #version, flags, device count, sequence, timestamp
+HEADER_SIZE = LENGTH.size + HEADER.size
+DEVICE_SIZE = 5 #device id + RGBA
+MAX_DEVICES = 0xFFFF
+
+FLAG_KEYFRAME = 0x01 #the frame holds every device, not only the ones that changed
+FLAG_LEDS = 0x02 #the frame holds per LED colours, see above
+
+LED_DEVICE = np.dtype([('device_id', 'u1'), ('led_count', '<u2')]) #one entry of an LED frame's device table
+LED_SIZE = 4 #RGBA
+
+class ProtocolError(ValueError):
+    '''
+    Raised when received bytes are not a valid frame.
+    '''
+
+def encode_message(device_id, r, g, b, a):
+    '''
+    Encodes one device's colour in the legacy 14 byte ASCII format, byte for byte what server.cpp sends.
+    '''
+    return b'%-2d%-3d%-3d%-3d%-3d' % (int(device_id), int(r), int(g), int(b), int(a))
+
+def decode_message(message):
+    '''
+    Decodes a legacy 14 byte message into a (device_id, r, g, b, a) tuple, the same way the API clients parse it.
+    '''
+    if len(message) != LEGACY_MESSAGE_SIZE:
+        raise ProtocolError("legacy messages are " + str(LEGACY_MESSAGE_SIZE) + " bytes, got " + str(len(message)))
+    return (int(message[0:2]), int(message[2:5]), int(message[5:8]), int(message[8:11]), int(message[11:14]))
+
+def encode_frame(device_ids, colours, sequence, timestamp=None, flags=0):
+    '''
+    Encodes one tick's worth of device colours as a binary frame.
+    device_ids is a sequence of n device ids and colours an (n, 4) array of RGBA values, e.g. a PatternEngine frame.
+    '''
+    colours = np.asarray(colours)
+    count = len(colours)
+    if count > MAX_DEVICES:
+        raise ProtocolError("a frame can hold at most " + str(MAX_DEVICES) + " devices")
+    if timestamp is None:
+        timestamp = time.monotonic_ns()
+
+    frame = np.empty(HEADER_SIZE + count * DEVICE_SIZE, dtype=np.uint8)
+    LENGTH.pack_into(frame, 0, len(frame) - LENGTH.size)
+    HEADER.pack_into(frame, LENGTH.size, PROTOCOL_VERSION, flags, count, sequence & 0xFFFFFFFF, timestamp)
+    body = frame[HEADER_SIZE:].reshape(count, DEVICE_SIZE)
+    body[:, 0] = device_ids
+    body[:, 1:] = colours
+    return frame.tobytes()
+
+class LedFrameWriter():
+    '''
+    Builds LED frames for a fixed set of devices. allocate() returns a new frame with its header and device table already filled in,
+    along with a writable (total LEDs, 4) view of its LED block, so the LEDs can be rendered straight into the bytes that get sent.
+    Every frame is a fresh buffer, so one that is still queued for a slow client is never overwritten by the next tick.
+    '''
+    def __init__(self, device_ids, led_counts):
+        if len(device_ids) > MAX_DEVICES:
+            raise ProtocolError("a frame can hold at most " + str(MAX_DEVICES) + " devices")
+        table = np.empty(len(device_ids), dtype=LED_DEVICE)
+        table['device_id'] = device_ids
+        table['led_count'] = led_counts
+        self.count = len(table)
+        self.leds = int(np.sum(led_counts, dtype=np.int64))
+        self.table = table.view(np.uint8)
+        self.leds_offset = HEADER_SIZE + len(self.table)
+        self.size = self.leds_offset + self.leds * LED_SIZE
+
+    def allocate(self, sequence, timestamp=None, flags=FLAG_KEYFRAME):
+        '''
+        Returns (frame, leds): frame is the whole encoded frame as a uint8 array (send memoryview(frame), no copy is needed),
+        leds the view of its LED block to render into.
+        '''
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        frame = np.empty(self.size, dtype=np.uint8)
+        LENGTH.pack_into(frame, 0, self.size - LENGTH.size)
+        HEADER.pack_into(frame, LENGTH.size, PROTOCOL_VERSION, flags | FLAG_LEDS, self.count, sequence & 0xFFFFFFFF, timestamp)
+        frame[HEADER_SIZE:self.leds_offset] = self.table
+        return frame, frame[self.leds_offset:].reshape(self.leds, LED_SIZE)
+
+class Frame():
+    '''
+    A decoded binary frame. device_ids and colours are read-only numpy views into the received bytes, nothing is copied per device.
+    LED frames have led_counts and leds (every LED's RGBA value, device after device) instead of colours, see device_leds().
+    '''
+    def __init__(self, sequence, timestamp, flags, device_ids, colours, led_counts=None, leds=None):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.flags = flags
+        self.device_ids = device_ids
+        self.colours = colours
+        self.led_counts = led_counts
+        self.leds = leds
+        self.led_offsets = None if led_counts is None else np.concatenate(([0], np.cumsum(led_counts, dtype=np.int64)))
+
+    def __len__(self):
+        return len(self.device_ids)
+
+    @property
+    def keyframe(self):
+        return bool(self.flags & FLAG_KEYFRAME)
+
+    @property
+    def has_leds(self):
+        return bool(self.flags & FLAG_LEDS)
+
+    def device_leds(self, index):
+        '''
+        Returns the (led count, 4) view of the LEDs of the index-th device in the frame.
+        '''
+        return self.leds[self.led_offsets[index]:self.led_offsets[index + 1]]
+
+    def devices(self):
+        '''
+        Returns the frame as a list of (device_id, r, g, b, a) tuples. LED frames have no single colour per device, so this is empty for them.
+        '''
+        if self.colours is None:
+            return []
+        return [(int(device_id),) + tuple(int(value) for value in colour) for device_id, colour in zip(self.device_ids, self.colours)]
+
+def decode_frame(payload):
+    '''
+    Decodes a frame's payload (everything after the LENGTH field) into a Frame.
+    '''
+    if len(payload) < HEADER.size:
+        raise ProtocolError("frame is too short for its header")
+    version, flags, count, sequence, timestamp = HEADER.unpack_from(payload, 0)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError("unsupported protocol version " + str(version))
+    if flags & FLAG_LEDS:
+        return _decode_led_frame(payload, sequence, timestamp, flags, count)
+    if len(payload) != HEADER.size + count * DEVICE_SIZE:
+        raise ProtocolError("frame length does not match its device count")
+    body = np.frombuffer(payload, dtype=np.uint8, offset=HEADER.size).reshape(count, DEVICE_SIZE)
+    return Frame(sequence, timestamp, flags, body[:, 0], body[:, 1:])
+
+def _decode_led_frame(payload, sequence, timestamp, flags, count):
+    leds_offset = HEADER.size + count * LED_DEVICE.itemsize
+    if len(payload) < leds_offset:
+        raise ProtocolError("frame is too short for its device table")
+    table = np.frombuffer(payload, dtype=LED_DEVICE, count=count, offset=HEADER.size)
+    leds = int(np.sum(table['led_count'], dtype=np.int64))
+    if len(payload) != leds_offset + leds * LED_SIZE:
+        raise ProtocolError("frame length does not match its LED counts")
+    body = np.frombuffer(payload, dtype=np.uint8, offset=leds_offset).reshape(leds, LED_SIZE)
+    return Frame(sequence, timestamp, flags, table['device_id'], None, table['led_count'], body)
+
+class FrameDecoder():
+    '''
+    Reassembles binary frames from a byte stream. Feed it whatever recv() returns, split or coalesced, and it returns every complete frame.
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+        self.pending = [] #frames already decoded by read() but not returned yet
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        start = 0
+        while len(self.buffer) - start >= LENGTH.size:
+            (length,) = LENGTH.unpack_from(self.buffer, start)
+            end = start + LENGTH.size + length
+            if end > len(self.buffer): #the rest of this frame has not arrived yet
+                break
+            frames.append(decode_frame(bytes(self.buffer[start + LENGTH.size:end])))
+            start = end
+        del self.buffer[:start]
+        return frames
+
+    def read(self, sock):
+        '''
+        Blocks until one complete frame arrives on sock and returns it, or None if the connection closes first.
+        '''
+        while not self.pending:
+            data = sock.recv(65536)
+            if not data:
+                return None
+            self.pending = self.feed(data)
+        return self.pending.pop(0)
@@ -0,0 +1,335 @@
+'''
+Razer bridge: drives Razer devices through the Chroma SDK's REST API from the frames a server sends, in process instead of razerAPIclient.exe.
+
+razerAPIclient makes a new HTTP connection for every call, and for every 14 byte message creates an effect, applies it and deletes it again
+(three calls per device, nine for 'All') and then sends a heartbeat, so one tick of three devices costs a dozen connections and requests. When the
+SDK answers slowly the messages queue up in the socket and the LEDs fall further and further behind. The bridge instead:
+
+    - keeps one keep-alive connection to the session's uri for everything it sends (ChromaSession)
+    - sends the devices that changed since the last update together: one PUT /effect applies every device whose colour already has an effect,
+      colours seen for the second time get an effect created while there is room for it (they are repeating, e.g. part of a pulse), and
+      every other colour is set directly on its device with one PUT, which is cheaper than creating an effect that may never be used again
+    - always sends the newest colours: frames arriving while a request is in flight are merged, and counted as coalesced
+    - sends a heartbeat only when nothing else has been sent for HEARTBEAT_INTERVAL seconds, which keeps the session open
+    - starts a new session after SESSION_RETRIES failures in a row, as the SDK ends sessions (e.g. when Synapse restarts) and a dead session's uri
+      never answers again, then sends every device its colour in it
+
+At most EFFECT_CACHE effects are kept. Once that many exist, the ones unused for EFFECT_STALE updates (e.g. from an earlier profile) are deleted
+in one request, but nothing in use is evicted to make room: a pattern with more colours than fit reuses the effects it has and sets the rest
+directly, so once its effects are made it never costs more requests than setting every colour directly would.
+'''
+
+from collections import OrderedDict
+import http.client
+import json
+import socket
+import threading
+import time
+import urllib.parse
+
+from rgbengine.discovery import RAZER_URL
+from rgbengine.loopback import LoopbackClient
+from rgbengine.metrics import Histogram
+from rgbengine.ports import HOST, PORT
+
+APP_INFO = {
+    'title': "Cross-API RGB Controller",
+    'description': "This is a REST interface for the RGB Controller",
+    'author': {'name': "RGBController", 'contact': "www.razerzone.com"},
+    'device_supported': ['keyboard', 'mouse', 'headset'],
+    'category': 'application',
+}
+#device ids of the server's messages to Chroma devices, as in razerAPIclient. Device 0 ('All') is every one of them
+DEVICE_MAP = {1: 'keyboard', 2: 'mouse', 6: 'headset'}
+
+REQUEST_TIMEOUT = 5
+HEARTBEAT_INTERVAL = 1 #seconds without a request before a heartbeat is sent, the SDK ends sessions that are quiet for 15
+EFFECT_CACHE = 1024 #effects kept on the SDK for reuse, enough for a full pulse of three devices
+EFFECT_STALE = 4 * EFFECT_CACHE #updates an effect may go unused before it can be deleted
+SEEN_COLOURS = 4 * EFFECT_CACHE #colours remembered to tell repeating ones apart
+SESSION_RETRIES = 3 #failed updates or heartbeats in a row before the session is started again
+
+class ChromaError(OSError):
+    '''
+    Raised when the Chroma SDK can't be reached or rejects a request.
+    '''
+
+class _Connection(http.client.HTTPConnection):
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        #requests are small and answered before the next one is sent, so never hold one back waiting for an ack
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+def bgr(r, g, b):
+    #the SDK takes colours as BGR integers
+    return (int(b) << 16) | (int(g) << 8) | int(r)
+
+class ChromaSession():
+    '''
+    One Chroma SDK session and the keep-alive connection all its requests go over, reconnecting once if the connection has dropped.
+    '''
+    def __init__(self, url=RAZER_URL, timeout=REQUEST_TIMEOUT, app_info=APP_INFO):
+        self.url = url
+        self.timeout = timeout
+        self.app_info = app_info
+        self.uri = None
+        self.connection = None
+        self.path = None
+        self.requests = 0
+        self.connections = 0
+        self.last_request = 0
+
+    def _connect(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.connections += 1
+        return _Connection(parts.hostname, parts.port or 80, timeout=self.timeout), parts.path.rstrip('/')
+
+    def _send(self, connection, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        connection.request(method, path, body=data, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        reply = response.read()
+        self.requests += 1
+        self.last_request = time.monotonic()
+        if response.status != 200:
+            raise ChromaError(method + " " + path + " failed with status " + str(response.status))
+        try:
+            return json.loads(reply) if reply else None
+        except ValueError:
+            raise ChromaError(method + " " + path + " returned something that is not JSON")
+
+    def open(self):
+        '''
+        Starts the session, as razerAPIclient does, and connects to the uri the SDK gives for it.
+        '''
+        connection, path = self._connect(self.url)
+        try:
+            reply = self._send(connection, 'POST', path, self.app_info)
+        except (OSError, http.client.HTTPException) as error:
+            raise ChromaError("could not start a Chroma SDK session: " + str(error))
+        finally:
+            connection.close()
+        if not isinstance(reply, dict) or 'uri' not in reply:
+            raise ChromaError("the Chroma SDK did not return a session uri")
+        self.uri = reply['uri']
+        self.connection, self.path = self._connect(self.uri)
+        return self
+
+    def reopen(self):
+        '''
+        Starts a new session in place of one the SDK has ended. The old one isn't deleted, the SDK no longer knows it.
+        '''
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        return self.open()
+
+    def request(self, method, endpoint='', body=None):
+        '''
+        Sends one request to the session's uri plus endpoint and returns the decoded reply.
+        '''
+        if self.connection is None:
+            raise ChromaError("the Chroma SDK session is not open")
+        for attempt in range(2):
+            try:
+                return self._send(self.connection, method, self.path + endpoint, body)
+            except (OSError, http.client.HTTPException) as error:
+                if isinstance(error, ChromaError):
+                    raise
+                #the SDK closes idle keep-alive connections, so try once more on a new one
+                self.connection.close()
+                self.connection, self.path = self._connect(self.uri)
+                if attempt:
+                    raise ChromaError(method + " " + endpoint + " failed: " + str(error))
+
+    def create_effect(self, device, colour):
+        reply = self.request('POST', '/' + device, {'effect': 'CHROMA_STATIC', 'param': {'color': colour}})
+        if not isinstance(reply, dict) or 'id' not in reply:
+            raise ChromaError("the Chroma SDK did not return an effect id")
+        return reply['id']
+
+    def set_effect(self, device, colour):
+        return self.request('PUT', '/' + device, {'effect': 'CHROMA_STATIC', 'param': {'color': colour}})
+
+    def apply_effects(self, ids):
+        return self.request('PUT', '/effect', {'id': ids[0]} if len(ids) == 1 else {'ids': list(ids)})
+
+    def delete_effects(self, ids):
+        return self.request('DELETE', '/effect', {'id': ids[0]} if len(ids) == 1 else {'ids': list(ids)})
+
+    def heartbeat(self):
+        return self.request('PUT', '/heartbeat')
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.request('DELETE')
+        except ChromaError: #the SDK ends the session by itself once the heartbeats stop
+            pass
+        self.connection.close()
+        self.connection = None
+
+class RazerBridge():
+    '''
+    Reads a server's frames with a LoopbackClient and sends the Razer devices' colours to the Chroma SDK on its own thread.
+    legacy must match the server's wire format (the LED wire format works too, devices take the colour of their first LED).
+    start() raises ChromaError if no session can be started.
+    '''
+    def __init__(self, host=HOST, port=PORT, legacy=True, url=RAZER_URL, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 effect_cache=EFFECT_CACHE, name='razer'):
+        self.client = LoopbackClient(host, port, legacy=legacy, name=name + '-frames')
+        self.session = ChromaSession(url)
+        self.heartbeat_interval = heartbeat_interval
+        self.effect_cache = effect_cache
+        self.name = name
+        self.effects = OrderedDict() #(device, colour) -> (effect id, update it was last used in), least recently used first
+        self.seen = OrderedDict() #(device, colour) keys seen once, to know which colours repeat
+        self.shown = {} #device -> colour the SDK was last given
+
+        self.updates = 0 #batches of changes sent
+        self.coalesced = 0 #frames merged into a later one because a request was in flight
+        self.heartbeats = 0
+        self.errors = 0
+        self.failures = 0 #errors since the last update or heartbeat that went through
+        self.reopened = 0 #sessions started in place of one the SDK stopped answering
+        self.last_error = None
+        self.send_time = Histogram() #sending one batch of changes
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.session.open()
+        try:
+            self.client.connect()
+        except OSError:
+            self.session.close()
+            raise
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.client.condition:
+            self.client.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=REQUEST_TIMEOUT)
+        self.client.close()
+        self.session.close()
+
+    def _run(self):
+        client = self.client
+        frames = 0
+        while self.running and client.thread.is_alive(): #like razerAPIclient, stop once the server closes the connection
+            with client.condition:
+                client.condition.wait_for(lambda: client.frames != frames or not self.running, timeout=self.heartbeat_interval)
+                received = client.frames
+                colours = self._colours()
+            try:
+                if received != frames:
+                    self.coalesced += max(0, received - frames - 1)
+                    frames = received
+                    self.send(colours)
+                elif self.failures:
+                    self.send(colours) #what failed to go through is sent again without waiting for another change
+                #frames that change nothing send nothing, so the heartbeat can be due either way
+                if time.monotonic() - self.session.last_request >= self.heartbeat_interval:
+                    self.session.heartbeat()
+                    self.heartbeats += 1
+                self.failures = 0
+            except ChromaError as error:
+                #keep going, the next change or heartbeat tries again
+                self.errors += 1
+                self.failures += 1
+                self.last_error = str(error)
+                if self.failures % SESSION_RETRIES == 0:
+                    self._reopen()
+        self.running = False
+
+    def _reopen(self):
+        '''
+        Starts a new session after SESSION_RETRIES failures in a row. Effects belong to the session they were made in, so they are forgotten,
+        and so is what each device was shown, so the next update sends every device its colour.
+        '''
+        try:
+            self.session.reopen()
+        except ChromaError as error: #the SDK is down, try again after another SESSION_RETRIES failures
+            self.last_error = str(error)
+            return
+        self.effects.clear()
+        self.shown.clear()
+        self.reopened += 1
+
+    def _colours(self):
+        '''
+        Returns the newest colour of every Razer device: its own colour, or the colour of 'All' if that arrived since.
+        Called with the client's condition held.
+        '''
+        received = dict(self.client.colours)
+        for device_id, leds in self.client.leds.items():
+            if len(leds):
+                received[device_id] = tuple(int(value) for value in leds[0])
+        updated = self.client.updated
+        colours = {}
+        if 0 in received:
+            colours = {device: bgr(*received[0][:3]) for device in DEVICE_MAP.values()}
+        for device_id, device in DEVICE_MAP.items():
+            if device_id in received and updated.get(device_id, 0) >= updated.get(0, -1):
+                colours[device] = bgr(*received[device_id][:3])
+        return colours
+
+    def send(self, colours):
+        '''
+        Sends every device whose colour differs from what the SDK was last given, in as few requests as possible.
+        '''
+        changes = {device: colour for device, colour in colours.items() if self.shown.get(device) != colour}
+        if not changes:
+            return
+        start = time.perf_counter()
+        ids = []
+        for device, colour in changes.items():
+            key = (device, colour)
+            if key in self.effects:
+                self.effects[key] = (self.effects[key][0], self.updates)
+                self.effects.move_to_end(key)
+                ids.append(self.effects[key][0])
+            elif key in self.seen and len(self.effects) < self.effect_cache:
+                del self.seen[key]
+                self.effects[key] = (self.session.create_effect(device, colour), self.updates)
+                ids.append(self.effects[key][0])
+            else:
+                self._remember(key)
+                self.session.set_effect(device, colour)
+        if ids:
+            self.session.apply_effects(ids)
+        #only once everything was accepted, so a failed change is sent again with the next frame
+        self.shown.update(changes)
+        self._evict()
+        self.updates += 1
+        self.send_time.record(time.perf_counter() - start)
+
+    def _remember(self, key):
+        self.seen[key] = True
+        if len(self.seen) > SEEN_COLOURS:
+            self.seen.popitem(last=False)
+
+    def _evict(self):
+        if len(self.effects) < self.effect_cache:
+            return
+        shown = set(self.shown.items())
+        evicted = []
+        for key, (effect, used) in list(self.effects.items()):
+            if self.updates - used <= EFFECT_STALE:
+                break #least recently used first, so the rest are newer
+            if key not in shown: #an effect still on a device stays
+                evicted.append(effect)
+                del self.effects[key]
+        if evicted:
+            self.session.delete_effects(evicted)
+
+    def stats(self):
+        return {'running': self.running, 'updates': self.updates, 'coalesced': self.coalesced, 'heartbeats': self.heartbeats,
+                'requests': self.session.requests, 'connections': self.session.connections, 'effects': len(self.effects),
+                'errors': self.errors, 'reopened': self.reopened, 'last_error': self.last_error, 'send_time': self.send_time.summary()}
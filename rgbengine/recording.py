@@ -0,0 +1,247 @@
+'''
+Recording the frames the engine produces, and replaying them without running any patterns.
+
+A recording is a small header followed by segments, each holding fixed size records for one set of devices, so a segment's records can be read
+straight out of a memory map as a numpy array. All fields are little endian:
+
+    FILE       MAGIC (8 bytes)  VERSION (2 bytes)  METADATA_LENGTH (4 bytes)  METADATA (JSON, e.g. the pattern arguments and seed)  SEGMENT...
+    SEGMENT    TAG "SEGM" (4 bytes)  DEVICE_COUNT (2 bytes)  RECORD_COUNT (4 bytes)  DEVICE_ID (1 byte, x DEVICE_COUNT)  RECORD...
+    RECORD     TIMESTAMP (8 bytes, nanoseconds of pattern time)  R G B A (4 bytes, x DEVICE_COUNT)
+
+A new segment starts whenever the devices change. RECORD_COUNT is filled in when the segment is finished, and a segment left at UNFINISHED
+(the recorder was killed) runs to the end of the file.
+
+Replaying a recording (Player) costs a binary search per tick however expensive the recorded patterns were. A recording made from pattern
+arguments and a seed (record_patterns) is also a golden file: verify_recording renders them again and reports the first frame that differs,
+which is how a change to a pattern function can be checked against the output it had before.
+'''
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from rgbengine.keyframes import parse_patterns
+from rgbengine.patterns import PatternEngine, NANOSECONDS
+
+MAGIC = b'RGBREC\r\n' #the line endings catch files mangled by text mode transfers
+RECORDING_VERSION = 1
+FILE_HEADER = struct.Struct('<8sHI')
+SEGMENT_TAG = b'SEGM'
+SEGMENT_HEADER = struct.Struct('<4sHI')
+TIMESTAMP = struct.Struct('<q')
+UNFINISHED = 0xFFFFFFFF
+DEFAULT_TICK = NANOSECONDS // 20 #the pattern time of one legacy step, server.cpp's 50ms
+
+class RecordingError(ValueError):
+    '''
+    Raised for files that are not recordings, or are damaged.
+    '''
+
+def record_dtype(devices):
+    return np.dtype([('timestamp', '<i8'), ('colours', 'u1', (devices, 4))])
+
+class Recorder():
+    '''
+    Writes frames to a recording. metadata (any JSON-able dict) is stored in the file's header.
+    '''
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self.file = open(path, 'wb')
+        metadata = json.dumps(metadata or {}).encode()
+        self.file.write(FILE_HEADER.pack(MAGIC, RECORDING_VERSION, len(metadata)))
+        self.file.write(metadata)
+        self.device_ids = None
+        self.segment_offset = None #where the current segment's header is, to fill in its record count
+        self.records = 0
+        self.frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _finish_segment(self):
+        if self.segment_offset is not None:
+            end = self.file.tell()
+            self.file.seek(self.segment_offset)
+            self.file.write(SEGMENT_HEADER.pack(SEGMENT_TAG, len(self.device_ids), self.records))
+            self.file.seek(end)
+        self.segment_offset = None
+
+    def write(self, timestamp, device_ids, colours):
+        '''
+        Appends one frame: timestamp in nanoseconds, and the device_ids and (n, 4) uint8 colours of a PatternEngine frame.
+        The colours are written from the array's own buffer, nothing is converted per device.
+        '''
+        device_ids = np.asarray(device_ids, dtype=np.uint8)
+        if self.device_ids is None or not np.array_equal(device_ids, self.device_ids):
+            self._finish_segment()
+            self.device_ids = device_ids.copy()
+            self.segment_offset = self.file.tell()
+            self.records = 0
+            self.file.write(SEGMENT_HEADER.pack(SEGMENT_TAG, len(device_ids), UNFINISHED))
+            self.file.write(self.device_ids.tobytes())
+        self.file.write(TIMESTAMP.pack(int(timestamp)))
+        self.file.write(np.ascontiguousarray(colours, dtype=np.uint8))
+        self.records += 1
+        self.frames += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        self._finish_segment()
+        self.file.close()
+
+class Segment():
+    '''
+    One run of frames with the same devices. timestamps is a (records,) and colours a (records, devices, 4) view into the memory map.
+    '''
+    def __init__(self, device_ids, records):
+        self.device_ids = device_ids
+        self.timestamps = records['timestamp']
+        self.colours = records['colours']
+
+    def __len__(self):
+        return len(self.timestamps)
+
+class Recording():
+    '''
+    A recording opened through a read-only memory map, nothing but the segment headers is read until frames are used.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < FILE_HEADER.size:
+                raise RecordingError(path + " is too short to be a recording")
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metadata_length = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise RecordingError(path + " is not a recording")
+        if version != RECORDING_VERSION:
+            raise RecordingError("unsupported recording version " + str(version))
+        offset = FILE_HEADER.size
+        try:
+            self.metadata = json.loads(bytes(self.map[offset:offset + metadata_length]))
+        except ValueError as error:
+            raise RecordingError("could not read the recording's metadata: " + str(error))
+        offset += metadata_length
+
+        self.segments = []
+        while offset < size:
+            if size - offset < SEGMENT_HEADER.size:
+                raise RecordingError("truncated segment header at byte " + str(offset))
+            tag, devices, count = SEGMENT_HEADER.unpack_from(self.map, offset)
+            if tag != SEGMENT_TAG:
+                raise RecordingError("damaged segment at byte " + str(offset))
+            offset += SEGMENT_HEADER.size
+            device_ids = np.frombuffer(self.map, dtype=np.uint8, count=devices, offset=offset)
+            offset += devices
+            dtype = record_dtype(devices)
+            if count == UNFINISHED:
+                count = (size - offset) // dtype.itemsize
+            if offset + count * dtype.itemsize > size:
+                raise RecordingError("segment at byte " + str(offset) + " is cut short")
+            self.segments.append(Segment(device_ids, np.frombuffer(self.map, dtype=dtype, count=count, offset=offset)))
+            offset += count * dtype.itemsize
+        self.segments = [segment for segment in self.segments if len(segment)]
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def frames(self):
+        '''
+        Yields (timestamp, device_ids, colours) for every recorded frame, colours being views into the memory map.
+        '''
+        for segment in self.segments:
+            for index in range(len(segment)):
+                yield int(segment.timestamps[index]), segment.device_ids, segment.colours[index]
+
+    def close(self):
+        #the views handed out keep the map alive, so it is only released once they are gone
+        self.segments = []
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+
+class Player():
+    '''
+    Steps through a recording in pattern time: advance(elapsed) returns the (device_ids, colours) frame that was showing elapsed seconds later,
+    the same way PatternEngine.step() moves on by elapsed. With loop=True it starts over from the beginning after the last frame.
+    '''
+    def __init__(self, recording, loop=False):
+        if not len(recording):
+            raise RecordingError(recording.path + " has no frames")
+        self.recording = recording
+        self.loop = loop
+        self.starts = np.array([segment.timestamps[0] for segment in recording.segments], dtype=np.int64)
+        last = recording.segments[-1].timestamps
+        self.start = int(self.starts[0])
+        #the last frame is shown for as long as the gap before it, so a looping recording keeps its rhythm
+        self.end = int(last[-1]) + (int(last[-1] - last[-2]) if len(last) > 1 else DEFAULT_TICK)
+        self.clock = None #the first advance() shows the first frame
+        self.finished = False
+
+    def advance(self, elapsed):
+        if self.clock is None:
+            self.clock = self.start
+            return self.current()
+        self.clock += int(round(elapsed * NANOSECONDS))
+        if self.clock >= self.end:
+            if self.loop:
+                self.clock = self.start + (self.clock - self.start) % (self.end - self.start)
+            else:
+                self.clock = self.end - 1
+                self.finished = True
+        return self.current()
+
+    def current(self):
+        segment = self.recording.segments[max(0, int(np.searchsorted(self.starts, self.clock, 'right')) - 1)]
+        index = max(0, int(np.searchsorted(segment.timestamps, self.clock, 'right')) - 1)
+        return segment.device_ids, segment.colours[index]
+
+def record_patterns(path, args, ticks, fps=None, seed=0, patterns=None):
+    '''
+    Renders ticks frames of args (server.exe style pattern arguments) from a seeded engine into a recording, which can later be verified.
+    Without fps the engine takes legacy steps (exactly server.cpp's ticks), otherwise real time steps of 1 / fps seconds.
+    patterns are the definitions of any user defined patterns args names, kept in the recording so it can be verified without the profile store.
+    Returns the number of frames written.
+    '''
+    engine = PatternEngine(args, seed=seed, patterns=parse_patterns(patterns or {}))
+    metadata = {'args': [str(value) for value in args], 'seed': seed, 'fps': fps, 'ticks': ticks}
+    if patterns:
+        metadata['patterns'] = patterns
+    with Recorder(path, metadata) as recorder:
+        for tick in range(ticks):
+            engine.step(None if fps is None else 1 / fps)
+            recorder.write(engine.clock if fps is not None else engine.ticks * DEFAULT_TICK, engine.device_id, engine.frame())
+        return recorder.frames
+
+def verify_recording(path):
+    '''
+    Renders a recording made by record_patterns again, from the arguments and seed in its metadata.
+    Returns None if every frame matches, otherwise (frame index, device_ids, recorded colours, rendered colours) for the first difference.
+    '''
+    with Recording(path) as recording:
+        metadata = recording.metadata
+        if 'args' not in metadata:
+            raise RecordingError(path + " was not made from pattern arguments, so it can't be verified")
+        engine = PatternEngine(metadata['args'], seed=metadata.get('seed'), patterns=parse_patterns(metadata.get('patterns', {})))
+        fps = metadata.get('fps')
+        for index, (timestamp, device_ids, colours) in enumerate(recording.frames()):
+            engine.step(None if fps is None else 1 / fps)
+            frame = engine.frame()
+            if not np.array_equal(device_ids, engine.device_id) or not np.array_equal(colours, frame):
+                return index, device_ids.copy(), colours.copy(), frame
+        return None
@@ -0,0 +1,96 @@
+'''
+Fixed-rate tick scheduling.
+
+server.cpp renders, sends, then calls Sleep(50), so every tick really takes 50ms plus however long the work took, and the patterns slow down as the
+number of devices grows. TickScheduler instead keeps a fixed timeline of deadlines (start + n * period) on the monotonic clock and sleeps until
+the next one, so time spent working is absorbed instead of accumulating. Every tick records how late it woke up, to show the timing stays stable.
+
+When a tick is late by more than a whole period (the machine was busy, or a tick took too long), late_policy decides what happens to the missed ticks:
+
+    'skip'      the missed ticks are not rendered, the next tick is passed all the elapsed time so the patterns jump ahead and stay in real time
+    'catch-up'  the missed ticks are rendered back to back (up to max_catch_up of them, the rest are skipped as above)
+'''
+
+from collections import deque
+import time
+
+DEFAULT_FPS = 20 #the 50ms tick of server.cpp
+MAX_CATCH_UP = 5
+LATENESS_HISTORY = 1000 #ticks kept for the lateness statistics
+LATE_POLICIES = ('skip', 'catch-up')
+
+class TickScheduler():
+    '''
+    Calls a tick function at a fixed rate, passing it the seconds of pattern time the tick covers.
+    '''
+    def __init__(self, fps=DEFAULT_FPS, late_policy='skip', max_catch_up=MAX_CATCH_UP, history=LATENESS_HISTORY):
+        if fps <= 0:
+            raise ValueError("fps must be positive")
+        if late_policy not in LATE_POLICIES:
+            raise ValueError("late_policy must be one of " + ", ".join(LATE_POLICIES))
+        self.fps = fps
+        self.period = 1 / fps
+        self.late_policy = late_policy
+        self.max_catch_up = max_catch_up
+
+        self.lateness = deque(maxlen=history) #seconds each tick woke up after its deadline
+        self.ticks = 0
+        self.skipped = 0
+        self.start = None
+        self.next_deadline = None
+
+    def reset(self):
+        self.start = time.monotonic()
+        self.next_deadline = self.start + self.period
+        self.lateness.clear()
+        self.ticks = 0
+        self.skipped = 0
+
+    def wait(self):
+        '''
+        Sleeps until the next deadline and returns how many periods have passed since the previous tick (1 unless ticks were missed).
+        '''
+        if self.next_deadline is None:
+            self.reset()
+        delay = self.next_deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        now = time.monotonic()
+        late = now - self.next_deadline
+        self.lateness.append(late)
+
+        due = 1 + int(late // self.period) #the deadlines we have passed, including the one we woke up for
+        self.next_deadline += due * self.period #stays on the original timeline, so lateness never builds up
+        return due
+
+    def run(self, tick, running):
+        '''
+        Calls tick(elapsed) at the scheduled rate for as long as running() returns True.
+        '''
+        self.reset()
+        while running():
+            due = self.wait()
+            if self.late_policy == 'catch-up':
+                rendered = min(due, 1 + self.max_catch_up)
+            else:
+                rendered = 1
+            self.skipped += due - rendered
+            for index in range(rendered):
+                #the last tick also covers any skipped ticks, so pattern time always matches real time
+                periods = due - rendered + 1 if index == rendered - 1 else 1
+                tick(periods * self.period)
+                self.ticks += 1
+
+    def stats(self):
+        '''
+        Returns the timing statistics as a dict, lateness values in milliseconds.
+        '''
+        samples = sorted(self.lateness)
+        def percentile(fraction):
+            return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000 if samples else None
+        elapsed = time.monotonic() - self.start if self.start is not None else 0
+        return {'fps': self.fps, 'effective_fps': self.ticks / elapsed if elapsed > 0 else None,
+                'ticks': self.ticks, 'skipped': self.skipped,
+                'lateness_mean': sum(samples) / len(samples) * 1000 if samples else None,
+                'lateness_p50': percentile(0.5), 'lateness_p95': percentile(0.95),
+                'lateness_p99': percentile(0.99), 'lateness_max': samples[-1] * 1000 if samples else None}
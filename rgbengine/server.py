@@ -0,0 +1,574 @@
+'''
+Long-lived syncing server, the Python counterpart of rgbsyncserver/server.cpp.
+
+server.cpp takes its patterns as command line arguments, so every pattern change meant killing it, respawning every API client and waiting for them
+to reconnect, with the LEDs going back to their vendor defaults in the meantime. This server is started once and keeps its API client connections open.
+Pattern changes come in over a local control socket (see control.py) and are applied on the next tick.
+
+Control messages are single lines of JSON, each answered by one line of JSON once the change has been sent to the API clients:
+
+    {"command": "set-device-pattern", "args": [device, r, g, b, a, speed, pattern]}
+    {"command": "load-profile", "args": [device1, r1, ..., pattern1, device2, ...]}
+    {"command": "clear-device", "device_id": device}          device 0 ('All') clears every device
+    {"command": "record", "path": "frames.rgbrec"}              records every frame sent from now on (see recording.py)
+    {"command": "stop-recording"}
+    {"command": "play", "path": "frames.rgbrec", "loop": true}  sends a recording instead of running the patterns
+    {"command": "stop-playback"}                                 so does any pattern change
+    {"command": "ping"}
+    {"command": "stats"}
+    {"command": "discover"}
+    {"command": "stop"}
+
+The API clients have no way of handing a device back to its vendor's default, so a cleared device is sent RELEASED_COLOUR (off) once, rather
+than being left on the last colour it was sent. Stopping the server is what hands every device back.
+
+set-device-pattern and load-profile fade from the previous patterns over the server's transition time (see transitions.py), a command can
+ask for its own with e.g. "transition": 2.0, or 0 to switch straight away. They can also carry user defined patterns that their device lines name,
+as "patterns": {"name": {"keyframes": [...], ...}} (see keyframes.py), which the server keeps for later commands too.
+
+Replies look like {"ok": true, "tick": 1234, "devices": 3, "latency": 0.021}, where latency is the time in seconds from the command arriving
+to the frame containing it being handed to the API client connections. Failed commands reply {"ok": false, "error": "..."}.
+
+Given the backends to look for, the server runs discover() itself when it starts and every REDISCOVER_INTERVAL seconds after, and starts
+the API client (or bridge) of every backend that has turned up since, e.g. iCUE started after the engine. {"command": "discover"} does the
+same straight away, answering {"ok": true, "started": [names], "discovery": {...}}. A backend, once started, is left running.
+
+Backends in BRIDGES are driven in process instead of by an API client: the bridge connects to the client port like an API client would,
+but runs on one of the server's threads (see razer.py).
+
+Consumers on the same machine can read frames from shared memory instead of the client port: started with shared_frames, the server also
+writes every frame, complete, into a frame ring (see framering.py) that any number of processes can read without a socket each.
+
+stats is answered straight away rather than on the next tick, so it still works when the tick loop is the thing that is stuck.
+Its reply holds {"ok": true, "stats": {...}} with the timing histograms (see metrics.py), the scheduler's fps and lateness, and per-client counters.
+'''
+
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+from rgbengine.cycles import DEFAULT_CYCLE_CACHE
+from rgbengine.discovery import BACKENDS, discover
+from rgbengine.fanout import FanOut, QUEUE_SIZE, KEYFRAME_INTERVAL
+from rgbengine.framering import FrameRingWriter
+from rgbengine.keyframes import parse_patterns
+from rgbengine.leds import LedRenderer
+from rgbengine.metrics import Histogram
+from rgbengine.patterns import PatternEngine, ARGS_PER_DEVICE, NANOSECONDS
+from rgbengine.profiles import validate_device
+from rgbengine.protocol import HOST, PORT, CONTROL_PORT, FLAG_KEYFRAME, LEGACY_MAX_DEVICE_ID, LedFrameWriter, encode_frame, encode_message
+from rgbengine.razer import RazerBridge
+from rgbengine.recording import Recorder, Recording, Player, DEFAULT_TICK
+from rgbengine.scheduler import TickScheduler, DEFAULT_FPS
+from rgbengine.transitions import Transition, DEFAULT_TRANSITION, snapshot
+
+#backends driven in process, by name, each a factory taking the server's host, port and whether it sends legacy messages
+BRIDGES = {'razer': RazerBridge}
+
+#all currently implemented API clients, relative to the rgbsyncserver directory (the same list as API_PATHS in server.cpp)
+API_PATHS = [backend.path for backend in BACKENDS]
+
+COMMAND_TIMEOUT = 5 #seconds a control connection waits for its command to be applied
+RESPAWN_WINDOW = 3 #seconds after a client drops in which exited API client processes are restarted
+REDISCOVER_INTERVAL = 30 #seconds between looking again for backends that were not found, see rediscover()
+
+WIRE_FORMATS = ('legacy', 'binary', 'leds')
+RELEASED_COLOUR = (0, 0, 0, 0) #sent once to a device whose pattern was cleared
+
+def check_device_args(args, single=False, max_device_id=255):
+    '''
+    Returns args if it is a list of server.exe style device arguments (device r g b a speed pattern, repeated), exactly one device if single,
+    each one in range as profiles.validate_device checks a profile's lines and with a device id of at most max_device_id.
+    Raises ValueError otherwise.
+    '''
+    if not isinstance(args, list) or len(args) % ARGS_PER_DEVICE != 0 or (single and len(args) != ARGS_PER_DEVICE):
+        raise ValueError("args must be a list of " + ("" if single else "a multiple of ") + str(ARGS_PER_DEVICE)
+                         + " values: device r g b a speed pattern")
+    for index in range(0, len(args), ARGS_PER_DEVICE):
+        device = args[index:index + ARGS_PER_DEVICE]
+        if not isinstance(device[-1], str):
+            raise ValueError("pattern must be a name, got " + str(device[-1]))
+        validate_device(device)
+        if int(device[0]) > max_device_id:
+            raise ValueError("device ids go up to " + str(max_device_id) + " in this wire format, got " + str(device[0]))
+    return args
+
+class Command():
+    '''
+    A control request waiting to be applied by the tick loop.
+    '''
+    def __init__(self, request):
+        self.request = request
+        self.received = time.monotonic()
+        self.done = threading.Event()
+        self.reply = None
+
+    def finish(self, reply):
+        self.reply = reply
+        self.done.set()
+
+class SyncServer():
+    '''
+    Renders patterns with a PatternEngine and streams them to every connected API client.
+    wire_format is 'legacy' for the shipped C++ API clients, 'binary' for clients that read protocol.py frames,
+    or 'leds' for clients that read protocol.py LED frames, with every LED rendered by a LedRenderer.
+    Port 0 picks a free port, the bound ports are available as self.port and self.control_port once start() returns.
+    Frames are sent through a FanOut, so a slow client only delays (and drops frames for) itself, queue_size being how many frames it may fall behind.
+    Ticks run at a fixed fps on a TickScheduler, pattern speeds are real time rates so they look the same at any fps (see PatternEngine.step).
+    Clients are only sent the devices whose colour changed, plus every device once every keyframe_interval ticks (1 sends everything every tick).
+    Pattern changes cross-fade over transition seconds by default.
+    bridges are started once the server listens, as bridge(host=, port=, legacy=) (see BRIDGES), and stopped with it.
+    shared_frames is the name of a frame ring to also write every frame into, as a binary keyframe (or LED frame), or None for no ring.
+    backends, if given, are discovered when the server starts and every rediscover_interval seconds while it runs, see rediscover(),
+    with discovery_cache as the DiscoveryCache (the default one in the profile directory if None).
+    '''
+    def __init__(self, host=HOST, port=PORT, control_port=CONTROL_PORT, wire_format='legacy', api_paths=(), cwd=None,
+                 fps=DEFAULT_FPS, late_policy='skip', cycle_cache=DEFAULT_CYCLE_CACHE, queue_size=QUEUE_SIZE,
+                 keyframe_interval=KEYFRAME_INTERVAL, discovery=None, seed=None, transition=DEFAULT_TRANSITION,
+                 shared_frames=None, bridges=(), backends=None, rediscover_interval=REDISCOVER_INTERVAL, discovery_cache=None):
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError("wire_format must be one of " + ", ".join(WIRE_FORMATS))
+        self.host = host
+        self.port = port
+        self.control_port = control_port
+        self.wire_format = wire_format
+        self.api_paths = list(api_paths)
+        self.cwd = cwd
+        self.discovery = discovery #what discover() found, if the api paths came from it, reported in stats
+        self.scheduler = TickScheduler(fps=fps, late_policy=late_policy)
+
+        self.engine = PatternEngine(cycle_cache=cycle_cache, seed=seed, wait_for_cycles=False) #the tick thread never waits for a cycle
+        self.leds = LedRenderer(self.engine) if wire_format == 'leds' else None
+        self.transition_time = transition
+        self.transition = None #the fade in progress, if any
+        self.sequence = 0
+        self.pattern_time = 0 #nanoseconds of pattern time sent so far, the timestamps of recorded frames
+        self.recorder = None
+        self.player = None
+        self.released = [] #ids of the devices cleared since the last tick, sent RELEASED_COLOUR once
+        self.shared_frames = shared_frames
+        self.ring = None
+
+        self.fanout = FanOut(queue_size=queue_size, on_disconnect=self._client_disconnected, keyframe_interval=keyframe_interval)
+        self.processes = [] #API client subprocesses, one per api path
+        self.bridge_factories = list(bridges)
+        self.bridges = []
+        self.bridge_errors = [] #bridges that could not be started, e.g. the vendor's software stopped answering since it was discovered
+        self.backends = backends
+        self.rediscover_interval = rediscover_interval
+        self.discovery_cache = discovery_cache
+        self.backends_started = set() #names of the backends rediscover() has started
+        self.backends_lock = threading.Lock() #held while rediscover() adds API clients, which the tick thread respawns
+        self.respawn_until = 0
+        self.respawns = 0
+        self.output_errors = {} #exceptions raised by the fan-out, frame ring and recorder, by name, see _output()
+        self.last_output_error = None
+
+        self.started = None
+        self.render_time = Histogram() #advancing the patterns and reading out the frame
+        self.publish_time = Histogram() #diffing and encoding the frame for every client
+        self.tick_time = Histogram() #the whole tick, commands included
+
+        self.commands = []
+        self.commands_lock = threading.Lock()
+
+        self.running = False
+        self.stopping = False #set by the stop command, the tick loop then shuts everything down
+        self.stopped = threading.Event()
+        self.listening_socket = None
+        self.control_socket = None
+        self.threads = []
+
+    def start(self):
+        '''
+        Binds the client and control ports, spawns the API clients and starts the tick loop, all in background threads.
+        '''
+        self.listening_socket = self._listen(self.port)
+        self.port = self.listening_socket.getsockname()[1]
+        self.control_socket = self._listen(self.control_port)
+        self.control_port = self.control_socket.getsockname()[1]
+        if self.shared_frames is not None:
+            self.ring = FrameRingWriter(self.shared_frames)
+        self.running = True
+        self.started = time.monotonic()
+        self.fanout.start()
+
+        self.processes = [self._spawn(path) for path in self.api_paths]
+        for target, name in ((self._accept_clients, 'clients'), (self._accept_control, 'control'), (self._run, 'ticks')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        for factory in self.bridge_factories:
+            self._start_bridge(factory)
+        if self.backends is not None:
+            self.rediscover()
+            thread = threading.Thread(target=self._rediscover_periodically, name='discovery', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def _start_bridge(self, factory):
+        try:
+            self.bridges.append(factory(host=self.host, port=self.port, legacy=self.wire_format == 'legacy').start())
+        except OSError as error:
+            self.bridge_errors.append(str(error))
+
+    def rediscover(self, refresh=False):
+        '''
+        Runs discover() for the server's backends and starts the API client (or bridge) of every present backend not started yet.
+        Returns the names of the backends it started.
+        '''
+        discovery = discover(self.backends, cwd=self.cwd, cache=self.discovery_cache, refresh=refresh)
+        started = []
+        with self.backends_lock:
+            for result in discovery['backends']:
+                if not result['present'] or result['name'] in self.backends_started:
+                    continue
+                if result['name'] in BRIDGES:
+                    self._start_bridge(BRIDGES[result['name']])
+                else:
+                    self.api_paths.append(result['path'])
+                    self.processes.append(self._spawn(result['path']))
+                self.backends_started.add(result['name'])
+                started.append(result['name'])
+            self.discovery = discovery
+        return started
+
+    def _rediscover_periodically(self):
+        while not self.stopped.wait(self.rediscover_interval):
+            if self.running and set(backend.name for backend in self.backends) - self.backends_started:
+                self.rediscover()
+
+    def serve_forever(self):
+        '''
+        Starts the server and blocks until a stop command arrives.
+        '''
+        self.start()
+        self.stopped.wait()
+
+    def stop(self):
+        '''
+        Stops ticking and closes every socket. Closing the client sockets makes the API clients hand control back and exit by themselves.
+        '''
+        if not self.running:
+            return
+        self.running = False
+        for bridge in self.bridges:
+            bridge.stop()
+        for sock in (self.listening_socket, self.control_socket):
+            sock.close()
+        self.fanout.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.ring is not None:
+            for thread in self.threads:
+                if thread.name == 'ticks' and thread is not threading.current_thread():
+                    thread.join(COMMAND_TIMEOUT) #the tick being run may still be writing to the ring
+            self.ring.close()
+        self.stopped.set()
+
+    def _listen(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((self.host, port))
+        sock.listen(socket.SOMAXCONN)
+        return sock
+
+    def _spawn(self, path):
+        '''
+        Starts one API client subprocess, returns None if it could not be started (e.g. it has not been built on this machine).
+        '''
+        cwd = self.cwd or os.getcwd()
+        try:
+            return subprocess.Popen([os.path.join(cwd, path)], cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                    creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        except OSError:
+            return None
+
+    def _respawn_exited(self):
+        '''
+        Restarts API client processes that have exited, e.g. the Corsair client closing itself after 2 hours.
+        '''
+        with self.backends_lock:
+            for index, process in enumerate(self.processes):
+                if process is not None and process.poll() is not None:
+                    self.processes[index] = self._spawn(self.api_paths[index])
+                    self.respawns += 1
+
+    def _accept_clients(self):
+        #unlike server.cpp we keep accepting, so a client that starts late (or restarts) joins without disturbing the others
+        while self.running:
+            try:
+                client, address = self.listening_socket.accept()
+            except OSError:
+                break
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.fanout.add(client)
+
+    def _client_disconnected(self, connection):
+        #the API client exits once its socket closes, so give it a moment and then start it again, without touching the other clients
+        self.respawn_until = time.monotonic() + RESPAWN_WINDOW
+
+    def _accept_control(self):
+        while self.running:
+            try:
+                connection, address = self.control_socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle_control, args=(connection,), name='control-connection', daemon=True).start()
+
+    def _handle_control(self, connection):
+        '''
+        Reads JSON commands line by line from one control connection and answers each once it has been applied.
+        '''
+        with connection, connection.makefile('rwb') as stream:
+            for line in stream:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                if not isinstance(request, dict):
+                    request = {}
+                    reply = {'ok': False, 'error': 'commands must be JSON objects'}
+                elif request.get('command') == 'stats':
+                    reply = {'ok': True, 'stats': self.stats()}
+                elif request.get('command') == 'discover':
+                    #probing takes up to a second, so it is done here rather than holding up a tick
+                    if self.backends is None:
+                        reply = {'ok': False, 'error': 'the server was not given any backends to discover'}
+                    else:
+                        reply = {'ok': True, 'started': self.rediscover(refresh=True), 'discovery': self.discovery}
+                else:
+                    command = self.submit(request)
+                    if command.done.wait(COMMAND_TIMEOUT):
+                        reply = command.reply
+                    else:
+                        reply = {'ok': False, 'error': 'timed out'}
+                try:
+                    stream.write(json.dumps(reply).encode() + b'\n')
+                    stream.flush()
+                except OSError:
+                    break
+                if request.get('command') == 'stop' and reply.get('ok'):
+                    break
+
+    def submit(self, request):
+        '''
+        Queues a command dict to be applied at the start of the next tick, returns the Command to wait on.
+        '''
+        command = Command(request)
+        with self.commands_lock:
+            self.commands.append(command)
+        return command
+
+    def _apply(self, request):
+        '''
+        Applies one command to the engine. Raises on invalid commands, which the tick loop turns into an error reply.
+        '''
+        name = request.get('command')
+        #everything a pattern change carries is checked before any of it is applied, so a bad command leaves the server as it was
+        if name in ('set-device-pattern', 'load-profile'):
+            patterns = parse_patterns(request['patterns']) if 'patterns' in request else {}
+            args = check_device_args(request.get('args'), single=name == 'set-device-pattern',
+                                     max_device_id=LEGACY_MAX_DEVICE_ID if self.wire_format == 'legacy' else 255)
+            #a recording being played is not in the engine, so there is nothing to fade from
+            duration = float(request.get('transition', self.transition_time)) if self.player is None else 0
+            if duration < 0:
+                raise ValueError("transition must not be negative")
+            self.engine.define_patterns(patterns)
+            self._start_transition(duration)
+        elif name == 'clear-device':
+            device_id = int(request['device_id'])
+        if name in ('set-device-pattern', 'load-profile', 'clear-device'):
+            self.player = None #the user picked a pattern, so that is what they want to see
+        if name == 'set-device-pattern':
+            self.engine.set_device(*args)
+        elif name == 'load-profile':
+            self.engine.set_patterns(args)
+        elif name == 'clear-device':
+            self.released += self.engine.clear_device(device_id)
+        elif name == 'record':
+            if self.leds is not None:
+                raise ValueError("recordings hold one colour per device, they can't be made with the leds wire format")
+            if self.recorder is not None:
+                self.recorder.close()
+            self.recorder = Recorder(request['path'], {'wire_format': self.wire_format, 'fps': self.scheduler.fps})
+        elif name == 'stop-recording':
+            if self.recorder is not None:
+                self.recorder.close()
+            self.recorder = None
+        elif name == 'play':
+            if self.leds is not None:
+                raise ValueError("recordings hold one colour per device, they can't be played with the leds wire format")
+            self.player = Player(Recording(request['path']), loop=bool(request.get('loop', False)))
+        elif name == 'stop-playback':
+            self.player = None
+        elif name == 'stop':
+            self.stopping = True
+        elif name != 'ping':
+            raise ValueError("unknown command " + str(name))
+
+    def _start_transition(self, duration):
+        '''
+        Keeps what is showing before a pattern change running as the outgoing side of a new Transition into the engine.
+        '''
+        outgoing = snapshot(self.engine)
+        if self.transition is not None:
+            #fade from the blend on show, with the engine as it was before this change as its incoming side
+            self.transition.incoming = outgoing
+            outgoing = self.transition
+        self.transition = Transition(outgoing, self.engine, duration) if duration and len(self.engine) else None
+        if self.transition is not None and self.leds is not None:
+            self.leds.freeze()
+
+    def _run(self):
+        self.scheduler.run(self.tick, lambda: self.running and not self.stopping)
+        self.stop()
+
+    def tick(self, elapsed=None):
+        '''
+        One iteration of the main loop: apply queued commands, advance every pattern by elapsed seconds, and send the result to every client.
+        Without elapsed the patterns advance by one server.cpp tick.
+        '''
+        start = time.perf_counter()
+        with self.commands_lock:
+            commands, self.commands = self.commands, []
+        results = []
+        for command in commands:
+            try:
+                self._apply(command.request)
+                results.append(None)
+            except Exception as error:
+                results.append(str(error) or type(error).__name__)
+
+        render_start = time.perf_counter()
+        self.pattern_time += DEFAULT_TICK if elapsed is None else int(round(elapsed * NANOSECONDS))
+        if self.player is not None:
+            #playback sends the recorded frames as they are, no pattern is run
+            device_ids, frame = self.player.advance(DEFAULT_TICK / NANOSECONDS if elapsed is None else elapsed)
+            if self.player.finished:
+                self.player = None
+            publish_start = time.perf_counter()
+            self._output('fanout', self.fanout.publish_frame, device_ids, frame, self.encode)
+        elif self.leds is not None:
+            source = self._step(elapsed)
+            #LED frames are rendered straight into the buffer that gets sent, and every LED of a spatial pattern moves each tick, so nothing is diffed.
+            #a fade blends the LEDs themselves, so spatial patterns fade too
+            frame = self.leds.frame(self.sequence, fade=source.weight if source is not self.engine else 0)
+            publish_start = time.perf_counter()
+            self._output('fanout', self.fanout.publish, frame)
+            if self.released:
+                self._output('fanout', self._publish_released_leds)
+        else:
+            source = self._step(elapsed)
+            device_ids = self.engine.device_id
+            frame = source.frame()
+            publish_start = time.perf_counter()
+            #changes made by the commands are picked up here too, since every device is compared against what each client was last sent
+            sent_ids, sent = device_ids, frame
+            released = [device_id for device_id in self.released if device_id not in device_ids] #unless set again straight after
+            if released:
+                #ahead of the devices still running, so an 'All' cleared while a device was set shows the device on top
+                sent_ids = np.concatenate([released, device_ids])
+                sent = np.concatenate([np.tile(np.array(RELEASED_COLOUR, dtype=frame.dtype), (len(released), 1)), frame])
+            self._output('fanout', self.fanout.publish_frame, sent_ids, sent, self.encode)
+        self.released = []
+        if self.ring is not None:
+            #readers may skip frames, so every frame in the ring holds every device
+            self._output('shared_frames', lambda: self.ring.write(frame if self.leds is not None
+                                                                  else encode_frame(device_ids, frame, self.sequence, flags=FLAG_KEYFRAME)))
+        if self.recorder is not None:
+            self._output('recording', self.recorder.write, self.pattern_time, device_ids, frame)
+        self.sequence += 1
+        end = time.perf_counter()
+        self.render_time.record(publish_start - render_start)
+        self.publish_time.record(end - publish_start)
+        self.tick_time.record(end - start)
+
+        sent = time.monotonic()
+        for command, error in zip(commands, results):
+            if error is None:
+                command.finish({'ok': True, 'tick': self.engine.ticks, 'devices': len(self.engine), 'latency': sent - command.received})
+            else:
+                command.finish({'ok': False, 'error': error})
+
+        if time.monotonic() < self.respawn_until:
+            self._respawn_exited()
+
+    def _publish_released_leds(self):
+        '''
+        Sends the devices cleared since the last tick one LED frame with every LED RELEASED_COLOUR.
+        '''
+        layouts = self.leds.layouts
+        device_ids = sorted(layouts) if 0 in self.released else sorted(set(self.released) & set(layouts))
+        if device_ids:
+            data, leds = LedFrameWriter(device_ids, [len(layouts[device_id]) for device_id in device_ids]).allocate(self.sequence)
+            leds[:] = RELEASED_COLOUR
+            self.fanout.publish(memoryview(data))
+
+    def _output(self, name, write, *args):
+        '''
+        Hands the tick's frame to one of its outputs. An exception is counted in output_errors instead of being raised,
+        as it would end the tick loop and with it the server: one bad frame only costs that frame.
+        '''
+        try:
+            write(*args)
+        except Exception as error:
+            self.output_errors[name] = self.output_errors.get(name, 0) + 1
+            self.last_output_error = name + ": " + (str(error) or type(error).__name__)
+
+    def _step(self, elapsed):
+        '''
+        Advances the engine, along with the patterns it is fading from, and returns what to take the frame from.
+        '''
+        if self.transition is None:
+            self.engine.step(elapsed)
+            return self.engine
+        transition = self.transition
+        transition.step(elapsed)
+        if transition.done:
+            self.transition = None
+        return transition
+
+    def stats(self):
+        '''
+        Returns a snapshot of the engine's metrics as a JSON-ready dict, times in milliseconds.
+        '''
+        fanout = self.fanout.stats()
+        return {'uptime': time.monotonic() - self.started if self.started is not None else 0,
+                'devices': len(self.engine), 'wire_format': self.wire_format, 'sequence': self.sequence,
+                'recording': self.recorder.path if self.recorder is not None else None,
+                'playing': self.player.recording.path if self.player is not None else None,
+                'transition': self.transition.stats() if self.transition is not None else None,
+                'shared_frames': {'name': self.ring.name, 'frames': self.ring.frames} if self.ring is not None else None,
+                'scheduler': self.scheduler.stats(),
+                'render_time': self.render_time.summary(), 'publish_time': self.publish_time.summary(), 'tick_time': self.tick_time.summary(),
+                'clients': fanout.pop('clients'), 'fanout': fanout, 'respawns': self.respawns,
+                'processes_running': sum(1 for process in self.processes if process is not None and process.poll() is None),
+                'bridges': [bridge.stats() for bridge in self.bridges], 'bridge_errors': self.bridge_errors,
+                'output_errors': dict(self.output_errors), 'last_output_error': self.last_output_error,
+                'patterns': sorted(self.engine.patterns),
+                'cycle_cache': self.engine.cycle_cache.stats() if self.engine.cycle_cache is not None else None,
+                'discovery': self.discovery}
+
+    def encode(self, device_ids, colours, keyframe):
+        '''
+        Encodes the devices being sent this tick in the server's wire format, as one binary frame or back to back legacy messages.
+        '''
+        if self.wire_format == 'binary':
+            return encode_frame(device_ids, colours, self.sequence, flags=FLAG_KEYFRAME if keyframe else 0)
+        return b''.join(encode_message(device_id, *colour) for device_id, colour in zip(device_ids, colours))
+
+def main(backends=BACKENDS, cwd=None, **options):
+    '''
+    Runs the server until it receives a stop command, starting the API clients (or bridges) of the backends that discover() finds,
+    now or while it runs. options are passed on to SyncServer.
+    '''
+    SyncServer(cwd=cwd, backends=backends, **options).serve_forever()
+
+if __name__ == "__main__":
+    main(cwd=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rgbsyncserver'))
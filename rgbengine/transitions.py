@@ -0,0 +1,147 @@
+'''
+Cross-fading between patterns when they are changed.
+
+Changing a profile used to cut straight from one set of colours to the next. Instead, the server keeps a copy of the engine as it was before the
+change (the outgoing patterns) running next to the engine itself (the incoming patterns) for the length of the transition, and every frame
+blends the two with one weighted sum over all devices at once:
+
+    colour = incoming + (outgoing - incoming) * (1 - eased progress)
+
+Each incoming device fades from the same device's outgoing colour, or from the outgoing 'All' colour if it had no slot of its own. Devices with
+nothing to fade from (e.g. a device set while no pattern was running) show their new pattern straight away.
+
+A change made during a transition fades from whatever was showing at that moment, by making the running transition the outgoing side of the new one.
+At most MAX_TRANSITIONS are kept running inside each other, beyond that the oldest one is frozen on the frame it was showing (a Still), so even
+rapid clicking costs no more than MAX_TRANSITIONS engine steps and blends per tick, without the jump of cutting a fade short.
+
+The leds wire format fades every LED instead of every device colour, with the transition's weight (see LedRenderer.freeze()), since spatial
+effects have no single colour per device to blend.
+'''
+
+import copy
+
+import numpy as np
+
+from rgbengine.patterns import STATE_FIELDS
+
+DEFAULT_TRANSITION = 0.5 #seconds a pattern change fades over, 0 switches straight away
+MAX_TRANSITIONS = 3
+LEGACY_STEP = 0.05 #seconds of a step without elapsed, server.cpp's tick
+
+def snapshot(engine):
+    '''
+    Returns an independent copy of a PatternEngine that carries on exactly as the engine would, sharing its (read only) cycle cache and tables.
+    '''
+    outgoing = copy.copy(engine)
+    for name in STATE_FIELDS:
+        setattr(outgoing, name, getattr(engine, name).copy())
+    outgoing.devices = list(engine.devices)
+    outgoing.cycle_offsets = dict(engine.cycle_offsets)
+    outgoing.rng = copy.deepcopy(engine.rng) #so randomstrobe devices left unchanged keep drawing the same colours on both sides
+    return outgoing
+
+def ease(progress):
+    '''
+    Smoothstep, so fades start and end gently instead of with a visible jump in speed.
+    '''
+    return progress * progress * (3 - 2 * progress)
+
+def source_slots(outgoing_ids, incoming_ids):
+    '''
+    Returns, for every incoming device, the outgoing slot it fades from, or -1 if it has none.
+    '''
+    outgoing_ids = np.asarray(outgoing_ids)
+    incoming_ids = np.asarray(incoming_ids)
+    lookup = np.full(256, -1, dtype=np.intp) #device ids are a single byte on the wire
+    valid = (outgoing_ids >= 0) & (outgoing_ids < 256)
+    slots = np.flatnonzero(valid)[::-1]
+    lookup[outgoing_ids[slots]] = slots #assigned last to first, so a device's first slot wins
+    in_range = (incoming_ids >= 0) & (incoming_ids < 256)
+    sources = np.where(in_range, lookup[np.clip(incoming_ids, 0, 255)], -1)
+    sources = np.where(sources < 0, lookup[0], sources)
+    if len(outgoing_ids):
+        #a new 'All' covers every device, so fade it from the first of the devices it replaces
+        sources[(sources < 0) & (incoming_ids == 0)] = 0
+    return sources
+
+class Still():
+    '''
+    A frame that no longer changes, standing in for the patterns it was taken from.
+    '''
+    def __init__(self, source):
+        self.device_id = source.device_id.copy()
+        self.colours = source.frame().copy()
+
+    def step(self, elapsed=None):
+        pass
+
+    def frame(self, out=None):
+        if out is None:
+            return self.colours.copy()
+        out[:] = self.colours
+        return out
+
+class Transition():
+    '''
+    Fades from outgoing to incoming over duration seconds. Both sides are anything with step(), frame() and device_id: a PatternEngine,
+    another Transition or a Still. step() advances both sides, frame() returns the blended (n, 4) uint8 frame for incoming's devices.
+    '''
+    def __init__(self, outgoing, incoming, duration=DEFAULT_TRANSITION):
+        self.outgoing = outgoing
+        self.incoming = incoming
+        self.duration = duration
+        self.elapsed = 0.0
+        _limit_depth(self, MAX_TRANSITIONS)
+
+    @property
+    def device_id(self):
+        return self.incoming.device_id
+
+    @property
+    def done(self):
+        return self.elapsed >= self.duration
+
+    @property
+    def weight(self):
+        '''
+        How much of the outgoing side is still showing, from 1 when the transition starts down to 0 when it is done.
+        '''
+        return 0.0 if self.done else float(1 - ease(self.elapsed / self.duration))
+
+    def depth(self):
+        return 1 + (self.outgoing.depth() if isinstance(self.outgoing, Transition) else 0)
+
+    def step(self, elapsed=None):
+        self.elapsed += LEGACY_STEP if elapsed is None else elapsed
+        self.outgoing.step(elapsed)
+        if isinstance(self.outgoing, Transition) and self.outgoing.done:
+            self.outgoing = self.outgoing.incoming
+        return self.incoming.step(elapsed)
+
+    def frame(self, out=None):
+        incoming = self.incoming.frame()
+        if out is None:
+            out = np.empty_like(incoming)
+        if self.done:
+            out[:] = incoming
+            return out
+        outgoing = self.outgoing.frame()
+        sources = source_slots(self.outgoing.device_id, self.incoming.device_id)
+        fading = sources >= 0
+        weight = np.float32(self.weight)
+        blended = incoming.astype(np.float32)
+        blended[fading] += (outgoing[sources[fading]] - blended[fading]) * weight
+        np.rint(blended, out=blended)
+        out[:] = blended
+        return out
+
+    def stats(self):
+        return {'elapsed': self.elapsed, 'duration': self.duration, 'depth': self.depth()}
+
+def _limit_depth(transition, depth):
+    #the oldest transition left is frozen, along with everything it fades from
+    while isinstance(transition.outgoing, Transition):
+        if depth <= 1:
+            transition.outgoing = Still(transition.outgoing)
+            return
+        transition, depth = transition.outgoing, depth - 1
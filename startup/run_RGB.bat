@@ -1,3 +1,4 @@
 :: you can change the timeout if your computer takes longer to load your device's applications
 timeout /t 20 /nobreak
-start "" "C:\projects\RGBController\RGBController.exe"
\ No newline at end of file
+:: --apply loads your last loaded profile without opening the window, remove it if you want the window (and tray icon) on startup
+start "" "C:\projects\RGBController\RGBController.exe" --apply
\ No newline at end of file
@@ -6,7 +6,8 @@ if not exist "%FLAG%" exit
 
 :: you can change the timeout if your computer takes longer to load your device's applications
 timeout /t 20 /nobreak
-start "" "C:\projects\RGBController\RGBController.exe"
+:: --apply loads your last loaded profile without opening the window, remove it if you want the window (and tray icon) on startup
+start "" "C:\projects\RGBController\RGBController.exe" --apply
 
 :: this consumes the flag so we don't start the program again on this boot
 del "%FLAG%"
@@ -0,0 +1,38 @@
+'''
+Backend discovery and its cache, with fake probes.
+'''
+
+import time
+
+from rgbengine.discovery import Backend, DiscoveryCache, discover
+
+SLOW = 0.5
+
+def present(timeout):
+    return True, None, "running"
+
+def slow_absent(timeout):
+    time.sleep(SLOW) #as a probe waiting out its timeout would
+    return False, [], "not answering"
+
+BACKENDS = [Backend('fast', 'fast.exe', present, ['keyboard'], bridge=True), Backend('slow', 'slow.exe', slow_absent, ['mouse'], bridge=True)]
+
+def test_slow_absent_backends_are_not_waited_for(tmp_path):
+    cache = DiscoveryCache(str(tmp_path))
+    first = discover(BACKENDS, cache=cache) #never probed, so both are waited for
+    assert first['elapsed'] >= SLOW and first['pending'] == []
+    assert [result['present'] for result in first['backends']] == [True, False]
+
+    again = discover(BACKENDS, cache=cache, refresh=True)
+    assert again['elapsed'] < SLOW and again['pending'] == ['slow']
+    assert [result['present'] for result in again['backends']] == [True, False]
+    time.sleep(2 * SLOW)
+    assert cache.load()['slow']['checked'] > again['backends'][1]['checked'] #its probe saved its own result
+
+def test_absent_results_expire_sooner(tmp_path):
+    cache = DiscoveryCache(str(tmp_path), ttl=60, negative_ttl=0)
+    discover(BACKENDS, cache=cache)
+    time.sleep(0.01)
+    results = cache.load()
+    assert cache.fresh(results['fast']) and not cache.fresh(results['slow'])
+    assert discover(BACKENDS, cache=cache)['cached'] == ['fast']
@@ -0,0 +1,115 @@
+'''
+The fan-out's per client queues, dirty frame suppression and keyframes, over loopback sockets.
+'''
+
+import socket
+import time
+
+import numpy as np
+import pytest
+
+from rgbengine.fanout import FanOut
+from rgbengine.protocol import FrameDecoder, encode_frame
+from rgbengine.server import SyncServer
+
+def encode(device_ids, colours, keyframe):
+    return encode_frame(device_ids, colours, 0)
+
+@pytest.fixture
+def connect():
+    '''
+    Returns a function making a connected loopback (client, server side) pair of TCP sockets, all closed after the test.
+    '''
+    listener = socket.create_server(('127.0.0.1', 0))
+    sockets = [listener]
+    def connect():
+        client = socket.create_connection(listener.getsockname())
+        server_side = listener.accept()[0]
+        sockets.extend([client, server_side])
+        return client, server_side
+    yield connect
+    for sock in sockets:
+        sock.close()
+
+def queued_devices(fanout, connection, device_ids, colours):
+    '''
+    Publishes a frame and returns the device ids it queued for connection, or None if nothing was queued.
+    '''
+    fanout.publish_frame(device_ids, colours, encode)
+    if not connection.queue:
+        return None
+    data, queued = connection.queue.pop() #popped, so the next frame is queued behind nothing
+    return FrameDecoder().feed(bytes(data))[0].device_ids.tolist()
+
+def test_unchanged_devices_are_suppressed_until_a_keyframe(connect):
+    fanout = FanOut(keyframe_interval=4) #never started, so nothing is written and the queue can be read here
+    connection = fanout.add(connect()[1])
+    colours = np.array([[1, 0, 0, 255], [2, 0, 0, 255]])
+    sent = []
+    for tick in range(6):
+        colours[0, 0] = tick
+        sent.append(queued_devices(fanout, connection, [1, 2], colours))
+    assert sent == [[1, 2], [1], [1], [1], [1, 2], [1]]
+    assert queued_devices(fanout, connection, [1, 2], colours) is None
+    assert connection.keyframes == 2 and connection.devices_suppressed == 6 and connection.frames_suppressed == 1
+
+def test_stalled_client_drops_oldest_then_gets_everything_again(connect):
+    fanout = FanOut(queue_size=2, keyframe_interval=1000)
+    connection = fanout.add(connect()[1])
+    colours = np.array([[0, 0, 0, 255], [9, 9, 9, 255]])
+    for tick in range(5):
+        colours[0, 0] = tick
+        fanout.publish_frame([1, 2], colours, encode)
+        assert len(connection.queue) <= 2
+    assert connection.frames_dropped == 3
+    connection.queue.clear()
+    #device 2 has not changed since the first frame, which was dropped, so it is sent again
+    assert queued_devices(fanout, connection, [1, 2], colours) == [1, 2]
+    assert queued_devices(fanout, connection, [1, 2], colours) is None
+
+def test_stalled_client_only_holds_up_itself(connect):
+    fanout = FanOut(queue_size=2).start()
+    reader, reader_side = connect()
+    stalled, stalled_side = connect()
+    stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    stalled_side.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    fanout.add(reader_side)
+    slow = fanout.add(stalled_side)
+    device_ids = np.arange(255)
+    colours = np.zeros((255, 4), dtype=np.uint8) #over a kilobyte a frame, soon filling the stalled client's socket buffers
+    decoder = FrameDecoder()
+    reader.settimeout(2)
+    try:
+        for tick in range(1000):
+            colours[:, 0] = tick % 256
+            fanout.publish_frame(device_ids, colours, encode)
+            frames = []
+            while not frames:
+                frames = decoder.feed(reader.recv(1 << 16))
+            assert int(frames[-1].colours[0, 0]) == tick % 256 #the reading client keeps up, frame by frame
+        stats = fanout.stats()
+        assert stats['clients'][0]['frames_dropped'] == 0
+        assert slow.stats()['queued'] <= 3 and slow.frames_dropped > 0
+    finally:
+        fanout.stop()
+
+def test_out_of_range_device_ids_are_left_out(connect):
+    fanout = FanOut()
+    connection = fanout.add(connect()[1])
+    assert queued_devices(fanout, connection, [1, 300, -1], np.full((3, 4), 5)) == [1]
+    assert fanout.stats()['devices_invalid'] == 2
+
+def test_tick_survives_a_failing_output():
+    class BrokenRecorder():
+        path = 'broken'
+        def write(self, timestamp, device_ids, frame):
+            raise OSError("disk full")
+    server = SyncServer(port=0, control_port=0, wire_format='binary', transition=0)
+    server.engine.add_device(300, 255, 0, 0, 255, 2, 'static') #past the command checks, as a bug elsewhere could
+    server.recorder = BrokenRecorder()
+    for tick in range(3):
+        server.tick()
+    stats = server.stats()
+    assert stats['output_errors'] == {'recording': 3} and stats['last_output_error'] == "recording: disk full"
+    assert stats['fanout']['devices_invalid'] == 3
+    server.fanout.stop()
@@ -0,0 +1,138 @@
+'''
+The shared memory frame ring, with a writer process racing a reader over many frames.
+'''
+
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pytest
+
+from rgbengine.framering import FrameRingWriter, FrameRingReader, RingError, READ_RETRIES
+
+FRAMES = 20000
+SLOT_COUNT = 4
+FRAME_SIZE = 65536
+
+def frame_for(sequence):
+    #every byte of a frame comes from its sequence, so a frame mixing two writes can't pass for either of them
+    frame = np.full(FRAME_SIZE, sequence % 251, dtype=np.uint8)
+    frame[:8] = np.frombuffer(np.uint64(sequence).tobytes(), dtype=np.uint8)
+    return frame
+
+def check(sequence, data):
+    frame = np.frombuffer(data, dtype=np.uint8)
+    assert len(frame) == FRAME_SIZE
+    assert int(frame[:8].view(np.uint64)[0]) == sequence
+    assert (frame[8:] == sequence % 251).all(), "torn read of frame " + str(sequence)
+
+@pytest.fixture
+def ring():
+    writer = FrameRingWriter('rgbtest' + str(os.getpid()), slot_count=SLOT_COUNT, slot_size=FRAME_SIZE)
+    reader = FrameRingReader(writer.name)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+def write_frames(name, slot_count, ready, finished):
+    #runs in its own process, so the reader really does race it instead of taking turns with it for the GIL
+    writer = FrameRingWriter(name, slot_count=slot_count, slot_size=FRAME_SIZE)
+    frames = [frame_for(sequence) for sequence in range(251)] #only the sequence in front changes between writes, so it can write flat out
+    ready.set()
+    for sequence in range(1, FRAMES + 1):
+        frame = frames[sequence % 251]
+        frame[:8] = np.frombuffer(np.uint64(sequence).tobytes(), dtype=np.uint8)
+        writer.write(frame)
+    finished.wait(30)
+    writer.close()
+
+@pytest.mark.parametrize('slot_count', [1, SLOT_COUNT]) #a single slot is rewritten by every frame, so most reads race a write
+def test_reader_racing_the_writer_only_sees_whole_frames(slot_count):
+    context = multiprocessing.get_context()
+    ready, finished = context.Event(), context.Event()
+    name = 'rgbrace' + str(os.getpid())
+    process = context.Process(target=write_frames, args=(name, slot_count, ready, finished))
+    process.start()
+    read = []
+    try:
+        assert ready.wait(30)
+        reader = FrameRingReader(name)
+        deadline = time.monotonic() + 30
+        while reader.last_sequence != FRAMES and time.monotonic() < deadline:
+            result = reader.read()
+            if result is not None:
+                sequence, data = result
+                check(sequence, data)
+                read.append(sequence)
+        assert reader.read() is None
+        reader.close()
+    finally:
+        finished.set()
+        process.join(30)
+
+    #the ring wrapped around thousands of times, and the reader saw frames in order up to the last one written
+    assert read == sorted(set(read)) and read[-1] == FRAMES
+    assert reader.skipped == read[-1] - read[0] + 1 - len(read)
+    assert process.exitcode == 0
+
+def frame_with(sequence):
+    #frame_for() checks whole frames, the frames below only need their sequence
+    return np.uint64(sequence).tobytes()
+
+class LappedBuffer(np.ndarray):
+    '''
+    A reader buffer that lets the writer lap the reader halfway through copying a frame, which a race only does now and then.
+    '''
+    def __setitem__(self, key, value):
+        half = len(value) // 2
+        self.view(np.ndarray)[:half] = value[:half]
+        while self.laps:
+            self.laps.pop()()
+        self.view(np.ndarray)[half:len(value)] = value[half:]
+
+def test_a_frame_overwritten_while_it_is_read_is_read_again(ring):
+    writer, reader = ring
+    writer.write(frame_for(1))
+    reader.buffer = reader.buffer.view(LappedBuffer)
+    #the first frame's slot is reused by the time the copy is done, so the copy mixes two frames
+    reader.buffer.laps = [lambda: [writer.write(frame_for(sequence)) for sequence in range(2, SLOT_COUNT + 2)]]
+    sequence, data = reader.read()
+    assert sequence == SLOT_COUNT + 1 and reader.retries == 1
+    check(sequence, data)
+
+def test_a_frame_being_written_is_not_read(ring):
+    writer, reader = ring
+    writer.write(frame_for(1))
+    #as a reader that saw the first frame as the newest finds its slot, if the writer has come round to it again
+    writer.stamps[1] = 2 * (1 + SLOT_COUNT) - 1
+    assert reader.read() is None and reader.retries == READ_RETRIES and reader.last_sequence == 0
+
+def test_a_reader_that_falls_behind_skips_to_the_newest_frame(ring):
+    writer, reader = ring
+    assert reader.read() is None
+    writer.write(frame_with(1))
+    assert reader.read()[0] == 1
+    for sequence in range(2, 3 * SLOT_COUNT + 2):
+        writer.write(frame_with(sequence))
+    sequence, data = reader.read()
+    assert sequence == 3 * SLOT_COUNT + 1 and bytes(data) == frame_with(sequence)
+    assert reader.skipped == 3 * SLOT_COUNT - 1
+
+def test_a_view_is_invalid_once_its_slot_is_reused(ring):
+    writer, reader = ring
+    writer.write(frame_with(1))
+    sequence, view = reader.view()
+    assert bytes(view) == frame_with(1) and reader.valid(sequence)
+    for sequence in range(2, SLOT_COUNT + 1):
+        writer.write(frame_with(sequence))
+    assert reader.valid(1)
+    writer.write(frame_with(SLOT_COUNT + 1)) #wraps around onto the first frame's slot
+    assert not reader.valid(1)
+    del view
+
+def test_frames_larger_than_a_slot_are_refused(ring):
+    writer, reader = ring
+    with pytest.raises(RingError):
+        writer.write(bytes(FRAME_SIZE + 1))
+    assert writer.sequence == 0 and reader.read() is None
@@ -0,0 +1,105 @@
+'''
+Keyframe patterns: the compiled tables against the keyframes they are interpolated from, their cache keys and saving them.
+'''
+
+import json
+
+import numpy as np
+import pytest
+
+from rgbengine.cli import main
+from rgbengine.cycles import CycleCache
+from rgbengine.keyframes import KeyframePattern, PatternError, EASINGS
+from rgbengine.profiles import ProfileStore, ProfileError
+
+DEFINITION = {
+    'keyframes': [
+        {'colour': [255, 40, 0], 'hold': 3, 'ease': 'smooth'},
+        {'colour': [120, 0, 160]},
+        {'colour': None, 'hold': 1, 'ease': 'step'},
+        {'colour': [0, 200, 30], 'ease': 'in'},
+    ],
+    'period': 23,
+    'ease': 'out',
+}
+
+def expected_colour(pattern, device_colour, updates):
+    #walks the keyframes one update at a time, independently of compile()'s row building
+    colours = [keyframe['colour'] if keyframe['colour'] is not None else device_colour for keyframe in pattern.keyframes]
+    for index, fades in enumerate(pattern.fades):
+        keyframe = pattern.keyframes[index]
+        if updates <= keyframe['hold']:
+            return colours[index]
+        updates -= keyframe['hold'] + 1
+        if updates < fades:
+            progress = float(EASINGS[keyframe['ease']](np.float32((updates + 1) / (fades + 1))))
+            start, end = colours[index], colours[(index + 1) % len(colours)]
+            return [round(a + (b - a) * progress) for a, b in zip(start, end)]
+        updates -= fades
+    return colours[-1] #only reached by patterns that don't loop
+
+@pytest.mark.parametrize('loop', [True, False])
+def test_compiled_table_matches_the_keyframes(loop):
+    pattern = KeyframePattern(dict(DEFINITION, loop=loop))
+    cycle = pattern.compile(10, 20, 30)
+    assert len(cycle) == (23 if loop else 24)
+    for updates in range(3 * len(cycle)):
+        #a looping pattern starts over, one that doesn't stays on its last keyframe
+        expected = expected_colour(pattern, [10, 20, 30], updates % 23 if loop else min(updates, 23))
+        assert np.abs(cycle.colours(updates)[:3].astype(int) - expected).max() <= 1, updates
+        assert cycle.colours(updates)[3] == 255
+
+def test_period_of_just_the_keyframes_cuts_between_them():
+    pattern = KeyframePattern({'keyframes': [{'colour': [255, 0, 0], 'hold': 1}, {'colour': [0, 0, 255]}]})
+    assert pattern.compile(0, 0, 0).table[:, :3].tolist() == [[255, 0, 0], [255, 0, 0], [0, 0, 255]]
+
+def test_cache_key_ignores_device_colour_only_when_unused():
+    cache = CycleCache()
+    fixed = KeyframePattern({'keyframes': [{'colour': [255, 0, 0]}, {'colour': [0, 0, 255]}], 'period': 10})
+    assert cache.key(fixed, 1, 2, 3, 255) == cache.key(fixed, 200, 100, 0, 10)
+    assert cache.get(fixed, 1, 2, 3, 255) is cache.get(fixed, 200, 100, 0, 10)
+    assert len(cache) == 1
+
+    follows = KeyframePattern({'keyframes': [{'colour': [255, 0, 0]}, {'colour': None}], 'period': 10})
+    assert cache.key(follows, 1, 2, 3, 255) == cache.key(follows, 1, 2, 3, 0) #alpha is never in the table
+    assert cache.key(follows, 1, 2, 3, 255) != cache.key(follows, 200, 100, 0, 255)
+    assert cache.get(follows, 200, 100, 0, 255).table[-1, :3].tolist() != cache.get(follows, 1, 2, 3, 255).table[-1, :3].tolist()
+
+def test_same_definition_shares_a_key_whatever_its_name():
+    #defaults are filled in before keying, so spelling them out doesn't make a new table
+    assert (KeyframePattern({'keyframes': [{'colour': [1, 2, 3]}]}).key
+            == KeyframePattern({'keyframes': [{'colour': [1, 2, 3], 'hold': 0, 'ease': 'linear'}], 'loop': True, 'period': 1}).key)
+
+@pytest.mark.parametrize('definition', [
+    {'keyframes': []},
+    {'keyframes': [{'colour': [256, 0, 0]}]},
+    {'keyframes': [{'colour': [1, 2]}]},
+    {'keyframes': [{'colour': [1, 2, 3], 'ease': 'bounce'}]},
+    {'keyframes': [{'colour': [1, 2, 3], 'hold': -1}]},
+    {'keyframes': [{'colour': [1, 2, 3], 'hold': 5}], 'period': 2},
+    {'keyframes': [{'colour': [1, 2, 3]}], 'loop': False},
+    {'keyframes': [{'colour': [1, 2, 3]}], 'loop': 'yes'},
+])
+def test_invalid_definitions_are_rejected(definition):
+    with pytest.raises(PatternError):
+        KeyframePattern(definition)
+
+def test_save_pattern_rejects_a_bad_definition(tmp_path, capsys):
+    store = ProfileStore(str(tmp_path))
+    with pytest.raises(ProfileError):
+        store.save_pattern('mine', {'keyframes': [{'colour': [300, 0, 0]}]})
+    with pytest.raises(ProfileError):
+        store.save_pattern('pulse', {'keyframes': [{'colour': [1, 2, 3]}]}) #a built in pattern's name
+    path = tmp_path / 'mine.json'
+    path.write_text(json.dumps({'keyframes': [{'colour': [1, 2, 3], 'ease': 'bounce'}]}))
+    assert main(['--save-pattern', 'mine', str(path), '--profiles', str(tmp_path)]) == 1
+    assert "could not save pattern mine" in capsys.readouterr().err
+    path.write_text("{not json")
+    assert main(['--save-pattern', 'mine', str(path), '--profiles', str(tmp_path)]) == 1
+    assert store.patterns() == {}
+
+def test_save_pattern_stores_the_filled_in_definition(tmp_path):
+    path = tmp_path / 'mine.json'
+    path.write_text(json.dumps({'keyframes': [{'colour': [1, 2, 3]}, {'colour': None, 'hold': 2}]}))
+    assert main(['--save-pattern', 'mine', str(path), '--profiles', str(tmp_path)]) == 0
+    assert ProfileStore(str(tmp_path)).patterns()['mine'] == KeyframePattern(json.loads(path.read_text())).definition()
@@ -0,0 +1,205 @@
+'''
+The pattern engine against a scalar port of the pattern functions in rgbsyncserver/server.cpp, one struct rgb at a time.
+'''
+
+import numpy as np
+import pytest
+
+from rgbengine.cycles import CycleCache, compute_cycles
+from rgbengine.patterns import PatternEngine, ALL_DEVICE_IDS, RAINBOW_KEYS, STROBE_HOLD
+
+RAINBOW = [tuple(int(value) for value in key) for key in RAINBOW_KEYS]
+
+class ScalarRgb():
+    '''
+    struct rgb and the pattern functions, line for line as in server.cpp.
+    '''
+    def __init__(self, device_id, r, g, b, a, speed, pattern):
+        self.device_id, self.r, self.g, self.b, self.a, self.speed, self.pattern = device_id, r, g, b, a, speed, pattern
+        self.initial_r, self.initial_g, self.initial_b = r, g, b
+        self.count, self.pulse, self.rainbow_index, self.changing = 0, 1, 0, 'g'
+        if pattern in ('rainbowcycle', 'fire'):
+            self.r, self.g, self.b = 255, 0, 0
+
+    def update(self):
+        if self.pattern == 'pulse':
+            self.pulse_pattern()
+        elif self.pattern == 'rainbowpulse':
+            self.pulse_pattern()
+            if self.r == 0 and self.g == 0 and self.b == 0 and self.count == 50:
+                self.rainbow_index = (self.rainbow_index + 1) % 7
+                self.initial_r, self.initial_g, self.initial_b = RAINBOW[self.rainbow_index]
+        elif self.pattern == 'rainbowcycle':
+            self.rainbow_cycle_pattern()
+        elif self.pattern == 'fire':
+            self.fire_pattern()
+
+    def pulse_pattern(self):
+        if self.r == self.initial_r and self.g == self.initial_g and self.b == self.initial_b:
+            self.r, self.g, self.b = max(0, self.initial_r - 1), max(0, self.initial_g - 1), max(0, self.initial_b - 1)
+            self.pulse = -1
+            return
+        if self.r == 0 and self.g == 0 and self.b == 0:
+            if self.count == 50:
+                self.r, self.g, self.b = min(1, self.initial_r), min(1, self.initial_g), min(1, self.initial_b)
+                self.pulse = 1
+                self.count = 0
+            else:
+                self.count += 1
+            return
+        values = []
+        for value, initial in ((self.r, self.initial_r), (self.g, self.initial_g), (self.b, self.initial_b)):
+            if value >= initial:
+                value = initial
+            elif value <= 0:
+                value = 0
+            else:
+                value += self.pulse
+            values.append(value)
+        self.r, self.g, self.b = values
+
+    def rainbow_cycle_pattern(self):
+        cases = (('r', 1, 'g', 'g', 'r'), ('g', -1, 'r', 'r', 'b'), ('g', 1, 'b', 'b', 'g'),
+                 ('b', -1, 'g', 'g', 'r'), ('b', 1, 'r', 'r', 'b'), ('r', -1, 'b', 'b', 'g'))
+        for full, pulse, changing, moving, next_changing in cases:
+            if getattr(self, full) == 255 and self.pulse == pulse and self.changing == changing:
+                value = getattr(self, moving) + pulse
+                setattr(self, moving, value)
+                if (pulse == 1 and value >= 255) or (pulse == -1 and value == 0):
+                    self.pulse = -pulse
+                    self.changing = next_changing
+                return
+
+    def fire_pattern(self):
+        if self.g >= 55:
+            self.pulse = -1
+            self.g = 54
+            return
+        if self.g == 0:
+            if self.count == 30:
+                self.count = 0
+                self.g = 1
+                self.pulse = 1
+            else:
+                self.count += 1
+            return
+        self.g += self.pulse
+
+def scalar_render(devices, ticks):
+    '''
+    server.cpp's main loop: every tick, the devices due at their speed are updated.
+    '''
+    rgbs = [ScalarRgb(*device) for device in devices]
+    medium_speed_count = low_speed_count = 0
+    frames = np.empty((ticks, len(rgbs), 4), dtype=np.uint8)
+    for tick in range(ticks):
+        for rgb in rgbs:
+            if rgb.speed == 2 or (rgb.speed == 1 and medium_speed_count == 1) or (rgb.speed == 0 and low_speed_count == 2):
+                rgb.update()
+        medium_speed_count = (medium_speed_count + 1) % 2
+        low_speed_count = (low_speed_count + 1) % 3
+        frames[tick] = [(rgb.r, rgb.g, rgb.b, rgb.a) for rgb in rgbs]
+    return frames
+
+DEVICES = [(device_id, r, g, b, a, speed, pattern)
+           for device_id, (pattern, (r, g, b)) in enumerate(
+               (pattern, colour) for pattern in ('static', 'pulse', 'rainbowpulse', 'rainbowcycle', 'fire', 'unknown')
+               for colour in ((255, 0, 0), (12, 200, 77), (1, 1, 1), (0, 0, 0), (255, 255, 255)))
+           for a, speed in ((255, device_id % 3),)]
+
+def args_of(devices):
+    return [value for device in devices for value in device]
+
+def test_engine_matches_server_cpp():
+    ticks = 9000 #long enough for rainbowpulse to go through its rainbow colours
+    assert np.array_equal(PatternEngine(args_of(DEVICES)).render(ticks), scalar_render(DEVICES, ticks))
+
+def test_cycle_cache_matches_state_machine():
+    ticks = 6000
+    cached = PatternEngine(args_of(DEVICES), cycle_cache=CycleCache(maxsize=len(DEVICES)))
+    assert np.array_equal(cached.render(ticks), PatternEngine(args_of(DEVICES)).render(ticks))
+    assert (cached.cycle_offset >= 0).all()
+
+def test_cycle_cache_real_time_steps_match():
+    cached = PatternEngine(args_of(DEVICES), cycle_cache=CycleCache())
+    engine = PatternEngine(args_of(DEVICES))
+    for elapsed in [0.05, 0.0166, 0.2, 0.001, 1.3] * 200:
+        cached.step(elapsed)
+        engine.step(elapsed)
+        assert np.array_equal(cached.frame(), engine.frame())
+
+def test_cycle_cache_counts_hits():
+    cache = CycleCache()
+    PatternEngine(args_of(DEVICES[:5]), cycle_cache=cache)
+    assert cache.stats()['misses'] == 5 and cache.stats()['hits'] == 0
+    PatternEngine(args_of(DEVICES[:5]), cycle_cache=cache)
+    assert cache.stats()['misses'] == 5 and cache.stats()['hits'] == 5
+
+def test_randomstrobe_is_not_cached():
+    with pytest.raises(ValueError):
+        compute_cycles([('randomstrobe', 255, 0, 0, 255)])
+
+def test_randomstrobe_holds_rainbow_colours():
+    frames = PatternEngine([1, 0, 0, 0, 255, 2, 'randomstrobe'], seed=1).render(10 * STROBE_HOLD)
+    colours = [tuple(int(value) for value in frame[0, :3]) for frame in frames]
+    assert all(colour in RAINBOW for colour in colours)
+    for start in range(0, len(colours), STROBE_HOLD):
+        assert len(set(colours[start:start + STROBE_HOLD])) == 1
+
+def test_seeded_engines_repeat():
+    args = [1, 0, 0, 0, 255, 2, 'randomstrobe', 2, 0, 0, 0, 255, 0, 'randomstrobe']
+    assert np.array_equal(PatternEngine(args, seed=7).render(500), PatternEngine(args, seed=7).render(500))
+
+def test_background_cycles_match_state_machine():
+    cache = CycleCache(maxsize=len(DEVICES))
+    engine = PatternEngine(args_of(DEVICES), cycle_cache=cache, wait_for_cycles=False)
+    reference = PatternEngine(args_of(DEVICES))
+    for tick in range(3000):
+        if tick == 700:
+            assert cache.wait(timeout=30)
+        engine.step(0.05)
+        reference.step(0.05)
+        assert np.array_equal(engine.frame(), reference.frame())
+    assert (engine.cycle_offset >= 0).all() #every device has moved onto its table
+
+def test_fixed_colour_patterns_share_tables():
+    cache = CycleCache()
+    PatternEngine([1, 255, 0, 0, 255, 2, 'rainbowcycle', 2, 0, 90, 4, 255, 2, 'rainbowcycle',
+                   3, 1, 2, 3, 255, 0, 'fire', 4, 200, 200, 200, 255, 1, 'fire'], cycle_cache=cache)
+    assert cache.stats()['size'] == 2
+
+def test_setting_a_device_splits_all():
+    engine = PatternEngine([0, 255, 0, 0, 255, 2, 'pulse', 3, 0, 0, 255, 255, 1, 'fire'])
+    reference = PatternEngine([0, 255, 0, 0, 255, 2, 'pulse'])
+    for tick in range(40):
+        engine.step()
+        reference.step()
+    engine.set_device(1, 0, 255, 0, 255, 2, 'static')
+    assert 0 not in engine.device_id.tolist() #clients paint every device with device 0, so it can't be sent next to device 1
+    assert sorted(engine.device_id.tolist()) == list(ALL_DEVICE_IDS)
+    for tick in range(40):
+        engine.step()
+        reference.step()
+        colours = dict(zip(engine.device_id.tolist(), engine.frame().tolist()))
+        assert colours[1] == [0, 255, 0, 255]
+        assert colours[3][0] == 255 and colours[3][2] == 0 #device 3 kept its own fire
+        for device_id in set(ALL_DEVICE_IDS) - {1, 3}:
+            assert colours[device_id] == reference.frame()[0].tolist() #the rest carry on with 'All' where it was
+
+def test_cycle_table_stays_bounded():
+    engine = PatternEngine([1, 255, 0, 0, 255, 2, 'pulse', 2, 0, 0, 255, 255, 1, 'static'], cycle_cache=CycleCache(maxsize=1000))
+    reference = PatternEngine([1, 255, 0, 0, 255, 2, 'pulse', 2, 0, 0, 255, 255, 1, 'static'])
+    for change in range(60):
+        colour = (change * 4 + 1, change % 7, 3)
+        for target in (engine, reference):
+            target.set_device(1, *colour, 255, 2, 'pulse') #a new table every time
+            target.step()
+        assert np.array_equal(engine.frame(), reference.frame())
+    playing = set(engine.cycle_offset.tolist())
+    used = sum(len(cycle.table) for offset, cycle in engine.cycle_offsets.values() if offset in playing)
+    largest = max(len(cycle.table) for offset, cycle in engine.cycle_offsets.values())
+    assert len(engine.cycle_table) <= 2 * used + largest #the tables left behind never outgrow the ones in use
+    for tick in range(600):
+        engine.step()
+        reference.step()
+    assert np.array_equal(engine.frame(), reference.frame())
@@ -0,0 +1,31 @@
+'''
+A device's own pattern wins over 'All' (device 0) wherever colours are sent: LED frames and transitions.
+The engine's own frames are covered in test_patterns.py.
+'''
+
+import numpy as np
+
+from rgbengine.leds import DEVICE_LAYOUTS, LedRenderer
+from rgbengine.patterns import PatternEngine, ALL_DEVICE_IDS
+from rgbengine.protocol import LENGTH, decode_frame
+from rgbengine.transitions import source_slots
+
+ALL_RED_KEYBOARD_GREEN = [0, 255, 0, 0, 255, 2, 'static', 1, 0, 255, 0, 255, 2, 'static']
+
+def test_all_devices_match_led_layouts():
+    assert sorted(DEVICE_LAYOUTS) == list(ALL_DEVICE_IDS)
+
+def test_led_frames_give_a_device_its_own_slot():
+    renderer = LedRenderer(PatternEngine(ALL_RED_KEYBOARD_GREEN))
+    frame = decode_frame(bytes(renderer.frame(1)[LENGTH.size:]))
+    assert frame.device_ids.tolist() == sorted(DEVICE_LAYOUTS)
+    for index, device_id in enumerate(frame.device_ids.tolist()):
+        colour = [0, 255, 0, 255] if device_id == 1 else [255, 0, 0, 255]
+        assert (frame.device_leds(index) == colour).all()
+
+def test_transitions_fade_from_a_devices_own_slot_first():
+    #outgoing has 'All' in slot 0 and the keyboard in slot 1
+    sources = source_slots([0, 1], [1, 2, 0, 300])
+    assert sources.tolist() == [1, 0, 0, 0]
+    assert source_slots([3], [1, 0]).tolist() == [-1, 0]
+    assert source_slots(np.zeros(0, dtype=np.int32), [1]).tolist() == [-1] #nothing was showing
@@ -0,0 +1,75 @@
+'''
+The profile store: importing the old profile files, caching profiles.json and writing it atomically.
+'''
+
+import json
+import os
+
+import pytest
+
+from rgbengine.profiles import ProfileStore, ProfileError, STORE_NAME, validate_device
+
+def test_legacy_profiles_are_imported(tmp_path):
+    (tmp_path / 'rgbprofile_1').write_text("0 255 0 0 255 1 pulse\n")
+    (tmp_path / 'rgbprofile_3').write_text("1 0 0 255 255 2 static\nnot a device line\n2 255 255 0 255 0 fire\n")
+    (tmp_path / 'rgbprofile_x').write_text("1 0 0 0 255 2 static\n")
+    (tmp_path / 'rgbprofile_settings').write_text("last_loaded_profile 3\n")
+    store = ProfileStore(str(tmp_path))
+    assert store.profile_ids() == [1, 3]
+    assert store.profile(3) == [['1', '0', '0', '255', '255', '2', 'static'], ['2', '255', '255', '0', '255', '0', 'fire']]
+    assert store.last_loaded_profile() == 3
+    #written out once, so the old files are never read again
+    assert json.loads((tmp_path / STORE_NAME).read_text())['profiles']['1'] == [['0', '255', '0', '0', '255', '1', 'pulse']]
+
+def test_nothing_to_import_writes_nothing(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    assert store.profile_ids() == [] and store.last_loaded_profile() is None
+    assert not (tmp_path / STORE_NAME).exists()
+
+def test_cache_is_read_again_when_the_file_changes(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    store.save_profile(1, [[1, 255, 0, 0, 255, 2, 'static']])
+    for lookup in range(10):
+        store.profile(1)
+    assert store.reads == 0 #its own write is the cache, nothing was read back
+
+    other = ProfileStore(str(tmp_path)) #e.g. --apply, in another process
+    other.save_profile(2, [[2, 0, 255, 0, 255, 1, 'pulse']])
+    stat = os.stat(store.path)
+    os.utime(store.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1)) #in case both writes land on the same mtime tick
+    assert store.profile_ids() == [1, 2] and store.reads == 1
+    assert store.profile(2) == [['2', '0', '255', '0', '255', '1', 'pulse']] and store.reads == 1
+
+def test_failed_write_leaves_the_file_as_it_was(tmp_path, monkeypatch):
+    store = ProfileStore(str(tmp_path))
+    store.save_profile(1, [[1, 255, 0, 0, 255, 2, 'static']])
+    def crash(data, file, **options):
+        file.write('{"version": 1, "profi') #half way through, as if the process died
+        raise OSError("disk full")
+    monkeypatch.setattr(json, 'dump', crash)
+    with pytest.raises(OSError):
+        store.save_profile(2, [[2, 0, 255, 0, 255, 1, 'pulse']])
+    monkeypatch.undo()
+    assert sorted(os.listdir(tmp_path)) == [STORE_NAME] #the temporary file is gone too
+    assert ProfileStore(str(tmp_path)).profile_ids() == [1]
+
+def test_broken_store_is_an_error(tmp_path):
+    (tmp_path / STORE_NAME).write_text('{"profiles": ')
+    with pytest.raises(ProfileError):
+        ProfileStore(str(tmp_path)).profile_ids()
+
+@pytest.mark.parametrize('values', [
+    [1, 255, 0, 0, 255, 2],
+    [1, 255, 0, 0, 255, 2, 'static', 'extra'],
+    [256, 255, 0, 0, 255, 2, 'static'],
+    [1, 255, -1, 0, 255, 2, 'static'],
+    [1, 255, 0, 0, 255, 3, 'static'],
+    [1, 'red', 0, 0, 255, 2, 'static'],
+    [1, 255, 0, 0, 255, 2, 'two words'],
+])
+def test_invalid_device_lines(values):
+    with pytest.raises(ProfileError):
+        validate_device(values)
+
+def test_valid_device_line_is_strings():
+    assert validate_device([0, 255, 0, 0, 255, 1, 'pulse']) == ['0', '255', '0', '0', '255', '1', 'pulse']
@@ -0,0 +1,66 @@
+'''
+Encoding and decoding the wire formats.
+'''
+
+import numpy as np
+import pytest
+
+from rgbengine.protocol import (FrameDecoder, LedFrameWriter, ProtocolError, LENGTH, FLAG_KEYFRAME,
+                                decode_frame, decode_message, encode_frame, encode_message)
+
+def test_legacy_message_is_server_cpp_bytes():
+    assert encode_message(1, 255, 0, 0, 255) == b'1 2550  0  255'
+    assert encode_message(12, 7, 80, 100, 0) == b'127  80 1000  '
+
+def test_legacy_round_trip():
+    for values in [(0, 0, 0, 0, 0), (6, 255, 255, 255, 255), (99, 1, 22, 133, 4)]:
+        assert decode_message(encode_message(*values)) == values
+
+def test_legacy_message_size_is_checked():
+    with pytest.raises(ProtocolError):
+        decode_message(b'1 255')
+
+def test_frame_round_trip():
+    device_ids = np.array([0, 1, 2, 255], dtype=np.uint8)
+    colours = np.arange(16, dtype=np.uint8).reshape(4, 4) * 15
+    data = encode_frame(device_ids, colours, 0x1_0000_0005, timestamp=123, flags=FLAG_KEYFRAME)
+    frame = decode_frame(data[LENGTH.size:])
+    assert frame.sequence == 5 #sequences wrap at 32 bits
+    assert frame.timestamp == 123
+    assert frame.keyframe and not frame.has_leds
+    assert np.array_equal(frame.device_ids, device_ids)
+    assert np.array_equal(frame.colours, colours)
+    assert frame.devices()[1] == (1, 60, 75, 90, 105)
+
+def test_empty_frame_round_trip():
+    frame = decode_frame(encode_frame([], np.zeros((0, 4), dtype=np.uint8), 1)[LENGTH.size:])
+    assert len(frame) == 0
+
+def test_decoder_reassembles_any_split():
+    frames = [encode_frame([1, 2], [[index, 0, 0, 255], [0, index, 0, 255]], index) for index in range(5)]
+    stream = b''.join(frames)
+    for chunk in (1, 3, 7, len(stream)):
+        decoder = FrameDecoder()
+        decoded = []
+        for start in range(0, len(stream), chunk):
+            decoded += decoder.feed(stream[start:start + chunk])
+        assert [frame.sequence for frame in decoded] == list(range(5))
+        assert [frame.devices()[1][2] for frame in decoded] == list(range(5))
+
+def test_led_frame_round_trip():
+    writer = LedFrameWriter([1, 6], [3, 2])
+    data, leds = writer.allocate(9, timestamp=1)
+    leds[:] = np.arange(20, dtype=np.uint8).reshape(5, 4)
+    frame = decode_frame(bytes(data[LENGTH.size:]))
+    assert frame.has_leds and frame.sequence == 9
+    assert frame.device_ids.tolist() == [1, 6]
+    assert np.array_equal(frame.device_leds(0), np.arange(12).reshape(3, 4))
+    assert np.array_equal(frame.device_leds(1), np.arange(12, 20).reshape(2, 4))
+    assert frame.devices() == []
+
+def test_damaged_frames_are_rejected():
+    data = encode_frame([1], [[1, 2, 3, 4]], 1)
+    with pytest.raises(ProtocolError):
+        decode_frame(data[LENGTH.size:-1])
+    with pytest.raises(ProtocolError):
+        decode_frame(b'\x09' + data[LENGTH.size + 1:])
@@ -0,0 +1,57 @@
+'''
+The Razer bridge against the mock Chroma SDK, driven by a server's frames.
+'''
+
+import time
+
+import pytest
+
+from rgbengine.chromamock import MockChromaServer
+from rgbengine.control import EngineControl
+from rgbengine.razer import RazerBridge, SESSION_RETRIES, bgr
+from rgbengine.server import SyncServer
+
+@pytest.fixture
+def bridged():
+    with MockChromaServer() as mock:
+        bridges = []
+        def factory(host, port, legacy):
+            bridges.append(RazerBridge(host, port, legacy, url=mock.url, heartbeat_interval=0.05))
+            return bridges[-1]
+        server = SyncServer(port=0, control_port=0, transition=0, bridges=[factory]).start()
+        control = EngineControl(port=server.control_port)
+        control.connect(timeout=5)
+        try:
+            yield mock, bridges[0], control
+        finally:
+            control.close()
+            server.stop()
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_colours_reach_the_sdk(bridged):
+    mock, bridge, control = bridged
+    control.load_profile([0, 255, 0, 0, 255, 2, 'static', 2, 0, 0, 255, 255, 2, 'static'])
+    assert mock.wait_for_colour('keyboard', bgr(255, 0, 0)) and mock.wait_for_colour('headset', bgr(255, 0, 0))
+    assert mock.wait_for_colour('mouse', bgr(0, 0, 255))
+    assert bridge.errors == 0 and mock.stats()['sessions'] == 1
+
+def test_a_new_session_is_started_once_the_sdk_ends_ours(bridged):
+    mock, bridge, control = bridged
+    control.load_profile([1, 255, 0, 0, 255, 2, 'static'])
+    assert mock.wait_for_colour('keyboard', bgr(255, 0, 0))
+    mock.end_sessions()
+    #the colour isn't changing, so the failing heartbeats are what notice, and the keyboard gets its colour again in the new session
+    assert mock.wait_for_colour('keyboard', bgr(255, 0, 0))
+    assert bridge.reopened == 1 and bridge.errors == SESSION_RETRIES and mock.stats()['sessions'] == 1
+    assert wait_until(lambda: bridge.failures == 0)
+
+    control.load_profile([1, 0, 255, 0, 255, 2, 'static'])
+    assert mock.wait_for_colour('keyboard', bgr(0, 255, 0))
+    assert bridge.reopened == 1 and bridge.stats()['reopened'] == 1
@@ -0,0 +1,75 @@
+'''
+Writing, reading, replaying and verifying recordings.
+'''
+
+import json
+
+import numpy as np
+import pytest
+
+from rgbengine.recording import (Player, Recorder, Recording, RecordingError, DEFAULT_TICK, FILE_HEADER, SEGMENT_HEADER, TIMESTAMP,
+                                 record_dtype, record_patterns, verify_recording)
+
+def test_write_and_read(tmp_path):
+    path = str(tmp_path / 'frames.rgbrec')
+    frames = [(index * DEFAULT_TICK, [1, 2], np.full((2, 4), index, dtype=np.uint8)) for index in range(3)]
+    frames.append((3 * DEFAULT_TICK, [1], np.full((1, 4), 3, dtype=np.uint8))) #the devices changed, so a new segment
+    with Recorder(path, {'note': 'test'}) as recorder:
+        for frame in frames:
+            recorder.write(*frame)
+    with Recording(path) as recording:
+        assert recording.metadata == {'note': 'test'}
+        assert len(recording) == 4 and len(recording.segments) == 2
+        for (timestamp, device_ids, colours), (read_timestamp, read_ids, read_colours) in zip(frames, recording.frames()):
+            assert timestamp == read_timestamp
+            assert list(device_ids) == read_ids.tolist()
+            assert np.array_equal(colours, read_colours)
+
+def test_unfinished_recording_is_readable(tmp_path):
+    path = str(tmp_path / 'killed.rgbrec')
+    recorder = Recorder(path)
+    for index in range(5):
+        recorder.write(index, [1], [[index, 0, 0, 255]])
+    recorder.file.flush() #no close(), as if the recorder was killed
+    with Recording(path) as recording:
+        assert len(recording) == 5
+    recorder.close()
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'not a recording at all')
+    with pytest.raises(RecordingError):
+        Recording(str(path))
+
+def test_player_follows_pattern_time(tmp_path):
+    path = str(tmp_path / 'frames.rgbrec')
+    with Recorder(path) as recorder:
+        for index in range(4):
+            recorder.write(index * DEFAULT_TICK, [1], [[index, 0, 0, 255]])
+    with Recording(path) as recording:
+        player = Player(recording, loop=True)
+        seconds = DEFAULT_TICK / 1e9
+        shown = [int(player.advance(seconds)[1][0, 0]) for tick in range(9)]
+        assert shown == [0, 1, 2, 3, 0, 1, 2, 3, 0]
+
+def test_golden_recording_verifies(tmp_path):
+    path = str(tmp_path / 'golden.rgbrec')
+    args = [1, 255, 0, 0, 255, 2, 'pulse', 2, 0, 0, 0, 255, 1, 'randomstrobe', 6, 0, 0, 0, 255, 0, 'rainbowcycle']
+    assert record_patterns(path, args, 400, seed=3) == 400
+    assert verify_recording(path) is None
+    assert record_patterns(path, args, 400, fps=30, seed=3) == 400
+    assert verify_recording(path) is None
+
+def test_verify_reports_first_difference(tmp_path):
+    path = str(tmp_path / 'golden.rgbrec')
+    record_patterns(path, [1, 255, 0, 0, 255, 2, 'pulse'], 50)
+    with Recording(path) as recording:
+        metadata_length = len(json.dumps(recording.metadata).encode())
+    #the red value of the one device in the 21st record of the only segment
+    offset = FILE_HEADER.size + metadata_length + SEGMENT_HEADER.size + 1 + 20 * record_dtype(1).itemsize + TIMESTAMP.size
+    with open(path, 'r+b') as file:
+        file.seek(offset)
+        file.write(bytes([7]))
+    index, device_ids, recorded, rendered = verify_recording(path)
+    assert index == 20 and device_ids.tolist() == [1]
+    assert recorded[0, 0] == 7 and rendered[0, 0] != 7
@@ -0,0 +1,94 @@
+'''
+Control commands as the server's tick loop applies them, without starting the server.
+'''
+
+import socket
+import time
+
+import pytest
+
+from rgbengine.control import EngineControl, EngineError
+from rgbengine.discovery import Backend, DiscoveryCache
+from rgbengine.protocol import FrameDecoder
+from rgbengine.server import SyncServer, RELEASED_COLOUR
+
+@pytest.mark.parametrize('request_', [
+    {'command': 'load-profile', 'args': [1, 2, 3], 'patterns': {'mine': {'keyframes': [{'colour': [1, 2, 3]}]}}},
+    {'command': 'set-device-pattern', 'args': [1, 'red', 0, 0, 255, 2, 'static'], 'transition': 1},
+    {'command': 'set-device-pattern', 'args': [1, 0, 0, 0, 255, 2, 'static'], 'transition': -1},
+    {'command': 'clear-device', 'device_id': 'keyboard'},
+    {'command': 'set-device-pattern', 'args': [1, 0, 0, 0, 255, 7, 'static']},
+    {'command': 'set-device-pattern', 'args': [1, 256, 0, 0, 255, 2, 'static']},
+    {'command': 'load-profile', 'args': [1, 0, 0, 0, 255, 2, 'static', 300, 0, 0, 0, 255, 2, 'static']},
+    {'command': 'set-device-pattern', 'args': [100, 0, 0, 0, 255, 2, 'static']}, #legacy device ids are two digits
+])
+def test_invalid_commands_change_nothing(request_):
+    server = SyncServer(port=0, control_port=0)
+    server._apply({'command': 'load-profile', 'args': [1, 255, 0, 0, 255, 2, 'pulse'], 'transition': 0})
+    with pytest.raises(ValueError):
+        server._apply(request_)
+    assert server.engine.devices == [(1, 255, 0, 0, 255, 2, 'pulse')]
+    assert server.engine.patterns == {} and server.transition is None
+
+def test_out_of_range_device_is_an_error_reply():
+    server = SyncServer(port=0, control_port=0, wire_format='binary', transition=0).start()
+    try:
+        control = EngineControl(port=server.control_port)
+        control.connect(timeout=5)
+        with pytest.raises(EngineError, match="out of range"):
+            control.request('set-device-pattern', args=[300, 255, 0, 0, 255, 2, 'static'])
+        assert control.request('set-device-pattern', args=[200, 255, 0, 0, 255, 2, 'static'])['devices'] == 1
+        assert control.request('ping')['ok']
+        control.close()
+    finally:
+        server.stop()
+
+def test_cleared_devices_are_sent_off_once():
+    listener = socket.create_server(('127.0.0.1', 0))
+    client = socket.create_connection(listener.getsockname())
+    server = SyncServer(port=0, control_port=0, wire_format='binary', transition=0)
+    connection = server.fanout.add(listener.accept()[0]) #the fan-out is never started, so the frames stay in its queue
+    def tick():
+        connection.queue.clear()
+        server.tick()
+        return {device_id: colour for data, queued in connection.queue for frame in FrameDecoder().feed(bytes(data))
+                for device_id, *colour in frame.devices()}
+    try:
+        server._apply({'command': 'load-profile', 'args': [0, 255, 0, 0, 255, 2, 'static', 3, 0, 0, 255, 255, 2, 'static']})
+        tick()
+        server._apply({'command': 'clear-device', 'device_id': 1})
+        sent = tick()
+        #the rest of 'All' carries on as devices of their own, sent once as they are new to the client
+        assert sent == {1: list(RELEASED_COLOUR), 2: [255, 0, 0, 255], 4: [255, 0, 0, 255], 5: [255, 0, 0, 255], 6: [255, 0, 0, 255]}
+        assert sorted(server.engine.device_id.tolist()) == [2, 3, 4, 5, 6]
+        assert tick() == {}
+        server._apply({'command': 'clear-device', 'device_id': 0})
+        assert tick() == {device_id: list(RELEASED_COLOUR) for device_id in (0, 2, 3, 4, 5, 6)} and len(server.engine) == 0
+    finally:
+        server.fanout.stop()
+        client.close()
+        listener.close()
+
+def test_backends_that_turn_up_later_are_started(tmp_path):
+    client = tmp_path / 'client.sh'
+    client.write_text('#!/bin/sh\nsleep 5\n')
+    client.chmod(0o755)
+    running = []
+    backend = Backend('late', 'client.sh', lambda timeout: (bool(running), None, "running" if running else "not running"), ['keyboard'])
+    server = SyncServer(port=0, control_port=0, cwd=str(tmp_path), backends=[backend], rediscover_interval=0.05,
+                        discovery_cache=DiscoveryCache(str(tmp_path), negative_ttl=0)).start()
+    try:
+        assert server.backends_started == set() and server.processes == []
+        running.append(True) #the vendor's software has been started
+        deadline = time.monotonic() + 5
+        while not server.processes and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert server.backends_started == {'late'} and len(server.processes) == 1
+        control = EngineControl(port=server.control_port)
+        control.connect(timeout=5)
+        assert control.discover()['started'] == [] #already running
+        control.close()
+    finally:
+        server.stop()
+        for process in server.processes:
+            process.kill()
@@ -0,0 +1,101 @@
+'''
+Cross-fades between patterns: the blend, the limit on nested transitions, Stills, and fading every LED of the leds wire format.
+'''
+
+import numpy as np
+
+from rgbengine.leds import LedRenderer
+from rgbengine.patterns import PatternEngine
+from rgbengine.protocol import LENGTH, decode_frame
+from rgbengine.server import SyncServer
+from rgbengine.transitions import Transition, Still, MAX_TRANSITIONS, ease, snapshot
+
+RED = [1, 255, 0, 0, 255, 2, 'static']
+BLUE = [1, 0, 0, 255, 255, 2, 'static']
+WAVE = [0, 0, 255, 0, 255, 2, 'wave']
+
+def blend(incoming, outgoing, weight):
+    incoming, outgoing = np.asarray(incoming, dtype=np.float64), np.asarray(outgoing, dtype=np.float64)
+    return np.rint(incoming + (outgoing - incoming) * weight).astype(int)
+
+def test_blend_follows_the_eased_progress():
+    transition = Transition(PatternEngine(RED), PatternEngine(BLUE + [2, 0, 255, 0, 128, 2, 'static']), 1.0)
+    assert transition.weight == 1
+    for step in range(4):
+        transition.step(0.25)
+        weight = 1 - ease(0.25 * (step + 1))
+        assert transition.weight == weight
+        #the mouse had nothing to fade from, so it shows straight away
+        assert transition.frame().tolist() == [blend([0, 0, 255, 255], [255, 0, 0, 255], weight).tolist(), [0, 255, 0, 128]]
+    assert transition.done and transition.weight == 0
+    assert transition.frame().tolist() == [[0, 0, 255, 255], [0, 255, 0, 128]]
+
+def test_snapshot_carries_on_like_the_engine():
+    engine = PatternEngine([1, 255, 0, 0, 255, 0, 'pulse', 2, 0, 0, 0, 255, 2, 'randomstrobe'], seed=3)
+    engine.step(0.4)
+    outgoing = snapshot(engine)
+    for _ in range(50):
+        engine.step(0.05)
+        outgoing.step(0.05)
+        assert np.array_equal(outgoing.frame(), engine.frame())
+
+def test_nested_transitions_are_capped_with_a_still():
+    showing = PatternEngine(RED)
+    for change in range(MAX_TRANSITIONS + 3):
+        showing = Transition(showing, PatternEngine([1, change, 0, 0, 255, 2, 'static']), 10.0)
+        assert showing.depth() == min(change + 1, MAX_TRANSITIONS)
+    oldest = showing
+    while isinstance(oldest.outgoing, Transition):
+        oldest = oldest.outgoing
+    assert isinstance(oldest.outgoing, Still)
+
+def test_still_is_frozen_on_the_frame_it_was_taken_from():
+    engine = PatternEngine([1, 255, 0, 0, 255, 0, 'pulse'])
+    engine.step(0.3)
+    still = Still(engine)
+    frame = engine.frame()
+    for _ in range(20):
+        engine.step(0.05)
+        still.step(0.05)
+        assert still.frame().tolist() == frame.tolist()
+    assert not np.array_equal(engine.frame(), frame)
+    out = np.zeros_like(frame)
+    assert still.frame(out) is out and out.tolist() == frame.tolist()
+
+def rendered(renderer, seconds, fade=0):
+    return decode_frame(bytes(renderer.frame(0, seconds=seconds, fade=fade)[LENGTH.size:])).leds.astype(int)
+
+def test_spatial_patterns_fade_led_by_led():
+    engine = PatternEngine(RED)
+    renderer = LedRenderer(engine)
+    before = rendered(renderer, 0.0) #only the keyboard is shown
+    renderer.freeze()
+    engine.set_patterns(WAVE)
+    expected = rendered(LedRenderer(PatternEngine(WAVE)), 0.3)
+
+    faded = rendered(renderer, 0.3, fade=0.25)
+    keyboard = len(before)
+    #the keyboard fades from the red it was showing, every other device had nothing to fade from
+    assert np.abs(faded[:keyboard] - blend(expected[:keyboard], before, 0.25)).max() <= 1
+    assert np.array_equal(faded[keyboard:], expected[keyboard:])
+
+    assert np.array_equal(rendered(renderer, 0.3), expected) #the fade is over
+    assert renderer.still is None
+
+def test_leds_wire_format_fades_spatial_patterns(monkeypatch):
+    server = SyncServer(port=0, control_port=0, wire_format='leds', transition=1.0)
+    sent = []
+    monkeypatch.setattr(server.fanout, 'publish', lambda data: sent.append(decode_frame(bytes(data[LENGTH.size:]))))
+    server._apply({'command': 'load-profile', 'args': RED, 'transition': 0})
+    server.tick(0.05)
+    server._apply({'command': 'load-profile', 'args': WAVE})
+    keyboard = []
+    while server.transition is not None:
+        server.tick(0.05)
+        keyboard.append(sent[-1].device_leds(0).astype(int))
+    assert sent[-1].device_ids.tolist() == [1, 2, 3, 4, 5, 6]
+    #starts from the red the keyboard was showing, and is the wave by the end
+    assert np.abs(keyboard[0][:, 0] - 255).max() < 10 and keyboard[0][:, 1].max() < 10
+    assert keyboard[-1][:, 0].max() == 0 and keyboard[-1][:, 1].max() > 200
+    reds = [int(frame[:, 0].mean()) for frame in keyboard]
+    assert reds == sorted(reds, reverse=True)